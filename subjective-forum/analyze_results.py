@@ -4,42 +4,37 @@ Script to analyze listening test results.
 """
 import os
 import json
-import glob
 import argparse
 from pathlib import Path
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import seaborn as sns
+
+# numpy, pandas, matplotlib and seaborn are imported inside the functions that
+# need them, so --help and argument errors return without loading them
+from utils.telemetry import load_telemetry, summarize_events
+from utils.ratings import ratings_table, zscores, summarize_by, reliability, participant_consistency
+from utils.screening import filter_results, screen_result
+from utils.mixed_effects import fit_mixed_models
+from utils.report import write_report
+from utils.exports import iter_result_files, iter_rows, write_rows
+from utils.metric_names import MetricCatalog
+from utils.saver import read_result, result_paths
+
+# Metric IDs, names and labels of the configs (--config) and result headers seen so far
+METRIC_NAMES = MetricCatalog()
 
 def translate_metric_name(chinese_name):
     """
-    Extract English metric names from Chinese names with English in parentheses.
+    Display label of a stored metric name or ID.
+    
+    Lookups are memoized, so this is cheap per rating. Names without an
+    English part are returned as they are.
     
     Args:
-        chinese_name: Metric name in format "中文（English）"
+        chinese_name: Metric name in format "中文（English）", or a metric ID
         
     Returns:
-        English metric name
-    """
-    # Check if the name contains parentheses with English translation
-    if '（' in chinese_name and '）' in chinese_name:
-        # Extract the English part from parentheses
-        start = chinese_name.find('（') + 1
-        end = chinese_name.find('）')
-        return chinese_name[start:end]
-    else:
-        raise NotImplementedError(f"Metric name {chinese_name} not implemented")
-    
-    # # Fallback to original translation dictionary for other cases
-    # translations = {
-    #     '效果評價（整體）': 'Overall Effect',
-    #     '音質評價（清晰度）': 'Audio Quality (Clarity)',
-    #     '自然度評價（流暢度）': 'Naturalness (Fluency)',
-    #     '情感表達評價': 'Emotional Expression'
-    # }
-    
-    # return translations.get(chinese_name, chinese_name)
+        English metric name, e.g. "Overall Rating"
+    """
+    return METRIC_NAMES.label(chinese_name)
 
 def load_results(results_dir):
     """
@@ -52,11 +47,11 @@ def load_results(results_dir):
         List of result dictionaries
     """
     results = []
-    for file_path in glob.glob(os.path.join(results_dir, '*.json')):
+    for file_path in result_paths(results_dir):
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                results.append(json.load(f))
-        except (json.JSONDecodeError, IOError) as e:
+            results.append(read_result(file_path))
+            METRIC_NAMES.register_header(results[-1].get('metrics'))
+        except (ValueError, IOError) as e:
             print(f"Error loading {file_path}: {e}")
     
     return results
@@ -169,6 +164,7 @@ def calculate_statistics(metrics_data):
     Returns:
         Dictionary mapping models to metric statistics
     """
+    import numpy as np
     stats = {}
     
     for model_name, data in metrics_data.items():
@@ -199,6 +195,10 @@ def plot_metrics_by_template(template_metrics_data, output_dir):
         template_metrics_data: Dictionary mapping template_id to metrics data
         output_dir: Directory to save plots
     """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+
     # Set seaborn style
     sns.set_theme(style="whitegrid")
     sns.set_context("talk")  # Increase font sizes for labels
@@ -250,6 +250,10 @@ def plot_metrics(stats, metrics_data, output_dir):
         metrics_data: Raw metrics data
         output_dir: Directory to save plots
     """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+
     # Set seaborn style
     sns.set_theme(style="whitegrid")
     sns.set_context("talk")  # Increase font sizes for labels
@@ -403,6 +407,7 @@ def export_mos_by_template(template_metrics_data, output_file):
         template_metrics_data: Dictionary mapping template_id to model metrics data
         output_file: Path to output MOS CSV file
     """
+    import numpy as np
     with open(output_file, 'w', encoding='utf-8') as f:
         # Write header
         f.write("template_id,model,MOS,std,rating_count\n")
@@ -463,6 +468,222 @@ def export_csv_by_template(template_stats, output_file):
                             f"{metric_stats['min']:.0f},{metric_stats['max']:.0f},"
                             f"{metric_stats['count']},{mos:.2f}\n")
 
+def analyze_reliability(results, output_dir):
+    """
+    Normalize ratings per participant and measure inter-rater reliability.
+
+    Exports z-scored ratings per template, model and metric (harsh and lenient
+    raters no longer inflate the spread), Krippendorff's alpha and the ICC per
+    template and metric, and a consistency score per participant.
+    
+    Args:
+        results: List of result dictionaries
+        output_dir: Directory to write the CSV files to
+    """
+    import numpy as np
+    table = ratings_table(results, translate_metric_name)
+    print(f"\n=== Rater Normalization and Reliability ({table.size('participant')} participants, "
+          f"{len(table)} ratings) ===\n")
+    if not len(table):
+        return
+
+    z_rows = summarize_by(table, zscores(table))
+    z_csv = os.path.join(output_dir, 'zscores_by_template.csv')
+    with open(z_csv, 'w', encoding='utf-8') as f:
+        f.write("template_id,model,metric,mean_z,std_z,ci_low,ci_high,count\n")
+        for row in z_rows:
+            f.write(f"{row['template']},{row['model']},{row['metric']},{row['mean']:.3f},{row['std']:.3f},"
+                    f"{row['ci_low']:.3f},{row['ci_high']:.3f},{row['count']}\n")
+
+    reliability_rows = reliability(table)
+    print(f"{'template':<12}{'metric':<24}{'raters':>8}{'items':>7}{'alpha':>8}{'ICC(1)':>8}{'ICC(1,k)':>10}")
+    for row in reliability_rows:
+        print(f"{row['template']:<12}{row['metric']:<24}{row['raters']:>8}{row['items']:>7}"
+              f"{row['alpha']:>8.3f}{row['icc1']:>8.3f}{row['icc1k']:>10.3f}")
+    reliability_csv = os.path.join(output_dir, 'reliability.csv')
+    with open(reliability_csv, 'w', encoding='utf-8') as f:
+        f.write("template_id,metric,raters,items,ratings,krippendorff_alpha,icc1,icc1k\n")
+        for row in reliability_rows:
+            f.write(f"{row['template']},{row['metric']},{row['raters']},{row['items']},{row['ratings']},"
+                    f"{row['alpha']:.4f},{row['icc1']:.4f},{row['icc1k']:.4f}\n")
+
+    # Least consistent first. The correlation is NaN when it cannot be computed: no item
+    # shared with another participant, or constant ratings on the shared items. Those
+    # rows say nothing about consistency, so they are listed separately and sorted last.
+    consistency_rows = sorted(participant_consistency(table),
+                              key=lambda row: (np.isnan(row['consistency']), row['consistency']))
+    computable = [row for row in consistency_rows if not np.isnan(row['consistency'])]
+    print("\nLeast consistent participants (correlation with the other participants):")
+    for row in computable[:5]:
+        print(f"  {row['participant']}: r={row['consistency']:.2f}, "
+              f"mean |deviation|={row['mean_abs_deviation']:.2f}, rating SD={row['rating_std']:.2f}")
+    not_computable = consistency_rows[len(computable):]
+    if not_computable:
+        print(f"Consistency not computable for {len(not_computable)} participants:")
+        for row in not_computable[:5]:
+            reason = "no items shared with others" if not row['compared'] else "constant ratings"
+            print(f"  {row['participant']}: {reason} ({row['compared']} of {row['ratings']} ratings compared)")
+    consistency_csv = os.path.join(output_dir, 'participant_consistency.csv')
+    with open(consistency_csv, 'w', encoding='utf-8') as f:
+        f.write("participant,ratings,compared,consistency,mean_abs_deviation,rating_std\n")
+        for row in consistency_rows:
+            f.write(f"{row['participant']},{row['ratings']},{row['compared']},{row['consistency']:.4f},"
+                    f"{row['mean_abs_deviation']:.4f},{row['rating_std']:.4f}\n")
+    print(f"\nExported normalized ratings and reliability to {output_dir}")
+
+def analyze_mixed_effects(results, output_dir, workers=None):
+    """
+    Fit rating ~ model + (1|participant) + (1|prompt) per template and metric.
+
+    Unlike the MOS, the model estimates account for which participants and
+    prompts happened to rate each model.
+    
+    Args:
+        results: List of result dictionaries
+        output_dir: Directory to write mixed_effects.csv to
+        workers: Worker processes fitting templates and metrics in parallel
+
+    Returns:
+        Rows of fit_mixed_models, for the HTML report
+    """
+    table = ratings_table(results, translate_metric_name)
+    if not len(table):
+        return []
+    rows = fit_mixed_models(table, workers)
+
+    print("\n=== Mixed-Effects Model Estimates (REML, 95% CI) ===\n")
+    previous = None
+    for row in rows:
+        if (row['template'], row['metric']) != previous:
+            previous = (row['template'], row['metric'])
+            if row['error']:
+                print(f"{row['template']} / {row['metric']}: {row['ratings']} ratings, not fitted ({row['error']})")
+            else:
+                print(f"{row['template']} / {row['metric']}: {row['ratings']} ratings, "
+                      f"SD participant={row['sd_participant']:.2f}, prompt={row['sd_prompt']:.2f}, "
+                      f"residual={row['sd_residual']:.2f}" + ("" if row['converged'] else " (not converged)"))
+        if not row['error']:
+            print(f"    {row['model']:<16}{row['estimate']:.2f} [{row['ci_low']:.2f}, {row['ci_high']:.2f}]")
+
+    csv_path = os.path.join(output_dir, 'mixed_effects.csv')
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write("template_id,metric,model,estimate,se,ci_low,ci_high,ratings,participants,prompts,"
+                "sd_participant,sd_prompt,sd_residual,converged\n")
+        for row in rows:
+            f.write(f"{row['template']},{row['metric']},{row['model']},{row['estimate']:.4f},{row['se']:.4f},"
+                    f"{row['ci_low']:.4f},{row['ci_high']:.4f},{row['ratings']},{row['participants']},"
+                    f"{row['prompts']},{row['sd_participant']:.4f},{row['sd_prompt']:.4f},"
+                    f"{row['sd_residual']:.4f},{row['converged']}\n")
+    print(f"\nExported mixed-effects estimates to {csv_path}")
+    return rows
+
+def analyze_report(results, output_dir, mixed_rows=None, title='Listening Test Results'):
+    """
+    Write all statistics to one self-contained HTML report.
+
+    MOS with confidence intervals, z-scores, rating histograms and reliability
+    are computed in one pass over the ratings, and the charts are inline SVG,
+    so this replaces the PNG plots and CSV files for sharing.
+    
+    Args:
+        results: List of result dictionaries
+        output_dir: Directory to write report.html to
+        mixed_rows: Mixed-effects rows from analyze_mixed_effects, if fitted
+        title: Report title
+    """
+    table = ratings_table(results, translate_metric_name)
+    report_path = os.path.join(output_dir, 'report.html')
+    size = write_report(table, report_path, mixed_rows, title)
+    print(f"Wrote HTML report to {report_path} ({size / 1024:.0f} KiB)")
+
+def analyze_telemetry(telemetry_dir, output_dir):
+    """
+    Summarize client timing telemetry and export it next to the rating statistics.
+
+    Clip events are grouped by clip, by model (from the clip filename), by served
+    format and by network class, so slow or stalling clips and encodings can be
+    compared with how they were rated.
+    
+    Args:
+        telemetry_dir: Directory with telemetry_<pid>.jsonl files
+        output_dir: Directory to write telemetry CSV files to
+    """
+    import pandas as pd
+    events = load_telemetry(telemetry_dir)
+    clip_events = [e for e in events if e.get('type') == 'clip']
+    page_events = [e for e in events if e.get('type') == 'page']
+    print(f"Loaded {len(clip_events)} clip and {len(page_events)} page telemetry events")
+    if not events:
+        return
+
+    for event in clip_events:
+        # Clip paths look like "task_1/001_gt.mp3"
+        filename = os.path.basename(event['clip'])
+        event['model'] = os.path.splitext(filename)[0].split('_', 1)[-1]
+
+    groups = {
+        'clip': summarize_events(clip_events, 'clip'),
+        'model': summarize_events(clip_events, 'model'),
+        'format': summarize_events(clip_events, 'format'),
+        'network': summarize_events(clip_events + page_events, 'network'),
+        'template': summarize_events(page_events, 'template'),
+    }
+
+    print("\n=== Client Timing Telemetry (ms) ===\n")
+    for group in ('network', 'format', 'model'):
+        print(f"By {group}:")
+        for key, fields in groups[group].items():
+            parts = [f"{field} p50={s['p50']:.0f} p90={s['p90']:.0f}" for field, s in fields.items()
+                     if field in ('ttfb', 'load', 'stallMs', 'pageTime') and s['count']]
+            print(f"  {key}: {', '.join(parts)}")
+        print()
+
+    worst = sorted(
+        ((key, fields['load']['p90']) for key, fields in groups['clip'].items() if 'load' in fields),
+        key=lambda item: item[1], reverse=True
+    )[:10]
+    if worst:
+        print("Slowest clips (p90 time to canplaythrough):")
+        for clip, load_p90 in worst:
+            stalls = groups['clip'][clip].get('stalls', {}).get('mean', 0)
+            print(f"  {clip}: {load_p90:.0f} ms, {stalls:.2f} stalls per play")
+        print()
+
+    for group, summary in groups.items():
+        rows = []
+        for key, fields in summary.items():
+            for field, stats in fields.items():
+                rows.append({group: key, 'field': field, **stats})
+        if rows:
+            csv_path = os.path.join(output_dir, f'telemetry_by_{group}.csv')
+            pd.DataFrame(rows).to_csv(csv_path, index=False)
+    print(f"Exported telemetry statistics to {output_dir}")
+
+def _with_metric_headers(results):
+    # Learn the metric IDs of each result's header before its rows are labelled
+    for data in results:
+        METRIC_NAMES.register_header(data.get('metrics'))
+        yield data
+
+def export_rows(results_dir, output_file, rules=None):
+    """
+    Stream one row per participant, question, model and metric to a file.
+
+    Result files are read one at a time, so memory stays constant for any
+    study size. The format follows the file name (.csv, .csv.gz, .csv.zst or
+    .parquet).
+    
+    Args:
+        results_dir: Directory containing result JSON files
+        output_file: Path to the output file
+        rules: Screening rules; excluded participants are left out
+    """
+    results = _with_metric_headers(iter_result_files(results_dir))
+    if rules:
+        results = (data for data in results if not screen_result(data, rules))
+    written = write_rows(iter_rows(results, translate_metric_name), output_file)
+    print(f"Exported {written} ratings to {output_file}")
+
 def main():
     """Main function."""
     parser = argparse.ArgumentParser(description='Analyze listening test results.')
@@ -474,6 +695,24 @@ def main():
                         help='Path to output CSV file')
     parser.add_argument('--by-template', action='store_true',
                         help='Analyze results grouped by original_template_id')
+    parser.add_argument('--telemetry', default=None,
+                        help='Directory with client telemetry JSONL files (e.g. instance/telemetry)')
+    parser.add_argument('--screening', default=None,
+                        help='forum.json whose "screening" rules exclude low-quality participants')
+    parser.add_argument('--reliability', action='store_true',
+                        help='Also export per-participant z-scores, inter-rater reliability and rater consistency')
+    parser.add_argument('--mixed-effects', action='store_true',
+                        help='Also fit rating ~ model + (1|participant) + (1|prompt) per template and metric')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for the mixed-effects fits')
+    parser.add_argument('--report', action='store_true',
+                        help='Write all statistics to one self-contained report.html')
+    parser.add_argument('--title', default='Listening Test Results',
+                        help='Title of the HTML report')
+    parser.add_argument('--config', action='append', default=[],
+                        help='forum.json whose metric IDs, names and aliases label the results (repeatable)')
+    parser.add_argument('--export-rows', default=None,
+                        help='Stream the raw ratings to a .csv, .csv.gz, .csv.zst or .parquet file')
     
     args = parser.parse_args()
 
@@ -485,6 +724,25 @@ def main():
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
+
+    # Metric definitions, so renamed metrics and language variants are analyzed together
+    for config_path in args.config:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            METRIC_NAMES.register_questions(json.load(f).get('questions', []))
+
+    # Client timing telemetry (audio load, stalls, page time)
+    if args.telemetry:
+        analyze_telemetry(args.telemetry, args.output_dir)
+    
+    # Raw ratings are streamed from the files, before loading them all
+    if args.export_rows:
+        rules = None
+        if args.screening:
+            with open(args.screening, 'r', encoding='utf-8') as f:
+                rules = json.load(f).get('screening') or {}
+        export_rows(args.results_dir, args.export_rows, rules)
+        if not (args.by_template or args.report or args.reliability or args.mixed_effects):
+            return
     
     # Load results
     results = load_results(args.results_dir)
@@ -494,6 +752,29 @@ def main():
         print("No results found. Exiting.")
         return
     
+    if args.screening:
+        with open(args.screening, 'r', encoding='utf-8') as f:
+            rules = json.load(f).get('screening') or {}
+        results, excluded = filter_results(results, rules)
+        print(f"Screening excluded {len(excluded)} participants, {len(results)} remain")
+        for data, reasons in excluded:
+            print(f"  {data.get('uuid', 'unknown')}: {', '.join(reasons)}")
+        if not results:
+            return
+    
+    if args.reliability:
+        analyze_reliability(results, args.output_dir)
+
+    mixed_rows = None
+    if args.mixed_effects:
+        mixed_rows = analyze_mixed_effects(results, args.output_dir, args.workers)
+
+    if args.report:
+        analyze_report(results, args.output_dir, mixed_rows, args.title)
+        if not args.by_template:
+            # The report replaces the default plots and CSV files
+            return
+    
     if args.by_template:
         # Analyze by template ID
         template_metrics_data = extract_metrics_by_template(results)
@@ -1,21 +1,16 @@
 """
 Main Flask application for the Subjective Listening Test Forum.
 """
+import atexit
 import json
 import os
 from pathlib import Path
 from flask import Flask, session
+from flask.sessions import NullSession
 
-# Import blueprints
-from blueprints.cover import cover_bp
-from blueprints.participant import participant_bp
-from blueprints.rules import rules_bp
-from blueprints.questions import questions_bp
-from blueprints.api import api_bp
-from blueprints.thankyou import thankyou_bp
-
-# Import utilities
-from utils.loader import scan_audio_directory, validate_questions
+# Blueprints and utilities are imported inside create_app: `import app` stays
+# cheap for scripts and tooling, and disabled features are never imported.
+# See benchmarks/startup.py for the import-time report.
 
 
 def create_app(test_config=None):
@@ -28,6 +23,25 @@ def create_app(test_config=None):
     Returns:
         Configured Flask application
     """
+    from blueprints.cover import cover_bp
+    from blueprints.participant import participant_bp
+    from blueprints.rules import rules_bp
+    from blueprints.questions import questions_bp
+    from blueprints.api import api_bp
+    from blueprints.thankyou import thankyou_bp
+    from blueprints.health import health_bp
+    from blueprints.admin import admin_bp
+    from utils.session import LightweightSessionInterface
+    from utils.profiler import init_profiler
+    from utils.state import init_state
+    from utils.admission import init_admission
+    from utils.metric_names import init_metric_names
+    from utils.screening import init_screening
+    from utils.quota import init_quota
+    from utils.adaptive import init_adaptive
+    from utils.warmer import init_warmer
+    from utils.startup import start_audio_preparation
+
     # Create and configure the app
     app = Flask(__name__,
                 instance_relative_config=True,
@@ -39,24 +53,105 @@ def create_app(test_config=None):
         SECRET_KEY=os.environ.get('SECRET_KEY', 'dev'),
         FORUM_CONFIG='config/forum.json',
         RESULTS_DIR='results',
+        # Result file format (see utils/saver.py): 'compact' (schema 2) or 'json' (schema 1, indented)
+        RESULTS_FORMAT='compact',
+        RESULTS_COMPRESSION=None,  # None, 'gzip' or 'zstd' (needs the zstandard package)
         DEBUG=True,
+        # Session cookie handling (see utils/session.py)
+        SESSION_REFRESH_EACH_REQUEST=False,
+        SESSION_REFRESH_AFTER=600,  # Seconds before an unchanged cookie is re-signed
+        SESSION_SKIP_PREFIXES=('/static/', '/api/audio/', '/api/telemetry', '/metrics', '/admin/', '/healthz'),
+        SESSION_TOUCH_PATHS=('/api/heartbeat',),
+        # Audio duration/integrity index (see utils/audio_index.py)
+        AUDIO_INDEX_ENABLED=True,
+        AUDIO_INDEX_CACHE=None,  # Defaults to <instance>/audio_index.json
+        AUDIO_INDEX_WORKERS=8,
+        AUDIO_DURATION_TOLERANCE=1.0,  # Seconds a model clip may deviate from its prompt's median
+        # Scan/index/validate audio in a background thread; /healthz reports readiness (see utils/startup.py)
+        AUDIO_INIT_BACKGROUND=True,
+        AUDIO_READY_TIMEOUT=30.0,  # Seconds a participant request waits for the audio data
+        AUDIO_SHARED_CACHE=False,  # Share scanned audio per audioRoot across the apps of one process
+        # Pre-warm likely-requested clips into the page cache (see utils/warmer.py); 0 disables
+        AUDIO_WARM_BUDGET_MB=256,
+        AUDIO_WARM_SESSIONS=20,  # Upcoming sessions simulated to find the likely prompts
+        AUDIO_WARM_REFRESH=60.0,  # Minimum seconds between warming plans after assignments
+        # Audio offloading to a front proxy: None, 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd)
+        AUDIO_OFFLOAD=None,
+        AUDIO_ACCEL_PREFIX='/protected-audio/',
+        AUDIO_VARIANTS_ACCEL_PREFIX='/protected-audio-variants/',
+        # Question pages fetch their clips in one /api/audio/bundle request (see utils/audio_bundle.py)
+        AUDIO_BUNDLE=True,
+        # Request instrumentation and /metrics (see utils/metrics.py)
+        METRICS_ENABLED=True,
+        METRICS_DIR=None,  # Shared snapshot directory for multi-worker servers
+        METRICS_FLUSH_INTERVAL=5.0,  # Seconds between snapshot writes per worker
+        # Sampling profiler (see utils/profiler.py), controlled through /admin/profile/*
+        ADMIN_TOKEN=os.environ.get('ADMIN_TOKEN'),
+        PROFILE_ENABLED=False,  # Start capturing at startup
+        PROFILE_SAMPLE_RATE=0.1,  # Fraction of requests profiled during a capture
+        PROFILE_INTERVAL=0.005,  # Seconds between stack samples
+        PROFILE_DIR=None,  # Defaults to <instance>/profiles
+        # Client timing telemetry (see utils/telemetry.py)
+        TELEMETRY_ENABLED=True,
+        TELEMETRY_DIR=None,  # Defaults to <instance>/telemetry
+        TELEMETRY_FLUSH_INTERVAL=30.0,  # Seconds between JSONL appends per worker
+        TELEMETRY_MAX_BODY=64 * 1024,  # Bytes per batch
+        # Admission control for participant surges (see utils/admission.py); 0 disables a limit
+        ADMISSION_MAX_ACTIVE=0,  # Concurrently active participant sessions
+        ADMISSION_AUDIO_BUDGET_MBPS=0,  # Audio bandwidth across all workers, in Mbit/s
+        ADMISSION_BANDWIDTH_WINDOW=10.0,  # Seconds the audio bandwidth is averaged over
+        ADMISSION_IDLE_TIMEOUT=1200.0,  # Seconds without a page view before a session's slot is freed
+        ADMISSION_QUEUE_TIMEOUT=60.0,  # Seconds before a waiting participant who left is dropped
+        ADMISSION_RETRY_SECONDS=5,  # Base auto-retry interval of the waiting page
+        # Rating quotas from 'target_count'/'target_per_model' in forum.json (see utils/quota.py)
+        QUOTA_RESERVATION_TTL=3600.0,  # Seconds an unfinished session holds its assigned questions
+        # Adaptive prompt scheduling (see utils/adaptive.py): None or 'information'
+        ADAPTIVE_MODE=None,
+        ADAPTIVE_REFRESH_INTERVAL=10.0,  # Seconds between reloads of the shared rating statistics
+        ADAPTIVE_PRIOR_VARIANCE=1.0,  # Rating variance assumed for prompts with few ratings
+        # Shared state of admission, quotas, adaptive scheduling and results (see utils/state.py):
+        # None (<instance>/state.sqlite3, one node), 'sqlite:///path', 'memory://' or 'redis://host:6379/0'
+        STATE_BACKEND=None,
+        # Multi-study hosting (see create_multi_app): per-study instance, results and cookie namespace
+        STUDY_NAME=None,
+        LOG_LEVEL='DEBUG',
     )
+
+    # Environment overrides, e.g. FLASK_AUDIO_OFFLOAD=x-accel or FLASK_LOG_LEVEL=INFO
+    app.config.from_prefixed_env()
+    
+    # Override config with test config if provided
+    if test_config is not None:
+        app.config.update(test_config)
+
+    # A study hosted by create_multi_app keeps its shared state, index cache and results
+    # apart from the other studies; the admission limits stay process-wide
+    study = app.config['STUDY_NAME']
+    if study:
+        if not app.config['STATE_BACKEND']:
+            # One file for all studies; hash names carry the study name (see utils/state.py)
+            app.config['STATE_BACKEND'] = f"sqlite:///{os.path.join(app.instance_path, 'state.sqlite3')}"
+        app.instance_path = os.path.join(app.instance_path, 'studies', study)
+        app.config['RESULTS_DIR'] = os.path.join(app.config['RESULTS_DIR'], study)
+        if app.config['METRICS_DIR']:
+            app.config['METRICS_DIR'] = os.path.join(app.config['METRICS_DIR'], study)
+        app.config['SESSION_COOKIE_NAME'] = f"{app.config['SESSION_COOKIE_NAME']}_{study}"
+
+    # X-Sendfile is built into Flask's send_file
+    if app.config['AUDIO_OFFLOAD'] == 'x-sendfile':
+        app.config['USE_X_SENDFILE'] = True
     
     # Configure logging
     import logging
     logging.basicConfig(
-        level=logging.DEBUG,
+        level=app.config['LOG_LEVEL'],
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    app.logger.setLevel(logging.DEBUG)
-    app.logger.info("Application starting up in debug mode")
-    
-    # Override config with test config if provided
-    if test_config is not None:
-        app.config.update(test_config)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    app.logger.info(f"Application starting up (debug={app.config['DEBUG']}, log level={app.config['LOG_LEVEL']})")
     
     # Ensure the results directory exists
-    Path(app.config['RESULTS_DIR']).mkdir(exist_ok=True)
+    Path(app.config['RESULTS_DIR']).mkdir(parents=True, exist_ok=True)
     
     # Load forum configuration
     try:
@@ -65,25 +160,12 @@ def create_app(test_config=None):
             app.config['FORUM'] = forum_config
             # log the forum config
             app.logger.info(f"Forum config: {forum_config}")
-
-            # Scan audio directory
-            audio_root = forum_config.get('audioRoot', 'static/audio')
-            app.config['AUDIO_MODELS'] = scan_audio_directory(audio_root)
-            
-            # Validate questions
-            errors = validate_questions(
-                forum_config.get('questions', []),
-                app.config['AUDIO_MODELS']
-            )
-            
-            if errors:
-                app.logger.error("Forum configuration validation errors:")
-                for error in errors:
-                    app.logger.error(f"- {error}")
     except (FileNotFoundError, json.JSONDecodeError) as e:
         app.logger.error(f"Error loading forum configuration: {e}")
         app.config['FORUM'] = {}
-        app.config['AUDIO_MODELS'] = {}
+
+    # Until the audio is prepared (see below) the app serves with empty audio data
+    app.config.update(AUDIO_MODELS={}, AUDIO_VARIANTS={}, AUDIO_INDEX={}, AUDIO_ERRORS=[])
     
     # Register blueprints
     app.register_blueprint(cover_bp)
@@ -92,15 +174,113 @@ def create_app(test_config=None):
     app.register_blueprint(questions_bp)
     app.register_blueprint(api_bp)
     app.register_blueprint(thankyou_bp)
+    app.register_blueprint(health_bp)
     
     # Session configuration
+    app.session_interface = LightweightSessionInterface()
+
+    # Per-endpoint latency, in-flight, response size and cookie size metrics
+    if app.config['METRICS_ENABLED']:
+        from blueprints.metrics import metrics_bp
+        from utils.metrics import init_metrics, LATENCY_BUCKETS
+        registry = init_metrics(app)
+        registry.counter('forum_audio_requests_total', 'Audio requests by result (hit: 304 revalidation, miss, not_found) and source.')
+        registry.histogram('forum_results_write_seconds', 'Time spent writing a result file (utils.saver.save).', LATENCY_BUCKETS)
+        registry.counter('forum_admission_decisions_total', 'Admission decisions at rules.begin (admitted, queued).')
+        registry.counter('forum_audio_warm_requests_total', 'Audio responses by whether the file had been pre-warmed (warm, cold).')
+        registry.counter('forum_screening_decisions_total', 'Screened sessions by decision (accepted, excluded).')
+        app.register_blueprint(metrics_bp)
+
+    # Client timing telemetry, flushed to disk periodically and on shutdown
+    if app.config['TELEMETRY_ENABLED']:
+        from utils.telemetry import TelemetryAggregator
+        aggregator = TelemetryAggregator(
+            app.config['TELEMETRY_DIR'] or os.path.join(app.instance_path, 'telemetry'),
+            app.config['TELEMETRY_FLUSH_INTERVAL']
+        )
+        app.extensions['telemetry'] = aggregator
+        atexit.register(aggregator.flush, True)
+
+    # State shared by all workers (and nodes) behind admission, quotas and results
+    init_state(app)
+
+    # Limit concurrent participant sessions and audio bandwidth, if configured
+    init_admission(app)
+
+    # Metric IDs stored in result files instead of the full metric names
+    init_metric_names(app)
+
+    # Screen finished sessions for low-quality ratings, if forum.json sets rules
+    init_screening(app)
+
+    # Rating quotas shared by all workers, if any template sets a target
+    init_quota(app)
+
+    # Prefer prompts whose model differences are least certain, if enabled
+    init_adaptive(app)
+
+    # Read the clips of likely prompts into the page cache once the audio is prepared
+    init_warmer(app)
+
+    # Scan, index and validate audio, after quotas and scheduling so the warmer can use them
+    start_audio_preparation(app, app.config['AUDIO_INIT_BACKGROUND'])
+
+    # Opt-in sampling profiler
+    init_profiler(app)
+    app.register_blueprint(admin_bp)
+
     @app.before_request
     def make_session_permanent():
-        session.permanent = True
+        # Lightweight routes get a null or touch-only session; leave it alone.
+        # Only flag the session once so unchanged sessions are not re-sent.
+        if isinstance(session, NullSession) or getattr(session, 'touch_only', False):
+            return
+        if not session.permanent:
+            session.permanent = True
     
     return app
 
 
+def create_multi_app(studies, shared_config=None):
+    """
+    Host several studies from one process, each under its own URL prefix.
+
+    Every study is a full app from create_app with its own forum configuration,
+    audio index, results directory (<RESULTS_DIR>/<name>), quota and adaptive
+    state and session cookie. The studies share the worker pool, the
+    admission limits and the scanned audio data of studies with the same
+    audioRoot, so an extra study costs little memory or startup time.
+
+    Args:
+        studies: Mapping of URL prefix (e.g. '/study-a') to the study's config
+            overrides, at least FORUM_CONFIG
+        shared_config: Config applied to every study before its own overrides
+
+    Returns:
+        WSGI application dispatching on the URL prefix; its `mounts` attribute
+        maps each prefix to the study's Flask app
+    """
+    from werkzeug.exceptions import NotFound
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+    mounts = {}
+    for prefix, study_config in studies.items():
+        prefix = '/' + prefix.strip('/')
+        if prefix == '/':
+            raise ValueError("Every study needs a non-empty URL prefix")
+        config = dict(shared_config or {})
+        config.update(
+            STUDY_NAME=prefix.strip('/').replace('/', '_'),
+            APPLICATION_ROOT=prefix,  # Also the session cookie path
+            AUDIO_SHARED_CACHE=True,
+        )
+        config.update(study_config)
+        mounts[prefix] = create_app(config)
+        mounts[prefix].logger.info(f"Study '{config['STUDY_NAME']}' mounted at {prefix}")
+
+    return DispatcherMiddleware(NotFound(), mounts)
+
+
 if __name__ == '__main__':
     app = create_app()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""
+Performance benchmarks for the Subjective Listening Test Forum.
+
+Run from the subjective-forum directory, e.g. ``python -m benchmarks.sessions``.
+"""
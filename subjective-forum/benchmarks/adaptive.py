@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Simulation of adaptive prompt scheduling against uniform prompt selection.
+
+Simulated participants rate n_to_present prompts of one template with synthetic
+ratings: a per-model effect, per-(prompt, model) interaction and rating noise,
+rounded and clipped to a 1-5 scale. After every participant the ratings are added
+to the scheduler's statistics. After a fixed number of participants the report
+shows, per selection mode:
+- the RMSE of the estimated cp - cpdelay difference against the true difference
+  averaged over all prompts of the study;
+- how often the difference is significant (t-test over per-prompt mean
+  differences, so that repeated prompts are not counted as independent);
+- the time to choose the prompts of a session from cached statistics.
+
+Usage:
+    python -m benchmarks.adaptive
+    python -m benchmarks.adaptive --participants 20 40 80 --repeats 100
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from utils.adaptive import MODES, AdaptiveScheduler
+from utils.loader import select_and_randomize_questions_for_session
+from utils.state import SQLiteBackend
+
+MODELS = ['cp', 'cpdelay', 'remi', 'nmt']
+
+
+def make_study(rng, n_prompts, effect, interaction):
+    """
+    Synthetic study: template, scanned audio data and true mean ratings.
+
+    Args:
+        rng: numpy random generator
+        n_prompts: Number of prompts
+        effect: True cp - cpdelay difference of mean ratings
+        interaction: Standard deviation of per-(prompt, model) deviations
+
+    Returns:
+        (template, scanned audio data, {prompt: {model: true mean}})
+    """
+    template = {
+        'id': 'q1', 'audioSubfolder': 'task_1', 'n_to_present': 2, 'models': MODELS,
+        'metrics': [{'name': 'Overall'}], 'adaptive_pairs': [['cp', 'cpdelay']],
+    }
+    base = {'cp': 3.2 + effect, 'cpdelay': 3.2, 'remi': 2.6, 'nmt': 3.6}
+    prompts = [f"{i:03d}" for i in range(n_prompts)]
+    truth = {p: {m: base[m] + rng.normal(0, interaction) for m in MODELS} for p in prompts}
+    scanned = {'task_1': {p: ['prompt'] + MODELS for p in prompts}}
+    return template, scanned, truth
+
+
+def run_study(mode, seed, participants, n_prompts, effect, interaction, noise, work_dir):
+    """
+    Simulate one study with a fixed number of participants.
+
+    Args:
+        mode: 'uniform' or an adaptive mode
+        seed: Random seed of the study
+        participants: Number of participants
+        n_prompts: Number of prompts
+        effect: True cp - cpdelay difference
+        interaction: Per-(prompt, model) standard deviation
+        noise: Rating noise standard deviation
+        work_dir: Directory for the statistics database
+
+    Returns:
+        (squared error of the estimated difference, significant, per-session
+        selection times in seconds)
+
+    Selection times are measured after the study, on the cached statistics.
+    """
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    template, scanned, truth = make_study(rng, n_prompts, effect, interaction)
+    true_difference = statistics.mean(truth[p]['cp'] - truth[p]['cpdelay'] for p in truth)
+    scheduler = None
+    if mode != 'uniform':
+        backend = SQLiteBackend(os.path.join(work_dir, f"{mode}_{participants}_{seed}.sqlite3"))
+        scheduler = AdaptiveScheduler(backend, mode, seed=seed)
+
+    differences = defaultdict(list)  # prompt -> cp - cpdelay per question
+    for _ in range(participants):
+        questions = select_and_randomize_questions_for_session([template], scanned, None, scheduler)
+        answers = {}
+        for index, question in enumerate(questions):
+            prompt = question['promptId']
+            rated = {m: {'Overall': float(min(5, max(1, round(truth[prompt][m] + rng.normal(0, noise)))))}
+                     for m in MODELS}
+            answers[str(index)] = {'original_template_id': 'q1', 'prompt_id_selected': prompt, 'metrics_rated': rated}
+            differences[prompt].append(rated['cp']['Overall'] - rated['cpdelay']['Overall'])
+        if scheduler is not None:
+            scheduler.record(answers)
+            scheduler.refresh(force=True)  # A server reloads every ADAPTIVE_REFRESH_INTERVAL
+
+    all_differences = [d for values in differences.values() for d in values]
+    squared_error = (statistics.mean(all_differences) - true_difference) ** 2
+    prompt_means = [statistics.mean(values) for values in differences.values()]
+    significant = False
+    if len(prompt_means) >= 2 and statistics.stdev(prompt_means) > 0:
+        t = statistics.mean(prompt_means) / (statistics.stdev(prompt_means) / math.sqrt(len(prompt_means)))
+        significant = abs(t) >= 1.96
+
+    timings = []
+    for _ in range(200):
+        start = time.perf_counter()
+        select_and_randomize_questions_for_session([template], scanned, None, scheduler)
+        timings.append(time.perf_counter() - start)
+    return squared_error, significant, timings
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Simulate adaptive prompt scheduling.')
+    parser.add_argument('--participants', type=int, nargs='+', default=[20, 40], help='Participants per study')
+    parser.add_argument('--repeats', type=int, default=60, help='Simulated studies per mode')
+    parser.add_argument('--prompts', type=int, default=40, help='Prompts in the template')
+    parser.add_argument('--effect', type=float, default=0.3, help='True cp - cpdelay difference')
+    parser.add_argument('--interaction', type=float, default=0.6, help='SD of per-(prompt, model) deviations')
+    parser.add_argument('--noise', type=float, default=1.0, help='SD of rating noise')
+    args = parser.parse_args()
+
+    print(f"\n=== cp vs cpdelay after a fixed number of participants ({args.repeats} studies each) ===\n")
+    print(f"{'participants':>12}  {'mode':<12}{'RMSE':>8}{'power':>8}{'select p50 us':>15}{'select p99 us':>15}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for participants in args.participants:
+            for mode in ('uniform',) + MODES:
+                errors, significant, timings = [], 0, []
+                for seed in range(args.repeats):
+                    error, separated, t = run_study(mode, seed, participants, args.prompts, args.effect,
+                                                    args.interaction, args.noise, work_dir)
+                    errors.append(error)
+                    significant += separated
+                    timings.extend(t)
+                timings.sort()
+                print(f"{participants:>12}  {mode:<12}{math.sqrt(statistics.mean(errors)):>8.3f}"
+                      f"{significant / args.repeats:>8.2f}"
+                      f"{timings[len(timings) // 2] * 1e6:>15.0f}{timings[int(0.99 * (len(timings) - 1))] * 1e6:>15.0f}")
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark of analyze_results.py on synthetic studies of increasing size.
+
+For each study size, generate_test_results.py writes result files and every
+stage of `analyze_results.py --by-template` is timed on them:
+- load: reading the result JSON files (load_results)
+- aggregate: grouping ratings by template and model, statistics and the CSV
+  exports (extract_metrics_by_template, calculate_statistics, export_*)
+- reliability: per-participant z-scores, inter-rater reliability and rater
+  consistency (analyze_reliability, --reliability)
+- mixed: mixed-effects fits per template and metric (analyze_mixed_effects,
+  --mixed-effects)
+- report: the self-contained HTML report (analyze_report, --report)
+- plot: the per-template bar charts (plot_metrics_by_template; --plot only,
+  as it dominates at large sizes)
+
+The report lists the time per stage, the time per 1000 participants and the
+peak resident memory of the process.
+
+Usage:
+    python -m benchmarks.analysis
+    python -m benchmarks.analysis --participants 1000 10000 50000 --plot
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import analyze_results
+from generate_test_results import build_templates, generate_test_results, DEFAULT_METRICS
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process.
+
+    Returns:
+        Megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KiB on Linux
+
+
+def run_stages(results_dir, output_dir, plot=False):
+    """
+    Time the stages of the by-template analysis.
+
+    Args:
+        results_dir: Directory of result files
+        output_dir: Directory for the CSV files and plots
+        plot: Also time the plots
+
+    Returns:
+        Dictionary of stage -> seconds, plus 'files'
+    """
+    timings = {}
+    start = time.perf_counter()
+    results = analyze_results.load_results(results_dir)
+    timings['load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template_metrics_data = analyze_results.extract_metrics_by_template(results)
+    template_stats = {t: analyze_results.calculate_statistics(d) for t, d in template_metrics_data.items()}
+    analyze_results.export_csv_by_template(template_stats, os.path.join(output_dir, 'results_by_template.csv'))
+    analyze_results.export_mos_by_template(template_metrics_data, os.path.join(output_dir, 'MOS.csv'))
+    timings['aggregate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analyze_results.analyze_reliability(results, output_dir)
+    timings['reliability'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mixed_rows = analyze_results.analyze_mixed_effects(results, output_dir)
+    timings['mixed'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analyze_results.analyze_report(results, output_dir, mixed_rows)
+    timings['report'] = time.perf_counter() - start
+
+    if plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        start = time.perf_counter()
+        analyze_results.plot_metrics_by_template(template_metrics_data, output_dir)
+        timings['plot'] = time.perf_counter() - start
+
+    timings['files'] = len(results)
+    return timings
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Benchmark the analysis pipeline on synthetic results.')
+    parser.add_argument('--participants', type=int, nargs='+', default=[1000, 5000],
+                        help='Study sizes to benchmark')
+    parser.add_argument('--templates', type=int, default=2, help='Question templates')
+    parser.add_argument('--models', default='mmt,mmtdelay,remiplus,nmt', help='Comma-separated model names')
+    parser.add_argument('--workers', type=int, default=None, help='Generator processes (default: CPU count)')
+    parser.add_argument('--plot', action='store_true', help='Also time the plots')
+    args = parser.parse_args()
+
+    templates = build_templates(args.templates, args.models.split(','), DEFAULT_METRICS)
+    stages = ['generate', 'load', 'aggregate', 'reliability', 'mixed', 'report'] + (['plot'] if args.plot else [])
+
+    print("\n=== analyze_results.py --by-template on synthetic studies ===\n")
+    print(f"{'participants':>12}" + ''.join(f"{stage + ' s':>14}" for stage in stages)
+          + f"{'ms / 1k':>10}{'peak MB':>10}")
+    for participants in args.participants:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results_dir = os.path.join(work_dir, 'results')
+            start = time.perf_counter()
+            generate_test_results(results_dir, participants, templates, workers=args.workers)
+            timings = {'generate': time.perf_counter() - start}
+            # Suppress the per-plot messages of analyze_results
+            with open(os.devnull, 'w') as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    timings.update(run_stages(results_dir, work_dir, args.plot))
+                finally:
+                    sys.stdout = stdout
+            analysis = sum(timings[stage] for stage in stages if stage != 'generate')
+            print(f"{timings['files']:>12}" + ''.join(f"{timings[stage]:>14.2f}" for stage in stages)
+                  + f"{analysis / participants * 1e6:>10.0f}{peak_rss_mb():>10.0f}")
+    print()
+
+
+if __name__ == '__main__':
+    main()
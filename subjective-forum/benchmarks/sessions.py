@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Load-test harness that simulates complete participant sessions.
+
+Each simulated participant walks cover -> participant -> rules -> rules/begin ->
+questions (with the audio bundle or per-clip audio fetches, heartbeat and save) -> finish -> thankyou, either
+in-process against create_app() with a generated audio tree, or over HTTP against
+a running server (--url). The report contains p50/p95/p99 latency per route,
+throughput, session cookie sizes and error rates, and can be saved as a baseline
+and compared against later runs to catch regressions.
+
+Usage:
+    python -m benchmarks.sessions --participants 50 --concurrency 10
+    python -m benchmarks.sessions --save-baseline benchmarks/baseline_sessions.json
+    python -m benchmarks.sessions --compare benchmarks/baseline_sessions.json
+"""
+import argparse
+import html as html_entities
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from generate_test_audio import generate_test_tree
+
+DEFAULT_MODELS = ['gt', 'methodA', 'methodB', 'methodC']
+
+
+def build_fixture(work_dir, n_prompts=20, n_templates=2, models=None, n_to_present=2, duration=3.0, silent=None):
+    """
+    Generate an audio tree and matching forum config for the benchmark.
+
+    Args:
+        work_dir: Directory to create the fixture in
+        n_prompts: Prompts per template subfolder
+        n_templates: Number of question templates (one task_N subfolder each)
+        models: Model tags (defaults to DEFAULT_MODELS)
+        n_to_present: Questions per template in each session
+        duration: Clip duration in seconds
+        silent: Write silent MP3s instead of ffmpeg tones (default: when ffmpeg is missing)
+
+    Returns:
+        Path to the generated forum config JSON
+    """
+    models = models or DEFAULT_MODELS
+    if silent is None:
+        silent = shutil.which('ffmpeg') is None
+
+    with open('config/forum.json', 'r', encoding='utf-8') as f:
+        base_config = json.load(f)
+
+    audio_root = os.path.join(work_dir, 'audio')
+    prompt_ids = [f"{i:03d}" for i in range(1, n_prompts + 1)]
+    questions = []
+    expected = n_templates * n_prompts * (1 + len(models))
+    written = generate_test_tree(audio_root, n_templates, prompt_ids, models, duration, silent)
+    if written < expected:
+        raise RuntimeError(f"Fixture audio incomplete: {written} of {expected} files written")
+    for t in range(1, n_templates + 1):
+        questions.append({
+            'id': f"q{t}",
+            'title': f"Benchmark template {t}",
+            'audioSubfolder': f"task_{t}",
+            'n_to_present': n_to_present,
+            'metrics': base_config['questions'][0]['metrics'],
+            'models': list(models),
+        })
+
+    forum_config = {
+        'debug': False,
+        'branding': base_config.get('branding', {}),
+        'participantFields': base_config.get('participantFields', []),
+        'rulesMarkdown': os.path.abspath(os.path.join('config', base_config.get('rulesMarkdown', 'rules.md'))),
+        'audioRoot': audio_root,
+        'questions': questions,
+    }
+    config_path = os.path.join(work_dir, 'forum.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(forum_config, f, ensure_ascii=False, indent=2)
+    return config_path
+
+
+class FlaskClient:
+    """In-process client built on Flask's test client (one per participant)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self.client.open(path, method=method, data=form, json=json_body)
+        body = response.get_data()
+        headers = {'Set-Cookie': response.headers.getlist('Set-Cookie'), 'Location': response.headers.get('Location')}
+        response.close()
+        return response.status_code, body, headers
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Client for a running server, with its own cookie jar (one per participant)."""
+
+    def __init__(self, base_url, cookie_name='session'):
+        self.base_url = base_url.rstrip('/')
+        self.cookie_name = cookie_name
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            response = self.opener.open(req, timeout=60)
+        except urllib.error.HTTPError as e:
+            response = e  # Non-2xx (including unfollowed redirects) still carries a response
+        body = response.read()
+        result_headers = {'Set-Cookie': response.headers.get_all('Set-Cookie') or [], 'Location': response.headers.get('Location')}
+        return response.status, body, result_headers
+
+
+class Recorder:
+    """Thread-safe collection of per-route samples."""
+
+    def __init__(self, cookie_name='session'):
+        self.cookie_name = cookie_name
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = {}
+        self.cookie_sizes = []
+
+    def call(self, client, route, method, path, expected=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body, headers = client.request(method, path, **kwargs)
+        except Exception:
+            status, body, headers = 0, b'', {'Set-Cookie': [], 'Location': None}
+        elapsed = time.perf_counter() - start
+
+        cookie_sizes = [
+            len(cookie.split(';', 1)[0]) - len(self.cookie_name) - 1
+            for cookie in headers['Set-Cookie'] if cookie.startswith(self.cookie_name + '=')
+        ]
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            self.bytes[route] = self.bytes.get(route, 0) + len(body)
+            self.errors.setdefault(route, 0)
+            if status not in expected:
+                self.errors[route] += 1
+            self.cookie_sizes.extend(cookie_sizes)
+        return status, body, headers
+
+
+def _attribute(html, name):
+    match = re.search(rf'{name}="([^"]*)"', html)
+    return match.group(1) if match else None
+
+
+def simulate_participant(client, recorder, participant_id, think_time=0.0):
+    """
+    Walk one participant through the whole study.
+
+    Args:
+        client: FlaskClient or HttpClient
+        recorder: Recorder collecting the samples
+        participant_id: Number used for the form values
+        think_time: Seconds to pause between questions (simulates listening)
+
+    Returns:
+        True if the session reached the thank-you page without errors
+    """
+    ok = True
+    ok &= recorder.call(client, 'cover.index', 'GET', '/')[0] == 200
+    ok &= recorder.call(client, 'participant.index', 'GET', '/participant/')[0] == 200
+    form = {
+        'name': f"bench{participant_id}", 'age': '30', 'gender': '不願透露(Prefer not to say)',
+        'musical_exp': '無經驗(No experience)', 'headphones': 'benchmark',
+    }
+    ok &= recorder.call(client, 'participant.submit', 'POST', '/participant/', expected=(302,), form=form)[0] == 302
+    ok &= recorder.call(client, 'rules.index', 'GET', '/rules/')[0] == 200
+    status, _, headers = recorder.call(client, 'rules.begin', 'GET', '/rules/begin', expected=(302,))
+    if status != 302 or '/questions/' not in (headers['Location'] or ''):
+        return False
+
+    index = 0
+    while True:
+        status, body, _ = recorder.call(client, 'questions.show', 'GET', f"/questions/{index}")
+        if status != 200:
+            return False
+        html = body.decode('utf-8')
+        subfolder = _attribute(html, 'data-audio-subfolder')
+        prompt_id = _attribute(html, 'data-prompt-id')
+        template_id = _attribute(html, 'data-question-id')
+        question_data = json.loads(re.search(r'id="question-data-json"[^>]*>(.*?)</script>', html, re.S).group(1))
+        models = question_data['models']
+        metrics = [metric['name'] for metric in question_data['metrics']]
+
+        # Audio as the page loads it: one bundle request, or one request per clip
+        bundle_url = _attribute(html, 'data-audio-bundle')
+        if bundle_url:
+            ok &= recorder.call(client, 'api.serve_audio_bundle', 'GET', html_entities.unescape(bundle_url))[0] == 200
+        else:
+            for tag in ['prompt'] + models:
+                ok &= recorder.call(client, 'api.serve_audio', 'GET', f"/api/audio/{subfolder}/{prompt_id}_{tag}.mp3")[0] == 200
+        ok &= recorder.call(client, 'api.heartbeat', 'GET', '/api/heartbeat')[0] == 200
+
+        if think_time:
+            time.sleep(think_time)
+
+        answers = {model: {metric: random.randint(1, 5) for metric in metrics} for model in models}
+        payload = {'originalQuestionId': template_id, 'questionIndex': index, 'answers': answers, 'timeSpent': 30.0}
+        ok &= recorder.call(client, 'api.save_answer', 'POST', '/api/save', json_body=payload)[0] == 200
+
+        if _attribute(html, 'data-is-last') == 'true':
+            break
+        index += 1
+
+    status, body, _ = recorder.call(client, 'api.finish', 'POST', '/api/finish')
+    ok &= status == 200 and json.loads(body).get('success', False)
+    ok &= recorder.call(client, 'thankyou.show', 'GET', '/thankyou/')[0] == 200
+    return bool(ok)
+
+
+def summarize(recorder, wall_time, participants, completed):
+    """
+    Build the benchmark report.
+
+    Args:
+        recorder: Recorder with the collected samples
+        wall_time: Total run time in seconds
+        participants: Number of simulated participants
+        completed: Number of sessions that finished without errors
+
+    Returns:
+        Report dictionary
+    """
+    routes = {}
+    total_requests = 0
+    total_errors = 0
+    for route, samples in sorted(recorder.latencies.items()):
+        latencies_ms = np.array(samples) * 1000
+        count = len(samples)
+        total_requests += count
+        total_errors += recorder.errors[route]
+        routes[route] = {
+            'count': count,
+            'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+            'mean_bytes': int(recorder.bytes[route] / count),
+            'error_rate': round(recorder.errors[route] / count, 4),
+        }
+
+    cookies = recorder.cookie_sizes
+    return {
+        'participants': participants,
+        'completed_sessions': completed,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_rps': round(total_requests / wall_time, 1) if wall_time else 0.0,
+        'sessions_per_s': round(completed / wall_time, 2) if wall_time else 0.0,
+        'error_rate': round(total_errors / total_requests, 4) if total_requests else 0.0,
+        'session_cookie': {
+            'writes': len(cookies),
+            'writes_per_session': round(len(cookies) / participants, 2) if participants else 0.0,
+            'mean_bytes': int(np.mean(cookies)) if cookies else 0,
+            'max_bytes': int(max(cookies)) if cookies else 0,
+        },
+        'routes': routes,
+    }
+
+
+def run_benchmark(participants=20, concurrency=5, url=None, fixture=None, think_time=0.0, seed=0, warmup=1,
+                  config=None):
+    """
+    Run the simulated sessions and return the report.
+
+    Args:
+        participants: Number of simulated participants
+        concurrency: Number of participants running at the same time
+        url: Base URL of a running server; None to benchmark create_app() in-process
+        fixture: Keyword arguments for build_fixture (in-process mode only)
+        think_time: Seconds to pause on each question
+        seed: Random seed for the submitted ratings
+        warmup: Participants run (and discarded) first, so template compilation and
+                cold caches do not end up in the percentiles
+        config: Extra app config (in-process mode only), e.g. {'AUDIO_BUNDLE': False}
+
+    Returns:
+        Report dictionary (see summarize)
+    """
+    random.seed(seed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if url:
+            make_client = lambda: HttpClient(url)
+            cookie_name = 'session'
+        else:
+            from app import create_app
+
+            config_path = build_fixture(work_dir, **(fixture or {}))
+            app = create_app({
+                'TESTING': True,
+                'DEBUG': False,
+                'LOG_LEVEL': 'WARNING',
+                'FORUM_CONFIG': config_path,
+                'RESULTS_DIR': os.path.join(work_dir, 'results'),
+                # Simulated sessions must not reach the real instance/state.sqlite3 (results, quotas)
+                'STATE_BACKEND': f"sqlite:///{os.path.join(work_dir, 'state.sqlite3')}",
+                'AUDIO_INDEX_CACHE': os.path.join(work_dir, 'audio_index.json'),
+                'AUDIO_INIT_BACKGROUND': False,  # Measure serving, not startup
+                **(config or {}),
+            })
+            logging.getLogger().setLevel(logging.WARNING)
+            make_client = lambda: FlaskClient(app)
+            cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+
+        for pid in range(warmup):
+            simulate_participant(make_client(), Recorder(cookie_name), -1 - pid)
+
+        recorder = Recorder(cookie_name)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(
+                lambda pid: simulate_participant(make_client(), recorder, pid, think_time),
+                range(participants)
+            ))
+        wall_time = time.perf_counter() - start
+
+    return summarize(recorder, wall_time, participants, sum(outcomes))
+
+
+def compare_to_baseline(report, baseline, tolerance=1.0):
+    """
+    Compare a report against a saved baseline.
+
+    A route regresses when its p95 latency grows by more than `tolerance`
+    (relative, with a 1 ms floor so sub-millisecond noise is ignored) or its error
+    rate increases. Session cookie writes per session must not increase.
+
+    Args:
+        report: Current report
+        baseline: Baseline report
+        tolerance: Allowed relative p95 increase (1.0 = +100%)
+
+    Returns:
+        List of regression messages, empty if none
+    """
+    regressions = []
+    for route, base in baseline.get('routes', {}).items():
+        current = report['routes'].get(route)
+        if current is None:
+            regressions.append(f"{route}: missing from current run")
+            continue
+        allowed = max(base['p95_ms'] * (1 + tolerance), base['p95_ms'] + 1.0)
+        if current['p95_ms'] > allowed:
+            regressions.append(f"{route}: p95 {current['p95_ms']:.2f} ms > {allowed:.2f} ms (baseline {base['p95_ms']:.2f} ms)")
+        if current['error_rate'] > base['error_rate']:
+            regressions.append(f"{route}: error rate {current['error_rate']:.2%} > baseline {base['error_rate']:.2%}")
+
+    base_writes = baseline.get('session_cookie', {}).get('writes_per_session')
+    if base_writes is not None and report['session_cookie']['writes_per_session'] > base_writes:
+        regressions.append(
+            f"session cookie writes per session {report['session_cookie']['writes_per_session']} > baseline {base_writes}"
+        )
+    return regressions
+
+
+def print_report(report):
+    """
+    Print the benchmark report to console.
+
+    Args:
+        report: Report dictionary
+    """
+    print("\n=== Participant Session Benchmark ===\n")
+    print(f"Participants: {report['participants']} ({report['completed_sessions']} completed)")
+    print(f"Wall time: {report['wall_time_s']:.2f} s")
+    print(f"Throughput: {report['throughput_rps']:.1f} req/s, {report['sessions_per_s']:.2f} sessions/s")
+    print(f"Error rate: {report['error_rate']:.2%}")
+    cookie = report['session_cookie']
+    print(f"Session cookie: {cookie['writes']} writes ({cookie['writes_per_session']} per session), "
+          f"mean {cookie['mean_bytes']} B, max {cookie['max_bytes']} B")
+    print("-" * 78)
+    print(f"{'route':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'bytes':>10}{'errors':>9}")
+    for route, stats in report['routes'].items():
+        print(f"{route:<22}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['mean_bytes']:>10}{stats['error_rate']:>9.2%}")
+    print()
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Simulate concurrent participant sessions.')
+    parser.add_argument('--participants', type=int, default=40, help='Number of simulated participants')
+    parser.add_argument('--concurrency', type=int, default=8, help='Participants running at the same time')
+    parser.add_argument('--url', default=None, help='Benchmark a running server instead of create_app()')
+    parser.add_argument('--prompts', type=int, default=20, help='Prompts per template in the generated audio tree')
+    parser.add_argument('--templates', type=int, default=2, help='Question templates in the generated config')
+    parser.add_argument('--n-to-present', type=int, default=2, help='Questions per template in each session')
+    parser.add_argument('--duration', type=float, default=3.0, help='Generated clip duration in seconds')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Seconds spent on each question')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for submitted ratings')
+    parser.add_argument('--warmup', type=int, default=1, help='Participants run before measuring')
+    parser.add_argument('--no-audio-bundle', action='store_true',
+                        help='Fetch each clip separately instead of one bundle per question')
+    parser.add_argument('--json', default=None, help='Write the report to this JSON file')
+    parser.add_argument('--save-baseline', default=None, help='Save the report as a baseline JSON file')
+    parser.add_argument('--compare', default=None, help='Compare against a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Allowed relative p95 increase vs. baseline')
+
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        participants=args.participants,
+        concurrency=args.concurrency,
+        url=args.url,
+        fixture={
+            'n_prompts': args.prompts,
+            'n_templates': args.templates,
+            'n_to_present': args.n_to_present,
+            'duration': args.duration,
+        },
+        think_time=args.think_time,
+        seed=args.seed,
+        warmup=args.warmup,
+        config={'AUDIO_BUNDLE': False} if args.no_audio_bundle else None,
+    )
+    print_report(report)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved report to {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Startup-time report for the forum and its scripts.
+
+Each measurement runs in a fresh interpreter so module caches do not hide import
+costs. Reports:
+- the slowest imports of `import app` (from python -X importtime)
+- time to import app, to return from create_app() and until the audio
+  preparation has finished (readiness, see utils/startup.py)
+- time of `analyze_results.py --help`
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --top 30 --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Runs in the child interpreter; prints one JSON line with the timings
+CREATE_APP_SNIPPET = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+application = app.create_app({'LOG_LEVEL': 'WARNING'})
+t2 = time.perf_counter()
+from utils.startup import wait_until_ready
+wait_until_ready(application, 600)
+t3 = time.perf_counter()
+print(json.dumps({'import_app_s': t1 - t0, 'create_app_s': t2 - t1, 'ready_s': t3 - t1}))
+"""
+
+
+def import_times(module='app'):
+    """
+    Cumulative import time per module, from python -X importtime.
+
+    Args:
+        module: Module to import
+
+    Returns:
+        List of (cumulative seconds, self seconds, module name), slowest first
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name.rstrip()))
+    rows.sort(reverse=True)
+    return rows
+
+
+def run_timed(args, repeat=3):
+    """
+    Best-of-n wall time of a command.
+
+    Args:
+        args: Command line
+        repeat: Number of runs
+
+    Returns:
+        Fastest wall time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, capture_output=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def create_app_times(repeat=3):
+    """
+    Best-of-n import, create_app and readiness times, each in a fresh interpreter.
+
+    Args:
+        repeat: Number of runs
+
+    Returns:
+        Dictionary of timings in seconds
+    """
+    best = {}
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', CREATE_APP_SNIPPET], capture_output=True, text=True, check=True)
+        timings = json.loads(completed.stdout.strip().splitlines()[-1])
+        for key, value in timings.items():
+            best[key] = min(best.get(key, value), value)
+    return best
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Report import and startup times.')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to show')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per timing (best is reported)')
+    parser.add_argument('--json', default=None, help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    rows = import_times('app')
+    print("\n=== Slowest imports of `import app` (cumulative) ===\n")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative, own, name in rows[:args.top]:
+        print(f"{cumulative * 1000:>14.1f}{own * 1000:>10.1f}  {name}")
+
+    report = {'imports': [{'module': name.strip(), 'cumulative_s': c, 'self_s': s} for c, s, name in rows[:args.top]]}
+    report.update(create_app_times(args.repeat))
+    report['interpreter_s'] = run_timed([sys.executable, '-c', 'pass'], args.repeat)
+    report['analyze_results_help_s'] = run_timed(
+        [sys.executable, 'analyze_results.py', '--help'], args.repeat
+    ) if os.path.exists('analyze_results.py') else None
+
+    print("\n=== Startup ===\n")
+    print(f"Interpreter start:             {report['interpreter_s'] * 1000:8.1f} ms")
+    print(f"import app:                    {report['import_app_s'] * 1000:8.1f} ms")
+    print(f"create_app() returns:          {report['create_app_s'] * 1000:8.1f} ms")
+    print(f"create_app() until ready:      {report['ready_s'] * 1000:8.1f} ms")
+    if report['analyze_results_help_s'] is not None:
+        print(f"analyze_results.py --help:     {report['analyze_results_help_s'] * 1000:8.1f} ms")
+    print()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
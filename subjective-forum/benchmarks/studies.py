@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Startup time and memory of several studies hosted by one process.
+
+Generates one audio tree and N study configs that use it, then measures in fresh
+interpreters:
+- separate: one process per study (create_app), as when every study runs its own
+  server; times and peak RSS are summed over the processes
+- multi: all studies in one process (create_multi_app), sharing the audio data
+
+Usage:
+    python -m benchmarks.studies
+    python -m benchmarks.studies --studies 3 --prompts 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.sessions import build_fixture
+
+# Runs in the child interpreter; prints one JSON line with time until ready and peak RSS
+CHILD_SNIPPET = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+from app import create_app, create_multi_app
+from utils.startup import wait_until_ready
+studies, shared = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+if len(studies) == 1:
+    config = dict(shared, **next(iter(studies.values())))
+    apps = [create_app(config)]
+else:
+    apps = list(create_multi_app(studies, shared).mounts.values())
+for application in apps:
+    wait_until_ready(application, 600)
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'ready_s': time.perf_counter() - t0, 'rss_mb': rss_kb / 1024}))
+"""
+
+
+def run_child(studies, shared):
+    """
+    Start the given studies in a fresh interpreter.
+
+    Args:
+        studies: Mapping of URL prefix to study config
+        shared: Config shared by all studies
+
+    Returns:
+        Dictionary with seconds until ready and peak RSS in MB
+    """
+    completed = subprocess.run(
+        [sys.executable, '-c', CHILD_SNIPPET, json.dumps(studies), json.dumps(shared)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Compare separate and shared hosting of several studies.')
+    parser.add_argument('--studies', type=int, default=3, help='Number of studies')
+    parser.add_argument('--prompts', type=int, default=200, help='Prompts per template')
+    parser.add_argument('--templates', type=int, default=2, help='Templates (audio subfolders)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"Generating {args.prompts * args.templates} prompts of audio in {work_dir} ...")
+        forum_config = build_fixture(work_dir, n_prompts=args.prompts, n_templates=args.templates, duration=0.5)
+        studies = {f"/study-{i}": {'FORUM_CONFIG': forum_config} for i in range(1, args.studies + 1)}
+        shared = {
+            'LOG_LEVEL': 'WARNING',
+            'AUDIO_INIT_BACKGROUND': False,
+            'RESULTS_DIR': os.path.join(work_dir, 'results'),
+            'STATE_BACKEND': f"sqlite:///{os.path.join(work_dir, 'state.sqlite3')}",  # Not instance/state.sqlite3
+            'AUDIO_INDEX_ENABLED': False,  # Measure the scan, not a cold index cache
+        }
+
+        separate = [run_child({prefix: config}, shared) for prefix, config in studies.items()]
+        multi = run_child(studies, shared)
+
+    print(f"\n=== {args.studies} studies on one audio tree ===\n")
+    print(f"{'':<10}{'ready s':>10}{'RSS MB':>10}")
+    print(f"{'separate':<10}{sum(r['ready_s'] for r in separate):>10.2f}{sum(r['rss_mb'] for r in separate):>10.1f}")
+    print(f"{'multi':<10}{multi['ready_s']:>10.2f}{multi['rss_mb']:>10.1f}")
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Blueprint for operator endpoints (profiling, telemetry, sessions, admission, quotas, screening) of the listening test forum.
+
+All routes require the ADMIN_TOKEN configured for the app, sent as the
+X-Admin-Token header. Without a configured token the routes do not exist (404).
+"""
+import hmac
+from flask import Blueprint, jsonify, request, current_app, abort
+from utils.quota import template_total
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@admin_bp.before_request
+def require_admin_token():
+    """
+    Reject requests without the configured admin token.
+    """
+    expected = current_app.config.get('ADMIN_TOKEN')
+    if not expected:
+        abort(404)
+    provided = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(provided.encode('utf-8'), str(expected).encode('utf-8')):
+        current_app.logger.warning(f"Rejected admin request to {request.path} from {request.remote_addr}")
+        abort(403)
+
+
+def _profiler():
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        abort(404)
+    return profiler
+
+
+@admin_bp.route('/profile/start', methods=['POST'])
+def start_profile():
+    """
+    Start a profiling capture on all workers.
+
+    Optional JSON payload: {"sampleRate": 0.25}
+
+    Returns:
+        JSON response with the profiler status
+    """
+    data = request.get_json(silent=True) or {}
+    sample_rate = data.get('sampleRate')
+    if sample_rate is not None and not isinstance(sample_rate, (int, float)):
+        return jsonify({'success': False, 'error': 'sampleRate must be a number'}), 400
+
+    profiler = _profiler()
+    profiler.start(sample_rate)
+    current_app.logger.info(f"Profiling capture started (sample rate {profiler.sample_rate})")
+    return jsonify({'success': True, 'status': profiler.status()})
+
+
+@admin_bp.route('/profile/stop', methods=['POST'])
+def stop_profile():
+    """
+    Stop the profiling capture and write the collapsed-stack and speedscope files.
+
+    Other workers write their own files on their next request.
+
+    Returns:
+        JSON response with the files written by this worker
+    """
+    profiler = _profiler()
+    files = profiler.stop()
+    current_app.logger.info(f"Profiling capture stopped, wrote {files}")
+    return jsonify({'success': True, 'files': files, 'status': profiler.status()})
+
+
+@admin_bp.route('/profile/status', methods=['GET'])
+def profile_status():
+    """
+    Report the capture state of the worker handling the request.
+
+    Returns:
+        JSON response with the profiler status
+    """
+    return jsonify(_profiler().status())
+
+
+@admin_bp.route('/admission', methods=['GET'])
+def admission_status():
+    """
+    Report active and queued participant sessions and the audio bandwidth.
+
+    Returns:
+        JSON response with the admission status
+    """
+    admission = current_app.extensions.get('admission')
+    if admission is None:
+        abort(404)
+    return jsonify(admission.status())
+
+
+@admin_bp.route('/quota', methods=['GET'])
+def quota_status():
+    """
+    Report ratings collected (and reserved) against each template's targets.
+
+    Returns:
+        JSON response {template: {'target_count', 'questions', 'reserved', 'prompts'}}
+    """
+    quota = current_app.extensions.get('quota')
+    if quota is None:
+        abort(404)
+    counted = quota.usage(include_reservations=False)
+    with_reserved = quota.usage()
+    report = {}
+    for q_template in current_app.config.get('FORUM', {}).get('questions', []):
+        template_id = q_template.get('id')
+        report[template_id] = {
+            'target_count': q_template.get('target_count'),
+            'target_per_model': q_template.get('target_per_model'),
+            'questions': template_total(counted, template_id),
+            'reserved': template_total(with_reserved, template_id) - template_total(counted, template_id),
+            'prompts': counted.get(template_id, {}),
+        }
+    return jsonify(report)
+
+
+@admin_bp.route('/screening', methods=['GET'])
+def screening_status():
+    """
+    Report screened and excluded sessions with the reasons for each exclusion.
+
+    Returns:
+        JSON response {'rules', 'screened', 'excluded', 'reasons': {uuid: [...]}}
+    """
+    screener = current_app.extensions.get('screening')
+    if screener is None:
+        abort(404)
+    return jsonify(screener.status())
+
+
+@admin_bp.route('/telemetry', methods=['GET'])
+def telemetry_summary():
+    """
+    Report live client timing percentiles per clip and per network class.
+
+    Covers the recent events received by the worker handling the request; use
+    analyze_results.py --telemetry for all workers.
+
+    Returns:
+        JSON response with the telemetry summary
+    """
+    aggregator = current_app.extensions.get('telemetry')
+    if aggregator is None:
+        abort(404)
+    return jsonify(aggregator.summary())
+
+
+@admin_bp.route('/session', methods=['GET'])
+def session_stats():
+    """
+    Report how the session interface handled requests in this process.
+
+    The same counters are exported as forum_session_events_total on /metrics.
+
+    Returns:
+        JSON response with session write counters (skipped, touched, refreshed, written, avoided)
+    """
+    interface = current_app.session_interface
+    stats = interface.stats() if hasattr(interface, 'stats') else {}
+    return jsonify(stats)
@@ -1,13 +1,37 @@
 """
 Blueprint for API endpoints of the listening test forum.
 """
+import json
 import os
-from flask import Blueprint, jsonify, request, session, current_app, redirect, url_for, send_from_directory
-from utils.saver import save
+import time
+from urllib.parse import quote
+from uuid import uuid4
+from flask import Blueprint, jsonify, request, session, current_app, redirect, url_for, send_from_directory, abort
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from utils.saver import save_once
+from utils.audio_bundle import MAX_CLIPS, bundle_etag, bundle_header, iter_bundle
+from utils.audio_variants import negotiate_question_variants, prompt_clips
+from utils.metrics import get_registry
+from utils.telemetry import known_clip, normalize_batch
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 
+def _metric(name):
+    """
+    Look up a metric registered in create_app.
+
+    Args:
+        name: Metric name
+
+    Returns:
+        The metric, or None if metrics are disabled
+    """
+    registry = get_registry(current_app)
+    return registry.metrics.get(name) if registry is not None else None
+
+
 @api_bp.route('/save', methods=['POST'])
 def save_answer():
     """
@@ -58,6 +82,13 @@ def save_answer():
 
     if not debug_mode and not metric_answers: # In non-debug, answers are expected
         return jsonify({'success': False, 'error': 'Missing required field: answers'}), 400
+
+    # Ratings are stored under metric IDs at finish; refuse names that would collide there
+    if isinstance(metric_answers, dict):
+        try:
+            current_app.extensions['metric_names'].compact(metric_answers)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
     
     # Initialize session answers dict if not present
     if 'answers' not in session:
@@ -73,12 +104,73 @@ def save_answer():
         'metrics': metric_answers,
         'timeSpent': time_spent
     }
+    # Nested mutation is not tracked by the session, and the cookie is no longer
+    # rewritten on every request (SESSION_REFRESH_EACH_REQUEST is off)
+    session.modified = True
     
     return jsonify({
         'success': True
     })
 
 
+def _record_finished_session(uuid_hex, answers, quota_ticket, result_file):
+    """
+    Screen a saved session and count its ratings towards the quotas and adaptive statistics.
+
+    Each step is guarded on its own and only logs its failure: the results are
+    already saved, and the finish request must still succeed. A session whose
+    screening fails is counted like an accepted one; if its ratings cannot be
+    counted, its reservation is released.
+
+    Args:
+        uuid_hex: Session UUID
+        answers: Answers as saved to the result file
+        quota_ticket: Session ticket holding the quota reservation, if any
+        result_file: Path of the saved result file, for log messages
+    """
+    # Screen the session; an excluded session's ratings are not counted below
+    excluded = False
+    screener = current_app.extensions.get('screening')
+    if screener is not None:
+        try:
+            reasons = screener.screen(uuid_hex, {'answers': answers})
+        except Exception as e:
+            current_app.logger.error(f"Screening failed for {os.path.basename(result_file)}, counting it: {e}")
+        else:
+            excluded = bool(reasons)
+            if excluded:
+                current_app.logger.info(f"Session {os.path.basename(result_file)} excluded by screening: {reasons}")
+            decisions = _metric('forum_screening_decisions_total')
+            if decisions is not None:
+                decisions.inc(decision='excluded' if excluded else 'accepted')
+
+    # Count the ratings towards the quotas; an excluded session frees its prompts
+    # for the next participants
+    quota = current_app.extensions.get('quota')
+    if quota is not None:
+        try:
+            if not excluded:
+                quota.record(answers, quota_ticket)
+            elif quota_ticket is not None:
+                quota.release(quota_ticket)
+        except Exception as e:
+            current_app.logger.error(f"Quota update failed for {os.path.basename(result_file)}: {e}")
+            if quota_ticket is not None:
+                try:
+                    quota.release(quota_ticket)
+                except Exception as e:
+                    # The reservation still expires after QUOTA_RESERVATION_TTL
+                    current_app.logger.error(f"Quota reservation could not be released: {e}")
+
+    # Update the rating statistics behind adaptive scheduling
+    scheduler = current_app.extensions.get('adaptive')
+    if scheduler is not None and not excluded:
+        try:
+            scheduler.record(answers)
+        except Exception as e:
+            current_app.logger.error(f"Adaptive statistics update failed for {os.path.basename(result_file)}: {e}")
+
+
 @api_bp.route('/finish', methods=['GET', 'POST'])
 def finish():
     """
@@ -108,6 +200,9 @@ def finish():
     # This list is ordered by presentation.
     session_question_instances = session.get('session_questions', [])
     
+    # Ratings are stored under compact metric IDs, named in the result's "metrics" header
+    metric_names = current_app.extensions['metric_names']
+
     # Combine answers with their corresponding randomization details
     final_answers_to_save = {}
     for i, q_instance_details in enumerate(session_question_instances):
@@ -120,7 +215,7 @@ def finish():
                 "audio_subfolder": q_instance_details.get("audioSubfolder"),
                 "prompt_id_selected": q_instance_details.get("promptId"),
                 "models_shuffled_order": q_instance_details.get("models"),
-                "metrics_rated": answer_data.get("metrics"), # The actual ratings
+                "metrics_rated": metric_names.compact(answer_data.get("metrics")), # The actual ratings
                 "time_spent_on_question": answer_data.get("timeSpent")
             }
         else:
@@ -150,12 +245,54 @@ def finish():
             
         # The 'answers' argument to save() is now final_answers_to_save,
         # which already includes all details. No separate randomization_details needed.
-        result_file = save(participant, final_answers_to_save, results_dir)
-        
+        # Saving is idempotent on the session UUID: a retried finish request, on
+        # any node, returns the first save instead of writing a second result.
+        uuid_hex = session.get('session_uuid') or uuid4().hex
+        metric_ids = [metric_id for answer in final_answers_to_save.values()
+                      for ratings in (answer['metrics_rated'] or {}).values() for metric_id in (ratings or {})]
+        write_start = time.perf_counter()
+        result_file, saved = save_once(
+            current_app.extensions['state'],
+            participant,
+            final_answers_to_save,
+            results_dir,
+            uuid_hex,
+            'debug_results' if debug_mode else 'results',
+            metric_names.header(metric_ids),
+            current_app.config.get('RESULTS_FORMAT', 'compact'),
+            current_app.config.get('RESULTS_COMPRESSION')
+        )
+        write_latency = _metric('forum_results_write_seconds')
+        if write_latency is not None:
+            write_latency.observe(time.perf_counter() - write_start)
+        if not saved:
+            current_app.logger.info(f"Results of this session were already saved as {os.path.basename(result_file)}")
+
+        # Study bookkeeping runs once, right after the first save. It must not fail the
+        # request: a retry would find the result saved and skip it for good.
+        # Debug runs are not part of the study; their reservation is only released.
+        quota_ticket = session.pop('quota_ticket', None)
+        if saved and not debug_mode:
+            _record_finished_session(uuid_hex, final_answers_to_save, quota_ticket, result_file)
+        elif quota_ticket is not None and current_app.extensions.get('quota') is not None:
+            # Also for a retry: the first finish already counted the session
+            try:
+                current_app.extensions['quota'].release(quota_ticket)
+            except Exception as e:
+                # The reservation still expires after QUOTA_RESERVATION_TTL
+                current_app.logger.error(f"Quota reservation could not be released: {e}")
+
         # Clear session data
         session.pop('participant', None)
         session.pop('answers', None)
         session.pop('session_questions', None)
+        session.pop('session_uuid', None)
+
+        # Free the admission slot for the next participant in the queue
+        ticket = session.pop('admission_ticket', None)
+        admission = current_app.extensions.get('admission')
+        if admission is not None and ticket is not None:
+            admission.release(ticket)
         
         if request.method == 'POST':
             return jsonify({
@@ -177,10 +314,158 @@ def finish():
             return redirect(url_for('questions.show', index=0))
 
 
+def _send_audio(directory, relative_path, mimetype, accel_prefix):
+    """
+    Send an audio file, or hand it off to the front proxy when AUDIO_OFFLOAD is 'x-accel'.
+
+    Args:
+        directory: Root directory of the file
+        relative_path: Path of the file relative to directory
+        mimetype: Content type of the file
+        accel_prefix: Internal nginx location that maps to directory
+
+    Returns:
+        Flask response
+    """
+    if current_app.config.get('AUDIO_OFFLOAD') == 'x-accel':
+        # nginx streams the file itself; the worker is released immediately.
+        # Reject traversal here since nginx will not apply send_from_directory's checks.
+        safe_path = safe_join(directory, relative_path)
+        if safe_path is None or not os.path.isfile(safe_path):
+            abort(404)
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(relative_path)
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response
+
+    # With AUDIO_OFFLOAD='x-sendfile', USE_X_SENDFILE makes this emit an X-Sendfile header
+    return send_from_directory(
+        directory,
+        relative_path,
+        mimetype=mimetype,
+        max_age=3600  # Cache for 1 hour
+    )
+
+
+def _count_audio_request(source, send, *args):
+    """
+    Send an audio file and count it as a browser cache hit (304), miss or not_found.
+
+    Responses are also counted as warm or cold for the audio warmer, and bytes
+    sent count towards the admission bandwidth budget, if configured.
+
+    Args:
+        source: 'original' or the variant format served
+        send: Function producing the response
+        *args: Arguments for send
+
+    Returns:
+        Flask response
+    """
+    audio_requests = _metric('forum_audio_requests_total')
+    try:
+        response = send(*args)
+    except NotFound:
+        if audio_requests is not None:
+            audio_requests.inc(result='not_found', source=source)
+        raise
+    if audio_requests is not None:
+        audio_requests.inc(result='hit' if response.status_code == 304 else 'miss', source=source)
+
+    # Whether the file had been read into the page cache ahead of the request
+    warmer = current_app.extensions.get('warmer')
+    if warmer is not None and response.status_code != 304:
+        warm = warmer.is_warm(os.path.join(args[0], args[1]))
+        warm_requests = _metric('forum_audio_warm_requests_total')
+        if warm_requests is not None:
+            warm_requests.inc(result='warm' if warm else 'cold')
+
+    # Count the body towards the admission bandwidth budget
+    admission = current_app.extensions.get('admission')
+    if admission is not None and admission.audio_budget and response.status_code != 304:
+        size = response.content_length
+        if size is None:  # X-Accel-Redirect: the proxy sends the file
+            size = os.path.getsize(safe_join(args[0], args[1]))
+        admission.record_audio_bytes(size)
+    return response
+
+
+def _client_formats():
+    """
+    Audio formats the requesting client can play.
+
+    Returns:
+        (format keys from the 'formats' query parameter, mimetypes from the Accept header)
+    """
+    client_formats = request.args.get('formats', '').split(',')
+    accepted = [mimetype for mimetype, quality in request.accept_mimetypes if quality > 0]
+    return client_formats, accepted
+
+
+def _question_variants(filename, client_formats, accepted=()):
+    """
+    Choose the variants of all clips of the prompt a clip belongs to.
+
+    Every clip of a question gets the same encoding, or the original file if
+    some clip has no variant the client can play (see utils/audio_variants.py).
+
+    Args:
+        filename: Path of a clip relative to the audio root
+        client_formats: Format keys reported by the client
+        accepted: Explicit mimetypes from the Accept header
+
+    Returns:
+        Dictionary mapping the prompt's clips to a variant entry or None;
+        empty when the clip has no variants
+    """
+    all_variants = current_app.config.get('AUDIO_VARIANTS', {})
+    if not all_variants.get(filename):
+        return {}
+    clips = prompt_clips(current_app.config.get('AUDIO_MODELS', {}), filename)
+    return negotiate_question_variants(all_variants, clips, client_formats, accepted)
+
+
+def _audio_source(filename, question_variants=None):
+    """
+    Choose the file that answers a request for an audio clip.
+
+    When the forum config sets 'audioVariantsRoot', the smallest pre-transcoded
+    encoding that the client supports for every clip of the question is
+    chosen, otherwise the original mp3.
+
+    Args:
+        filename: Path of the clip relative to the audio root
+        question_variants: Result of _question_variants for a clip of the same
+            prompt, if already negotiated
+
+    Returns:
+        (directory, path relative to it, content type, source for the metrics
+        ('original' or the variant format), accel prefix, has variants)
+    """
+    forum_config = current_app.config.get('FORUM', {})
+    variants = current_app.config.get('AUDIO_VARIANTS', {}).get(filename)
+    if variants:
+        if question_variants is None or filename not in question_variants:
+            question_variants = _question_variants(filename, *_client_formats())
+        variant = question_variants.get(filename)
+        if variant is not None:
+            return (forum_config.get('audioVariantsRoot'), variant['path'], variant['mime'], variant['format'],
+                    current_app.config['AUDIO_VARIANTS_ACCEL_PREFIX'], True)
+    return (forum_config.get('audioRoot', 'static/audio'), filename, 'audio/mpeg', 'original',
+            current_app.config['AUDIO_ACCEL_PREFIX'], bool(variants))
+
+
 @api_bp.route('/audio/<path:filename>')
 def serve_audio(filename):
     """
     Serve audio files with appropriate cache headers.
+
+    When the forum config sets 'audioVariantsRoot', a transcoded variant
+    supported by the client is served instead of the original mp3, in the
+    same encoding for all clips of the question (see utils/audio_variants.py).
+    In production the file body can be offloaded to nginx (X-Accel-Redirect)
+    or Apache (X-Sendfile), see AUDIO_OFFLOAD.
     
     Args:
         filename: Path to the audio file relative to the audio root
@@ -188,50 +473,153 @@ def serve_audio(filename):
     Returns:
         Audio file response
     """
-    forum_config = current_app.config.get('FORUM', {})
-    audio_root = forum_config.get('audioRoot', 'static/audio')
-    
-    # Log the request
-    current_app.logger.info(f"Audio request received for: {filename}")
-    current_app.logger.info(f"Audio root from config: {audio_root}")
-    
-    # # Handle the path correctly
-    # if audio_root.startswith('static/'):
-    #     # If audio_root starts with 'static/', we need to strip it for send_from_directory
-    #     directory = 'static'
-    #     # Remove 'static/' prefix from audio_root and prepend to filename
-    #     subpath = audio_root[7:]
-    #     if subpath:
-    #         filename = f"{subpath}/{filename}"
-    # else:
-    #     # If audio_root doesn't start with 'static/', prepend it to the directory
-    #     directory = f"static/{audio_root}"
-    
-    # Check if the file exists
-    import os
-    full_path = os.path.join(audio_root, filename)
-    current_app.logger.info(f"Full audio path: {full_path}")
-    current_app.logger.info(f"File exists: {os.path.exists(full_path)}")
-    
-    current_app.logger.info(f"Serving audio from directory: {audio_root}, file: {filename}")
-    
-    return send_from_directory(
-        audio_root,
-        filename,
-        mimetype='audio/mpeg',
-        max_age=3600  # Cache for 1 hour
-    )
+    current_app.logger.debug(f"Audio request received for: {filename}")
+
+    # Serve a pre-transcoded variant the client can play, if any
+    directory, relative_path, mimetype, source, accel_prefix, has_variants = _audio_source(filename)
+    if source != 'original':
+        current_app.logger.debug(f"Serving {source} variant {relative_path} for {filename}")
+    response = _count_audio_request(source, _send_audio, directory, relative_path, mimetype, accel_prefix)
+    if has_variants:
+        response.vary.add('Accept')
+    if source != 'original':
+        return response
+
+    # Duration hint from the audio index, so players need not probe the stream
+    clip_info = current_app.config.get('AUDIO_INDEX', {}).get(filename)
+    if clip_info and clip_info.get('duration'):
+        response.headers['X-Content-Duration'] = f"{clip_info['duration']:.3f}"
+    return response
+
+
+@api_bp.route('/audio/bundle')
+def serve_audio_bundle():
+    """
+    Serve all clips of a question as one response (see utils/audio_bundle.py).
+
+    Query parameters: 'subfolder' and 'prompt' of the question, 'tags' (comma
+    separated, e.g. "prompt,gt,methodA") and 'formats' as for /api/audio/. Each
+    clip is chosen like a single /api/audio/ request would choose it, so all
+    come in one encoding or all as originals. The body
+    is read by the worker, so AUDIO_OFFLOAD does not apply; the bundle saves
+    the per-request overhead of the clips instead.
+
+    Returns:
+        application/octet-stream bundle, 304 when the client's copy is current,
+        400 for a malformed request or 404 when a clip is missing
+    """
+    subfolder = request.args.get('subfolder', '')
+    prompt_id = request.args.get('prompt', '')
+    tags = [tag for tag in request.args.get('tags', '').split(',') if tag]
+    if not prompt_id or not tags or len(tags) > MAX_CLIPS or len(set(tags)) != len(tags):
+        abort(400)
+
+    audio_requests = _metric('forum_audio_requests_total')
+    audio_index = current_app.config.get('AUDIO_INDEX', {})
+    clips, has_variants, question_variants = [], False, None
+    for tag in tags:
+        filename = f"{subfolder}/{prompt_id}_{tag}.mp3" if subfolder else f"{prompt_id}_{tag}.mp3"
+        if question_variants is None and current_app.config.get('AUDIO_VARIANTS', {}).get(filename):
+            # Negotiated once for the prompt's clips
+            question_variants = _question_variants(filename, *_client_formats())
+        directory, relative_path, mimetype, source, _, variants = _audio_source(filename, question_variants)
+        path = safe_join(directory, relative_path) if directory else None
+        stat = os.stat(path) if path is not None and os.path.isfile(path) else None
+        if stat is None:
+            if audio_requests is not None:
+                audio_requests.inc(result='not_found', source='bundle')
+            abort(404)
+        has_variants = has_variants or variants
+        clips.append({
+            'tag': tag, 'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'mime': mimetype,
+            'url': url_for('api.serve_audio', filename=filename),
+            'duration': (audio_index.get(filename) or {}).get('duration') if source == 'original' else None,
+        })
+
+    header, size = bundle_header(clips)
+    response = current_app.response_class(iter_bundle(header, clips), mimetype='application/octet-stream')
+    response.content_length = size
+    response.set_etag(bundle_etag(clips))
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600  # Like the single clips
+    if has_variants:
+        response.vary.add('Accept')
+    response = response.make_conditional(request)
+    if audio_requests is not None:
+        audio_requests.inc(result='hit' if response.status_code == 304 else 'miss', source='bundle')
+    if response.status_code == 304:
+        return response
+
+    # Warm/cold per clip, and the whole body towards the admission bandwidth budget
+    warmer = current_app.extensions.get('warmer')
+    if warmer is not None:
+        warm_requests = _metric('forum_audio_warm_requests_total')
+        if warm_requests is not None:
+            for clip in clips:
+                warm_requests.inc(result='warm' if warmer.is_warm(clip['path']) else 'cold')
+    admission = current_app.extensions.get('admission')
+    if admission is not None and admission.audio_budget:
+        admission.record_audio_bytes(size)
+    return response
+
+
+@api_bp.route('/telemetry', methods=['POST'])
+def telemetry():
+    """
+    Receive a batch of client timing events (sent with navigator.sendBeacon).
+
+    The session is not opened for this route. sendBeacon posts the JSON as
+    text/plain, so the body is parsed regardless of its content type.
+
+    Expected payload:
+    {
+        "network": "4g",                  // navigator.connection.effectiveType
+        "formats": ["opus", "mp3"],       // Formats the browser can play
+        "events": [
+            {"type": "clip", "clip": "task_1/001_gt.mp3", "ttfb": 85, "load": 640, "stalls": 1, "stallMs": 420, "bytes": 48213},
+            {"type": "page", "template": "q1", "prompt": "001", "question": 2, "pageTime": 41250}
+        ]
+    }
+
+    Returns:
+        Empty 204 response
+    """
+    aggregator = current_app.extensions.get('telemetry')
+    if aggregator is None:
+        abort(404)
+    if (request.content_length or 0) > current_app.config['TELEMETRY_MAX_BODY']:
+        abort(413)
+
+    try:
+        payload = json.loads(request.get_data(cache=False))
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
+
+    audio_models = current_app.config.get('AUDIO_MODELS', {})
+    events = normalize_batch(payload, lambda clip: known_clip(audio_models, clip))
+    if events:
+        # Record which encoding was served, using the same negotiation as serve_audio
+        client_formats = payload.get('formats') if isinstance(payload.get('formats'), list) else []
+        client_formats = [f for f in client_formats if isinstance(f, str)]
+        for event in events:
+            if event['type'] == 'clip' and 'format' not in event:
+                variant = _question_variants(event['clip'], client_formats).get(event['clip'])
+                event['format'] = variant['format'] if variant else 'mp3'
+        aggregator.add(events)
+    return '', 204
 
 
 @api_bp.route('/heartbeat', methods=['GET'])
 def heartbeat():
     """
     Simple heartbeat endpoint to keep session alive.
+
+    The session is never decoded here: the session interface only checks the
+    cookie signature and re-signs it once it is older than SESSION_REFRESH_AFTER.
     
     Returns:
         JSON response with timestamp
     """
-    import time
     return jsonify({
         'timestamp': int(time.time())
-    })
\ No newline at end of file
+    })
@@ -0,0 +1,32 @@
+"""
+Blueprint for the readiness probe of the listening test forum.
+"""
+from flask import Blueprint, jsonify, current_app
+from utils.startup import is_ready
+
+health_bp = Blueprint('health', __name__)
+
+
+@health_bp.route('/healthz')
+def healthz():
+    """
+    Report whether the app is ready to serve participants.
+
+    The audio scan, index and validation run in the background at startup
+    (see utils/startup.py); until they finish this returns 503 so load
+    balancers and orchestrators hold traffic back.
+
+    Returns:
+        JSON response with the readiness status
+    """
+    if not is_ready(current_app):
+        return jsonify({'status': 'starting'}), 503
+
+    audio_models = current_app.config.get('AUDIO_MODELS', {})
+    return jsonify({
+        'status': 'ready',
+        'subfolders': len(audio_models),
+        'prompts': sum(len(prompts) for prompts in audio_models.values()),
+        'indexedClips': len(current_app.config.get('AUDIO_INDEX', {})),
+        'validationErrors': len(current_app.config.get('AUDIO_ERRORS', [])),
+    })
@@ -0,0 +1,25 @@
+"""
+Blueprint for the Prometheus-style metrics endpoint.
+"""
+from flask import Blueprint, current_app, abort
+from utils.metrics import get_registry
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def export():
+    """
+    Export request, audio and results-write metrics of all worker processes.
+
+    Returns:
+        Metrics in the Prometheus text exposition format
+    """
+    registry = get_registry(current_app)
+    if registry is None:
+        abort(404)
+
+    response = current_app.response_class(registry.render(), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.cache_control.no_store = True
+    return response
@@ -45,9 +45,13 @@ def show(index):
         current_app.logger.warning(f"Invalid question index {index} for {len(session_questions)} session questions. Redirecting to first question.")
         return redirect(url_for('questions.show', index=0))
 
+    # Keep the admission slot of this session (see utils/admission.py)
+    admission = current_app.extensions.get('admission')
+    if admission is not None and 'admission_ticket' in session:
+        admission.touch(session['admission_ticket'])
+
     # Get the specific question instance for this index
     question_to_render = session_questions[index]
-    print("question_to_render", question_to_render)
     
     # 'question_to_render' already contains:
     # original_question_id, title, audioSubfolder, promptId (selected), models (shuffled), metrics
@@ -55,6 +59,22 @@ def show(index):
     current_app.logger.info(f"Showing question index {index}: original_id='{question_to_render.get('original_question_id')}', promptId='{question_to_render.get('promptId')}', subfolder='{question_to_render.get('audioSubfolder')}'")
     current_app.logger.info(f"Models for this instance: {question_to_render.get('models')}")
 
+    # Duration and size hints for each clip, from the audio index built at startup
+    audio_index = current_app.config.get('AUDIO_INDEX', {})
+    audio_hints = {}
+    for tag in ['prompt'] + list(question_to_render.get('models', [])):
+        clip_info = audio_index.get(f"{question_to_render.get('audioSubfolder')}/{question_to_render.get('promptId')}_{tag}.mp3")
+        if clip_info:
+            audio_hints[tag] = {'duration': clip_info.get('duration'), 'size': clip_info.get('size')}
+
+    # All clips of the question in one request (see utils/audio_bundle.py); tags are
+    # sorted so every participant's page asks for the same, cacheable URL
+    audio_bundle_url = None
+    if current_app.config.get('AUDIO_BUNDLE'):
+        audio_bundle_url = url_for('api.serve_audio_bundle', subfolder=question_to_render.get('audioSubfolder'),
+                                   prompt=question_to_render.get('promptId'),
+                                   tags=','.join(['prompt'] + sorted(question_to_render.get('models', []))))
+
     is_last = index == len(session_questions) - 1
     debug_mode = forum_config.get('debug', False) # Still useful for client-side debug flags
 
@@ -69,5 +89,7 @@ def show(index):
         next_url=url_for('questions.show', index=index+1) if not is_last else url_for('thankyou.show'), # Changed to thankyou.show
         prev_url=url_for('questions.show', index=index-1) if index > 0 else url_for('rules.index'),
         audio_root=forum_config.get('audioRoot', 'static/audio'),
+        audio_hints=audio_hints,
+        audio_bundle_url=audio_bundle_url,
         debug_mode=debug_mode
     )
\ No newline at end of file
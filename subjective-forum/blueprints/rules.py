@@ -1,14 +1,38 @@
 """
 Blueprint for the rules page of the listening test forum.
 """
-import markdown2
+from functools import lru_cache
 from pathlib import Path
+from uuid import uuid4
 from flask import Blueprint, render_template, redirect, url_for, session, current_app, flash
 from utils.loader import select_and_randomize_questions_for_session # Import the new function
+from utils.startup import wait_until_ready
+from utils.admission import new_ticket
+from utils.quota import quotas_met
+from utils.warmer import warm_after_assignment
+from utils.metrics import get_registry
 
 rules_bp = Blueprint('rules', __name__, url_prefix='/rules')
 
 
+@lru_cache(maxsize=8)
+def _render_markdown(path, mtime_ns):
+    """
+    Convert a markdown file to HTML, cached until the file changes.
+
+    Args:
+        path: Markdown file path
+        mtime_ns: Modification time of the file (part of the cache key)
+
+    Returns:
+        Rendered HTML
+    """
+    # markdown2 is only needed here; importing it lazily keeps app startup fast
+    import markdown2
+    with open(path, 'r', encoding='utf-8') as f:
+        return markdown2.markdown(f.read())
+
+
 @rules_bp.route('/')
 def index():
     """
@@ -49,9 +73,7 @@ def index():
         # Try to load and convert markdown to HTML
         rules_path = Path('config') / rules_md_file
         if rules_path.exists():
-            with open(rules_path, 'r', encoding='utf-8') as f:
-                rules_content = f.read()
-                rules_html = markdown2.markdown(rules_content)
+            rules_html = _render_markdown(str(rules_path), rules_path.stat().st_mtime_ns)
         else:
             rules_html = "<p>Rules content not found.</p>"
     except Exception as e:
@@ -67,6 +89,40 @@ def index():
     )
 
 
+def _admit(admission, forum_config):
+    """
+    Admit the participant's session or build the waiting page.
+
+    Args:
+        admission: The app's AdmissionController
+        forum_config: Forum configuration
+
+    Returns:
+        None if admitted, otherwise the waiting page response
+    """
+    if 'admission_ticket' not in session:
+        session['admission_ticket'] = new_ticket()
+    admitted, position = admission.admit(session['admission_ticket'])
+
+    registry = get_registry(current_app)
+    if registry is not None:
+        registry.metrics['forum_admission_decisions_total'].inc(result='admitted' if admitted else 'queued')
+    if admitted:
+        return None
+
+    retry_after = admission.retry_after(position, current_app.config['ADMISSION_RETRY_SECONDS'])
+    current_app.logger.info(f"Session queued at position {position}, retrying in {retry_after}s")
+
+    branding = forum_config.get('branding', {})
+    return render_template(
+        'waiting.html',
+        title=branding.get('title', 'Listening Survey'),
+        accent_color=branding.get('accentColor', '#888888'),
+        position=position,
+        retry_after=retry_after
+    )
+
+
 @rules_bp.route('/begin')
 def begin():
     """
@@ -87,20 +143,45 @@ def begin():
     
     # Generate and store the full, randomized question instances for the session
     if 'session_questions' not in session:
+        # The audio scan may still be running in the background (see utils/startup.py)
+        if not wait_until_ready(current_app):
+            current_app.logger.warning("Audio data not ready in time for rules/begin.")
+            flash("The survey is still starting up. Please try again in a moment.", "error")
+            return redirect(url_for('rules.index'))
+
+        # Over the session or audio bandwidth limit: wait in the queue instead
+        admission = current_app.extensions.get('admission')
+        if admission is not None:
+            waiting_page = _admit(admission, forum_config)
+            if waiting_page is not None:
+                return waiting_page
+
         question_templates = forum_config.get('questions', [])
         # n_questions_to_present = forum_config.get('n_questions', 0) # Global n_questions removed
         scanned_audio_data = current_app.config.get('AUDIO_MODELS', {}) # This is populated at app start
 
+        # Only assign items that still need ratings (see utils/quota.py)
+        quota = current_app.extensions.get('quota')
+        quota_usage = quota.usage() if quota is not None else None
+
         resolved_session_questions = select_and_randomize_questions_for_session(
             question_templates,
-            scanned_audio_data
+            scanned_audio_data,
             # n_questions_to_present # This argument is removed from the function
+            quota_usage,
+            current_app.extensions.get('adaptive')
         )
 
         # how many sacnned_audio_data are available? show numbers of available prompts
         current_app.logger.info(f"Number of available prompts: {len(scanned_audio_data)}")
 
         if not resolved_session_questions:
+            if admission is not None:
+                admission.release(session['admission_ticket'])
+            if quota_usage is not None and quotas_met(question_templates, quota_usage, scanned_audio_data):
+                current_app.logger.info("All rating quotas are met; not starting a new session.")
+                flash("This study has collected all the ratings it needs. Thank you for your interest!", "info")
+                return redirect(url_for('cover.index'))
             current_app.logger.error("Failed to generate any questions for the session. Check config and audio files.")
             # Flash a message to the user and redirect them, perhaps to the cover page or an error page.
             flash("Sorry, there was an error setting up the survey. Not enough unique audio prompts may be available for the configured questions. Please contact the administrator.", "error")
@@ -108,7 +189,14 @@ def begin():
             # Or, if you have an error page: return render_template('error.html', message="...")
 
         session['session_questions'] = resolved_session_questions
+        # Results are saved once per session UUID, whichever node handles finish
+        session['session_uuid'] = uuid4().hex
+        if quota is not None:
+            session['quota_ticket'] = new_ticket()
+            quota.reserve(session['quota_ticket'], resolved_session_questions)
         current_app.logger.info(f"Generated {len(resolved_session_questions)} questions for session.")
+        # Read this session's clips ahead of its requests (see utils/warmer.py)
+        warm_after_assignment(current_app, resolved_session_questions)
         
         # Clear any old 'answers' if starting a new set of questions
         if 'answers' in session:
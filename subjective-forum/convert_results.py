@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Script to convert a directory of result files to another record format.
+
+Result files of every format (indented JSON, compact schema 2 records, gzip or
+zstd compressed; see utils/saver.py) are read and written again in the chosen
+format, with the same UUID and timestamp and so the same file name apart from
+the compression suffix. Without --output-dir the directory is converted in
+place and the old files are removed once the new ones are written.
+"""
+import argparse
+import os
+
+from utils.saver import RECORD_FORMATS, COMPRESSION_SUFFIXES, read_result, result_paths, save
+from utils.screening import result_uuid
+
+
+def convert_results(results_dir, output_dir=None, record_format='compact', compression=None):
+    """
+    Rewrite every result file of a directory.
+
+    Args:
+        results_dir: Directory of result files
+        output_dir: Directory for the converted files (default: results_dir, in place)
+        record_format: 'compact' or 'json'
+        compression: None, 'gzip' or 'zstd'
+
+    Returns:
+        (files converted, bytes before, bytes after)
+    """
+    in_place = output_dir is None or os.path.abspath(output_dir) == os.path.abspath(results_dir)
+    converted, before, after = 0, 0, 0
+    for path in result_paths(results_dir):
+        data = read_result(path)
+        before += os.path.getsize(path)
+        new_path = save(data['participant'], data['answers'], output_dir or results_dir, result_uuid(data, path),
+                        data['timestamp'], data.get('metrics'), record_format, compression)
+        after += os.path.getsize(new_path)
+        # In place, a file with another compression suffix is replaced by the new one
+        if in_place and os.path.abspath(new_path) != os.path.abspath(path):
+            os.remove(path)
+        converted += 1
+    return converted, before, after
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Convert result files to another record format.')
+    parser.add_argument('--results-dir', default='results',
+                        help='Directory of the result files')
+    parser.add_argument('--output-dir', default=None,
+                        help='Directory for the converted files (default: convert in place)')
+    parser.add_argument('--format', choices=RECORD_FORMATS, default='compact',
+                        help='Record format to write (see utils/saver.py)')
+    parser.add_argument('--compression', choices=[c for c in COMPRESSION_SUFFIXES if c], default=None,
+                        help='Compress the converted files')
+
+    args = parser.parse_args()
+
+    converted, before, after = convert_results(args.results_dir, args.output_dir, args.format, args.compression)
+    print(f"Converted {converted} result files to {args.output_dir or args.results_dir}")
+    if converted:
+        print(f"Size: {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB ({after / before:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Script to export the results stored in the shared state backend as result files.
+
+In a scale-out deployment every node writes the results it saves to its own
+RESULTS_DIR, while the shared backend (STATE_BACKEND, see utils/state.py) holds
+the results of all nodes. This script writes the ones missing from a directory,
+in the format of the server's result files, so analyze_results.py sees the
+whole study.
+"""
+import argparse
+
+from utils.saver import RECORD_FORMATS, export_results
+from utils.state import PREFIX, open_backend
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Export results from the shared state backend.')
+    parser.add_argument('--backend', required=True,
+                        help='STATE_BACKEND URL, e.g. redis://localhost:6379/0 or sqlite:///instance/state.sqlite3')
+    parser.add_argument('--output-dir', default='results',
+                        help='Directory for the result files')
+    parser.add_argument('--study', default=None,
+                        help='Study name when several studies share the backend (see create_multi_app)')
+    parser.add_argument('--debug', action='store_true',
+                        help='Export the results of debug runs instead')
+    parser.add_argument('--format', choices=RECORD_FORMATS, default='compact',
+                        help='Result file format (RESULTS_FORMAT, see utils/saver.py)')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None,
+                        help='Compress the result files (RESULTS_COMPRESSION)')
+
+    args = parser.parse_args()
+
+    backend = open_backend(args.backend, f"{PREFIX}{args.study}:" if args.study else PREFIX)
+    written = export_results(backend, args.output_dir, 'debug_results' if args.debug else 'results',
+                             args.format, args.compression)
+    print(f"Wrote {written} result files to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
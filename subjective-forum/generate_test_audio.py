@@ -2,13 +2,37 @@
 """
 Script to generate dummy audio files for testing the Subjective Listening Test Forum.
 This creates simple sine wave tones with different frequencies for each model.
+
+Tones are synthesized for all tags of a prompt at once and piped to ffmpeg as raw
+PCM. Prompts are encoded in parallel by a process pool (--workers). The output
+only depends on the arguments and --seed, so fixture trees can be rebuilt
+byte-for-byte. With --tasks the files are written to task_1/ ... task_N/
+subfolders, the layout scan_audio_directory expects.
 """
 import os
+import sys
 import argparse
+import shutil
+import zlib
+from multiprocessing import Pool
+
 import numpy as np
 from scipy.io import wavfile
 import subprocess
-from pathlib import Path
+
+SAMPLE_RATE = 44100
+FREQUENCY_STEPS = 20  # Base frequencies repeat after this many prompts and stay below Nyquist
+TONE_CACHE_SIZE = 256  # Tones kept per process
+
+_TONE_CACHE = {}  # (freq, duration, sample rate) -> PCM bytes
+
+# Model frequency multipliers
+MODEL_MULTIPLIERS = {
+    'prompt': 1.0,
+    'gt': 1.0,
+    'methodA': 1.2,
+    'methodB': 0.8
+}
 
 def generate_sine_wave(freq, duration, sample_rate=44100):
     """
@@ -22,9 +46,56 @@ def generate_sine_wave(freq, duration, sample_rate=44100):
     Returns:
         Numpy array containing the sine wave
     """
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    sine = 0.5 * np.sin(2 * np.pi * freq * t)
-    return sine
+    return generate_sine_waves([freq], duration, sample_rate)[0]
+
+def generate_sine_waves(freqs, duration, sample_rate=44100):
+    """
+    Generate sine waves at several frequencies in one vectorized step.
+    
+    Args:
+        freqs: Frequencies in Hz
+        duration: Duration in seconds
+        sample_rate: Sample rate in Hz
+        
+    Returns:
+        Numpy array of shape (len(freqs), samples)
+    """
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    return 0.5 * np.sin(2 * np.pi * np.asarray(freqs, dtype=float)[:, None] * t)
+
+def to_pcm16(audio_data):
+    """
+    Convert audio in [-1, 1] to 16-bit PCM.
+    
+    Args:
+        audio_data: Audio data as numpy array
+        
+    Returns:
+        int16 numpy array
+    """
+    return (np.clip(audio_data, -1.0, 1.0) * 32767).astype(np.int16)
+
+def tones_pcm(freqs, duration, sample_rate=44100):
+    """
+    16-bit PCM bytes of several tones, synthesized together.
+
+    Tones are cached per process, as base frequencies repeat across prompts.
+    
+    Args:
+        freqs: Frequencies in Hz
+        duration: Duration in seconds
+        sample_rate: Sample rate in Hz
+        
+    Returns:
+        List of little-endian signed 16-bit mono samples, one per frequency
+    """
+    missing = [f for f in dict.fromkeys(freqs) if (f, duration, sample_rate) not in _TONE_CACHE]
+    if missing:
+        if len(_TONE_CACHE) + len(missing) > TONE_CACHE_SIZE:
+            _TONE_CACHE.clear()
+        for freq, row in zip(missing, to_pcm16(generate_sine_waves(missing, duration, sample_rate))):
+            _TONE_CACHE[(freq, duration, sample_rate)] = row.astype('<i2').tobytes()
+    return [_TONE_CACHE[(f, duration, sample_rate)] for f in freqs]
 
 def save_wav(filename, audio_data, sample_rate=44100):
     """
@@ -35,36 +106,140 @@ def save_wav(filename, audio_data, sample_rate=44100):
         audio_data: Audio data as numpy array
         sample_rate: Sample rate in Hz
     """
-    # Ensure audio data is in the correct range
-    audio_data = np.clip(audio_data, -1.0, 1.0)
-    
-    # Convert to 16-bit PCM
-    audio_data_16bit = (audio_data * 32767).astype(np.int16)
-    
-    # Save WAV file
-    wavfile.write(filename, sample_rate, audio_data_16bit)
+    # Convert to 16-bit PCM and save WAV file
+    wavfile.write(filename, sample_rate, to_pcm16(audio_data))
 
-def convert_to_mp3(wav_file, mp3_file):
+def encode_mp3(pcm, mp3_file, sample_rate=44100):
     """
-    Convert WAV file to MP3 using ffmpeg.
+    Encode 16-bit mono PCM to MP3 by piping it to ffmpeg (no temporary WAV).
     
     Args:
-        wav_file: Input WAV file
+        pcm: Little-endian signed 16-bit samples
         mp3_file: Output MP3 file
+        sample_rate: Sample rate in Hz
+
+    Returns:
+        True if the file was written
     """
     try:
         subprocess.run([
-            'ffmpeg', '-y', '-i', wav_file, '-codec:a', 'libmp3lame', 
-            '-qscale:a', '2', mp3_file
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print(f"Created {mp3_file}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting {wav_file} to MP3: {e}")
-    except FileNotFoundError:
-        print("ffmpeg not found. Please install ffmpeg to convert to MP3.")
-        print(f"WAV file saved as {wav_file}")
-
-def generate_test_audio(output_dir, prompt_ids, models, duration=3.0):
+            'ffmpeg', '-y', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+            '-codec:a', 'libmp3lame', '-qscale:a', '2', mp3_file
+        ], input=pcm, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Error encoding {mp3_file}: {e}")
+        if os.path.exists(mp3_file):
+            os.remove(mp3_file)  # A partial file would pass for a fixture clip
+        return False
+    print(f"Created {mp3_file}")
+    return True
+
+def write_silent_mp3(mp3_file, duration, bitrate_kbps=128, sample_rate=44100):
+    """
+    Write a frame-valid silent MP3 without an encoder.
+
+    Each frame is an MPEG-1 Layer III mono header followed by zeroed side info and
+    main data, which every decoder plays back as silence. Useful for load-test
+    fixtures where byte sizes and durations matter but ffmpeg is not installed.
+    
+    Args:
+        mp3_file: Output MP3 file
+        duration: Duration in seconds
+        bitrate_kbps: Constant bitrate in kbps (32-320)
+        sample_rate: Sample rate in Hz (44100, 48000 or 32000)
+    """
+    bitrate_index = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320].index(bitrate_kbps)
+    sample_rate_index = [44100, 48000, 32000].index(sample_rate)
+    frame_count = int(np.ceil(duration * sample_rate / 1152))
+
+    # Sync, MPEG-1, Layer III, no CRC / bitrate, sample rate, no padding / mono, original
+    header = bytes([0xFF, 0xFB, (bitrate_index << 4) | (sample_rate_index << 2), 0xC4])
+    frame_length = 144 * bitrate_kbps * 1000 // sample_rate
+    frame = header + bytes(frame_length - len(header))
+
+    with open(mp3_file, 'wb') as f:
+        f.write(frame * frame_count)
+    print(f"Created {mp3_file}")
+
+def tone_frequencies(prompt_index, tags, seed=0):
+    """
+    Tone frequency of each tag of a prompt.
+
+    Known models use fixed multipliers of the prompt's base frequency. Other
+    models get a multiplier between 0.7 and 1.3 derived from the seed and the
+    model name, so they sound the same in every run and every worker.
+    
+    Args:
+        prompt_index: Position of the prompt in the prompt list
+        tags: 'prompt' and model names
+        seed: Random seed for custom models
+        
+    Returns:
+        List of frequencies in Hz
+    """
+    base_freq = 220 * (1 + (prompt_index % FREQUENCY_STEPS) * 0.2)
+    freqs = []
+    for tag in tags:
+        multiplier = MODEL_MULTIPLIERS.get(tag)
+        if multiplier is None:
+            rng = np.random.default_rng([seed, zlib.crc32(tag.encode('utf-8'))])
+            multiplier = 0.7 + 0.6 * rng.random()
+        freqs.append(base_freq * multiplier)
+    return freqs
+
+def generate_prompt_audio(job):
+    """
+    Write the audio files of one prompt ('prompt' and every model).
+    
+    Args:
+        job: Tuple (output_dir, prompt_index, prompt_id, models, duration, silent, seed, encoder)
+             where encoder is False when ffmpeg is missing (WAV files are kept instead)
+        
+    Returns:
+        Number of files written (fewer than the tags if encoding failed)
+    """
+    output_dir, prompt_index, prompt_id, models, duration, silent, seed, encoder = job
+    tags = ['prompt'] + list(models)
+
+    if silent:
+        for tag in tags:
+            write_silent_mp3(os.path.join(output_dir, f"{prompt_id}_{tag}.mp3"), duration)
+        return len(tags)
+
+    written = 0
+    for tag, pcm in zip(tags, tones_pcm(tone_frequencies(prompt_index, tags, seed), duration, SAMPLE_RATE)):
+        if encoder:
+            written += encode_mp3(pcm, os.path.join(output_dir, f"{prompt_id}_{tag}.mp3"), SAMPLE_RATE)
+        else:
+            wav_file = os.path.join(output_dir, f"{prompt_id}_{tag}.wav")
+            wavfile.write(wav_file, SAMPLE_RATE, np.frombuffer(pcm, dtype='<i2'))
+            print(f"WAV file saved as {wav_file}")
+            written += 1
+    return written
+
+def run_jobs(jobs, workers=1):
+    """
+    Run prompt jobs, in a process pool when workers > 1.
+    
+    Args:
+        jobs: Arguments of generate_prompt_audio
+        workers: Number of worker processes
+        
+    Returns:
+        Number of files written
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return sum(generate_prompt_audio(job) for job in jobs)
+    with Pool(min(workers, len(jobs))) as pool:
+        return sum(pool.imap_unordered(generate_prompt_audio, jobs, chunksize=max(1, len(jobs) // (workers * 8))))
+
+def _encoder_available(silent):
+    if silent or shutil.which('ffmpeg') is not None:
+        return True
+    print("ffmpeg not found. Please install ffmpeg to convert to MP3.")
+    return False
+
+def generate_test_audio(output_dir, prompt_ids, models, duration=3.0, silent=False, workers=1, seed=0):
     """
     Generate test audio files for the specified prompt IDs and models.
     
@@ -73,51 +248,43 @@ def generate_test_audio(output_dir, prompt_ids, models, duration=3.0):
         prompt_ids: List of prompt IDs
         models: List of model names
         duration: Duration of each audio file in seconds
-    """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Base frequencies for different prompt IDs
-    base_freqs = {
-        prompt_id: 220 * (1 + i * 0.2) for i, prompt_id in enumerate(prompt_ids)
-    }
-    
-    # Model frequency multipliers
-    model_multipliers = {
-        'prompt': 1.0,
-        'gt': 1.0,
-        'methodA': 1.2,
-        'methodB': 0.8
-    }
-    
-    # Generate audio for each prompt and model
-    for prompt_id in prompt_ids:
-        base_freq = base_freqs[prompt_id]
+        silent: Write silent MP3s directly instead of encoding tones with ffmpeg
+        workers: Number of worker processes
+        seed: Random seed for the tones of custom models
         
-        # Generate prompt audio
-        prompt_audio = generate_sine_wave(base_freq, duration)
-        wav_file = os.path.join(output_dir, f"{prompt_id}_prompt.wav")
-        mp3_file = os.path.join(output_dir, f"{prompt_id}_prompt.mp3")
-        save_wav(wav_file, prompt_audio)
-        convert_to_mp3(wav_file, mp3_file)
+    Returns:
+        Number of files written
+    """
+    return generate_test_tree(output_dir, None, prompt_ids, models, duration, silent, workers, seed)
+
+def generate_test_tree(root, tasks, prompt_ids, models, duration=3.0, silent=False, workers=1, seed=0):
+    """
+    Generate test audio for several question templates in one process pool.
+    
+    Args:
+        root: Audio root directory
+        tasks: Number of task_N subfolders, or None to write into root directly
+        prompt_ids: List of prompt IDs (the same in every subfolder)
+        models: List of model names
+        duration: Duration of each audio file in seconds
+        silent: Write silent MP3s directly instead of encoding tones with ffmpeg
+        workers: Number of worker processes
+        seed: Random seed for the tones of custom models
         
-        # Generate model audio
-        for model in models:
-            if model in model_multipliers:
-                freq = base_freq * model_multipliers[model]
-            else:
-                # For custom models, use a random multiplier between 0.7 and 1.3
-                freq = base_freq * (0.7 + 0.6 * np.random.random())
-            
-            model_audio = generate_sine_wave(freq, duration)
-            wav_file = os.path.join(output_dir, f"{prompt_id}_{model}.wav")
-            mp3_file = os.path.join(output_dir, f"{prompt_id}_{model}.mp3")
-            save_wav(wav_file, model_audio)
-            convert_to_mp3(wav_file, mp3_file)
-    
-    # Clean up WAV files
-    for wav_file in Path(output_dir).glob("*.wav"):
-        os.remove(wav_file)
+    Returns:
+        Number of files written
+    """
+    folders = [root] if tasks is None else [os.path.join(root, f"task_{t}") for t in range(1, tasks + 1)]
+    for folder in folders:
+        # Create output directory if it doesn't exist
+        os.makedirs(folder, exist_ok=True)
+
+    encoder = _encoder_available(silent)
+    jobs = [
+        (folder, i, prompt_id, list(models), duration, silent, seed, encoder)
+        for folder in folders for i, prompt_id in enumerate(prompt_ids)
+    ]
+    return run_jobs(jobs, workers)
 
 def main():
     """Main function."""
@@ -126,22 +293,40 @@ def main():
                         help='Output directory for audio files')
     parser.add_argument('--prompt-ids', default='001,002,003',
                         help='Comma-separated list of prompt IDs')
+    parser.add_argument('--num-prompts', type=int, default=None,
+                        help='Generate prompt IDs 001 ... N instead of --prompt-ids')
+    parser.add_argument('--tasks', type=int, default=None,
+                        help='Write task_1/ ... task_N/ subfolders under the output directory')
     parser.add_argument('--models', default='gt,methodA,methodB',
                         help='Comma-separated list of model names')
     parser.add_argument('--duration', type=float, default=3.0,
                         help='Duration of each audio file in seconds')
+    parser.add_argument('--silent', action='store_true',
+                        help='Write silent MP3s without ffmpeg (for load-test fixtures)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for the tones of custom models')
     
     args = parser.parse_args()
     
-    prompt_ids = args.prompt_ids.split(',')
+    if args.num_prompts:
+        prompt_ids = [f"{i:03d}" for i in range(1, args.num_prompts + 1)]
+    else:
+        prompt_ids = args.prompt_ids.split(',')
     models = args.models.split(',')
     
-    print(f"Generating test audio files for prompts: {prompt_ids}")
+    print(f"Generating test audio files for {len(prompt_ids)} prompts: {prompt_ids[:10]}")
     print(f"Models: {models}")
     print(f"Output directory: {args.output_dir}")
     
-    generate_test_audio(args.output_dir, prompt_ids, models, args.duration)
-    print("Done!")
+    written = generate_test_tree(args.output_dir, args.tasks, prompt_ids, models, args.duration,
+                                 args.silent, args.workers, args.seed)
+    expected = (args.tasks or 1) * len(prompt_ids) * (1 + len(models))
+    if written < expected:
+        print(f"Failed: wrote {written} of {expected} files.")
+        sys.exit(1)
+    print(f"Done! Wrote {written} files.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
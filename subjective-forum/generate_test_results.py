@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Script to generate synthetic result files for testing the analysis pipeline at scale.
+
+Sessions are assigned with the same code as the server
+(select_and_randomize_questions_for_session) and saved in the schema of
+api.finish, with ratings under metric IDs (see utils/metric_names.py): result
+files written by utils.saver.save (compact records by default), or records in the shared state backend
+like utils.saver.save_once (--backend), which export_results.py turns into files.
+
+Ratings are integers on a 1-5 scale drawn from one of these distributions:
+- 'uniform': every rating equally likely
+- 'normal': per-model mean + participant bias + (prompt, model) interaction +
+  rating noise, rounded and clipped to the scale
+A fraction of careless participants (--careless) gives the same rating everywhere.
+
+Participants are generated in chunks by a process pool. Each chunk has its own
+seed, so a run is reproducible for any number of workers.
+"""
+import os
+import json
+import random
+import argparse
+import time
+import uuid
+from multiprocessing import Pool
+
+import numpy as np
+
+from utils.loader import select_and_randomize_questions_for_session
+from utils.metric_names import MetricCatalog
+from utils.saver import RECORD_FORMATS, encode_result, save
+from utils.state import PREFIX, open_backend
+
+SCALE = (1, 5)  # Rating scale of the question page
+DEFAULT_METRICS = ['連貫性（Coherence）', '豐富性（Richness）', '正確性（Consistency）', '整體評價（Overall Rating）']
+DEFAULT_PARTICIPANT_FIELDS = [
+    {'key': 'name', 'type': 'text'},
+    {'key': 'age', 'type': 'text'},
+]
+CHUNK_SIZE = 500  # Participants per worker task
+
+
+def build_templates(n_templates, models, metrics, n_to_present=2):
+    """
+    Question templates in the forum.json format.
+
+    Args:
+        n_templates: Number of templates (one task_N subfolder each)
+        models: Model tags
+        metrics: Metric names in the format "中文（English）"
+        n_to_present: Questions per template in each session
+
+    Returns:
+        List of question templates
+    """
+    return [
+        {
+            'id': f"q{t + 1}",
+            'title': f"Question {t + 1}",
+            'audioSubfolder': f"task_{t + 1}",
+            'n_to_present': n_to_present,
+            'metrics': [{'name': name} for name in metrics],
+            'models': list(models),
+        }
+        for t in range(n_templates)
+    ]
+
+
+def model_means(models, spread=1.5):
+    """
+    Default true mean rating per model, evenly spaced around the middle of the scale.
+
+    Args:
+        models: Model tags
+        spread: Distance between the best and the worst model
+
+    Returns:
+        Dictionary of model -> mean rating
+    """
+    middle = (SCALE[0] + SCALE[1]) / 2
+    if len(models) == 1:
+        return {models[0]: middle}
+    return {m: middle + spread * (0.5 - i / (len(models) - 1)) for i, m in enumerate(models)}
+
+
+def generate_participant(index, fields, rng):
+    """
+    Participant information for the participantFields of forum.json.
+
+    Args:
+        index: Participant number
+        fields: participantFields from forum.json
+        rng: random.Random of the chunk
+
+    Returns:
+        Participant dictionary as stored in the session
+    """
+    participant = {}
+    for field in fields:
+        key = field.get('key')
+        if field.get('type') == 'select' and field.get('options'):
+            participant[key] = rng.choice(field['options'])
+        elif key == 'age':
+            participant[key] = str(rng.randint(18, 65))
+        else:
+            participant[key] = f"synthetic-{index}"
+    return participant
+
+
+def generate_chunk(spec):
+    """
+    Generate the results of a chunk of participants.
+
+    Args:
+        spec: Dictionary with 'start', 'count', 'seed' and the settings of main()
+
+    Returns:
+        List of result dictionaries in the format written by utils.saver.save
+    """
+    rng = random.Random(spec['seed'])
+    np_rng = np.random.default_rng(spec['seed'])
+    random.seed(spec['seed'])  # select_and_randomize_questions_for_session uses the random module
+    templates, scanned = spec['templates'], spec['scanned']
+    metric_names = MetricCatalog(templates)
+    header = metric_names.header(metric_names.id_of(m['name']) for t in templates for m in t['metrics'])
+    means, interactions = spec['means'], spec['interactions']
+    low, high = SCALE
+
+    results = []
+    for index in range(spec['start'], spec['start'] + spec['count']):
+        bias = np_rng.normal(0, spec['rater_sd'])
+        careless = rng.random() < spec['careless']
+        constant = rng.randint(low, high)
+
+        answers = {}
+        questions = select_and_randomize_questions_for_session(templates, scanned)
+        for i, q in enumerate(questions):
+            names = sorted(m['name'] for m in q['metrics'])
+            models = sorted(q['models'])  # The session cookie stores keys sorted
+            if careless:
+                ratings = np.full((len(models), len(names)), constant)
+            elif spec['distribution'] == 'uniform':
+                ratings = np_rng.integers(low, high + 1, size=(len(models), len(names)))
+            else:
+                centre = np.array([means[m] + interactions[q['original_question_id']][q['promptId']][m]
+                                   for m in models])[:, None] + bias
+                noisy = centre + np_rng.normal(0, spec['noise'], size=(len(models), len(names)))
+                ratings = np.clip(np.rint(noisy), low, high)
+
+            answers[str(i)] = {
+                'original_template_id': q['original_question_id'],
+                'audio_subfolder': q['audioSubfolder'],
+                'prompt_id_selected': q['promptId'],
+                'models_shuffled_order': q['models'],
+                'metrics_rated': {
+                    model: {metric_names.id_of(name): int(r) for name, r in zip(names, row)}
+                    for model, row in zip(models, ratings)
+                },
+                'time_spent_on_question': round(float(np_rng.lognormal(np.log(90), 0.5)), 3),
+            }
+
+        results.append({
+            'participant': generate_participant(index, spec['participant_fields'], rng),
+            'answers': answers,
+            'timestamp': int(spec['start_time'] + rng.random() * spec['days'] * 86400),
+            'uuid': uuid.UUID(int=rng.getrandbits(128), version=4).hex,
+            'metrics': header,
+        })
+
+    return results
+
+
+def write_chunk(spec):
+    """
+    Generate a chunk of participants and write it to files or the backend.
+
+    Args:
+        spec: Chunk specification (see generate_chunk) with 'output_dir' or 'backend'
+
+    Returns:
+        Number of results written
+    """
+    results = generate_chunk(spec)
+    if spec.get('backend'):
+        backend = open_backend(spec['backend'], spec['prefix'])
+        compact = spec['record_format'] == 'compact'
+        backend.hset(spec['hash_name'], {
+            r['uuid']: json.dumps(encode_result(r) if compact else r, ensure_ascii=False, separators=(',', ':'))
+            for r in results
+        })
+    else:
+        for r in results:
+            save(r['participant'], r['answers'], spec['output_dir'], r['uuid'], r['timestamp'], r['metrics'],
+                 spec['record_format'], spec['compression'])
+    return len(results)
+
+
+def generate_test_results(output_dir, participants, templates, n_prompts=20, participant_fields=None,
+                          distribution='normal', means=None, rater_sd=0.4, interaction_sd=0.3, noise=0.8,
+                          careless=0.0, days=14.0, seed=0, workers=None, backend=None, study=None,
+                          hash_name='results', record_format='compact', compression=None):
+    """
+    Generate synthetic results for the given question templates.
+
+    Args:
+        output_dir: Directory for the result files
+        participants: Number of participants
+        templates: Question templates in the forum.json format
+        n_prompts: Prompts per template subfolder ("000", "001", ...)
+        participant_fields: participantFields from forum.json (default: name and age)
+        distribution: 'normal' or 'uniform'
+        means: True mean rating per model (default: model_means of all models)
+        rater_sd: Standard deviation of participant biases
+        interaction_sd: Standard deviation of per-(prompt, model) deviations
+        noise: Standard deviation of rating noise
+        careless: Fraction of participants giving the same rating everywhere
+        days: Timestamps are spread over this many days before now
+        seed: Random seed
+        workers: Worker processes (default: CPU count; 1 runs in this process)
+        backend: STATE_BACKEND URL to store records in instead of files
+        study: Study name of the backend records (see create_multi_app)
+        hash_name: Backend hash of the records ('results' or 'debug_results')
+        record_format: 'compact' or 'json' (see utils/saver.py)
+        compression: None, 'gzip' or 'zstd' for the result files
+
+    Returns:
+        Number of results written
+    """
+    rng = np.random.default_rng(seed)
+    all_models = sorted({m for t in templates for m in t.get('models', [])})
+    means = means or model_means(all_models)
+    prompt_ids = [f"{p:03d}" for p in range(n_prompts)]
+    scanned = {t['audioSubfolder']: {p: ['prompt'] + list(t.get('models', [])) for p in prompt_ids}
+               for t in templates}
+    interactions = {t['id']: {p: {m: float(rng.normal(0, interaction_sd)) for m in t.get('models', [])}
+                              for p in prompt_ids}
+                    for t in templates}
+
+    base = {
+        'templates': templates, 'scanned': scanned, 'means': means, 'interactions': interactions,
+        'participant_fields': participant_fields or DEFAULT_PARTICIPANT_FIELDS,
+        'distribution': distribution, 'rater_sd': rater_sd, 'noise': noise, 'careless': careless,
+        'start_time': time.time() - days * 86400, 'days': days,
+        'output_dir': output_dir, 'backend': backend, 'hash_name': hash_name,
+        'record_format': record_format, 'compression': compression,
+        'prefix': f"{PREFIX}{study}:" if study else PREFIX,
+    }
+    specs = [
+        dict(base, start=start, count=min(CHUNK_SIZE, participants - start), seed=seed * 1000003 + start)
+        for start in range(0, participants, CHUNK_SIZE)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(specs) == 1:
+        return sum(write_chunk(spec) for spec in specs)
+    with Pool(min(workers, len(specs))) as pool:
+        return sum(pool.imap_unordered(write_chunk, specs))
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Generate synthetic listening test results.')
+    parser.add_argument('--output-dir', default='results_synthetic',
+                        help='Output directory for result files')
+    parser.add_argument('--participants', type=int, default=1000,
+                        help='Number of participants')
+    parser.add_argument('--config', default=None,
+                        help='forum.json to take question templates and participant fields from')
+    parser.add_argument('--templates', type=int, default=2,
+                        help='Number of question templates (without --config)')
+    parser.add_argument('--models', default='mmt,mmtdelay,remiplus,nmt',
+                        help='Comma-separated list of model names (without --config)')
+    parser.add_argument('--metrics', default=','.join(DEFAULT_METRICS),
+                        help='Comma-separated metric names in the format 中文（English） (without --config)')
+    parser.add_argument('--n-to-present', type=int, default=2,
+                        help='Questions per template in each session (without --config)')
+    parser.add_argument('--prompts', type=int, default=20,
+                        help='Prompts per template')
+    parser.add_argument('--distribution', choices=['normal', 'uniform'], default='normal',
+                        help='Rating distribution')
+    parser.add_argument('--model-means', default=None,
+                        help='True mean ratings as model=mean pairs, e.g. mmt=3.8,nmt=2.9')
+    parser.add_argument('--rater-sd', type=float, default=0.4,
+                        help='SD of participant biases (normal distribution)')
+    parser.add_argument('--interaction-sd', type=float, default=0.3,
+                        help='SD of per-(prompt, model) deviations (normal distribution)')
+    parser.add_argument('--noise', type=float, default=0.8,
+                        help='SD of rating noise (normal distribution)')
+    parser.add_argument('--careless', type=float, default=0.0,
+                        help='Fraction of participants giving the same rating everywhere')
+    parser.add_argument('--days', type=float, default=14.0,
+                        help='Spread result timestamps over this many days')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--backend', default=None,
+                        help='Store records in a STATE_BACKEND URL instead of writing files '
+                             '(export them with export_results.py)')
+    parser.add_argument('--study', default=None,
+                        help='Study name of the backend records')
+    parser.add_argument('--format', choices=RECORD_FORMATS, default='compact',
+                        help='Result record format (see utils/saver.py)')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None,
+                        help='Compress the result files')
+
+    args = parser.parse_args()
+
+    participant_fields = None
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            forum_config = json.load(f)
+        templates = forum_config.get('questions', [])
+        participant_fields = forum_config.get('participantFields')
+    else:
+        templates = build_templates(args.templates, args.models.split(','), args.metrics.split(','),
+                                    args.n_to_present)
+
+    means = None
+    if args.model_means:
+        all_models = sorted({m for t in templates for m in t.get('models', [])})
+        means = model_means(all_models)
+        for pair in args.model_means.split(','):
+            model, mean = pair.split('=')
+            means[model] = float(mean)
+
+    target = args.backend or args.output_dir
+    print(f"Generating {args.participants} participants for templates {[t['id'] for t in templates]}")
+    print(f"Output: {target}")
+
+    start = time.perf_counter()
+    written = generate_test_results(
+        args.output_dir, args.participants, templates, args.prompts, participant_fields,
+        args.distribution, means, args.rater_sd, args.interaction_sd, args.noise, args.careless,
+        args.days, args.seed, args.workers, args.backend, args.study,
+        record_format=args.format, compression=args.compression
+    )
+    print(f"Wrote {written} results in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Gunicorn configuration for production serving of the Subjective Listening Test Forum.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden through environment variables (GUNICORN_*).
+Long audio downloads must not occupy a whole worker, so the default worker class
+is gthread (or gevent when GUNICORN_WORKER_CLASS=gevent and gevent is installed),
+and the app is preloaded so the audio scan and config parsing happen once in the
+master before workers are forked.
+"""
+import multiprocessing
+import os
+import tempfile
+
+from utils.metrics import clear_metrics_dir, mark_process_dead
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Worker model: threads (or greenlets) so slow clients don't starve page requests
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 9)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))  # gthread only
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))  # gevent only
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, otherwise locks and sockets created at
+    # import time are the unpatched blocking versions
+    from gevent import monkey
+    monkey.patch_all()
+
+# Build app state (config, audio scan, audio index) once, before fork
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+if preload_app:
+    # Background threads do not survive the fork, so prepare audio before it
+    os.environ.setdefault('FLASK_AUDIO_INIT_BACKGROUND', 'false')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = os.environ.get('GUNICORN_ERRORLOG', '-')
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+# Trust X-Forwarded-* from the local reverse proxy (nginx sidecar / Cloudflare Tunnel)
+forwarded_allow_ips = os.environ.get('GUNICORN_FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+# Workers write metric snapshots here; /metrics sums them (see utils/metrics.py)
+os.environ.setdefault('FLASK_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'subjective-forum-metrics'))
+
+
+def on_starting(server):
+    # Totals start from zero on every server start
+    clear_metrics_dir(os.environ['FLASK_METRICS_DIR'])
+
+
+def child_exit(server, worker):
+    # Keep a recycled worker's counters, drop its gauges and snapshot file;
+    # studies of a multi-study server (FORUM_STUDIES) each have a subdirectory
+    metrics_dir = os.environ['FLASK_METRICS_DIR']
+    mark_process_dead(metrics_dir, worker.pid)
+    if os.path.isdir(metrics_dir):
+        for entry in os.scandir(metrics_dir):
+            if entry.is_dir():
+                mark_process_dead(entry.path, worker.pid)
@@ -34,6 +34,14 @@ fi
 
 # Run the application
 export FLASK_APP=app.py
+
+# Production profile: ./run.sh --prod [port]
+if [ "$1" == "--prod" ]; then
+    shift
+    export GUNICORN_BIND="0.0.0.0:${1:-8000}"
+    exec gunicorn -c gunicorn.conf.py wsgi:app
+fi
+
 export FLASK_ENV=development
 
 # Check if port is specified
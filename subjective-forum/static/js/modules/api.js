@@ -4,6 +4,9 @@
  * Handles all API communication with the server.
  */
 
+// API base URL; studies hosted under a URL prefix set window.SCRIPT_ROOT (see base templates)
+const API_ROOT = `${window.SCRIPT_ROOT || ''}/api`;
+
 /**
  * Save a question answer to the server
  * @param {string} questionId - The ID of the question
@@ -12,7 +15,7 @@
  * @returns {Promise} - Promise that resolves with the server response
  */
 export function saveAnswer(questionId, answers, timeSpent) {
-    return fetch('/api/save', {
+    return fetch(`${API_ROOT}/save`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -36,7 +39,7 @@ export function saveAnswer(questionId, answers, timeSpent) {
  * @returns {Promise} - Promise that resolves with the server response
  */
 export function finishTest() {
-    return fetch('/api/finish', {
+    return fetch(`${API_ROOT}/finish`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -55,7 +58,7 @@ export function finishTest() {
  * @returns {Promise} - Promise that resolves with the server response
  */
 export function sendHeartbeat() {
-    return fetch('/api/heartbeat')
+    return fetch(`${API_ROOT}/heartbeat`)
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! Status: ${response.status}`);
@@ -4,6 +4,29 @@
  * Handles preloading and caching of audio files for smooth playback experience.
  */
 
+import { telemetry } from './telemetry.js';
+
+const BUNDLE_MAGIC = 'AUDB';
+
+/**
+ * Split an /api/audio/bundle response into its clips (see utils/audio_bundle.py)
+ * @param {ArrayBuffer} buffer - The whole bundle
+ * @returns {Array<Object>} - Index entries (tag, url, mime, duration) with the clip bytes in 'data'
+ */
+export function parseAudioBundle(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== BUNDLE_MAGIC) {
+        throw new Error('Not an audio bundle');
+    }
+    const indexLength = view.getUint32(4); // Big-endian
+    const index = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, indexLength)));
+    const body = 8 + indexLength;
+    return index.map(entry => Object.assign({}, entry, {
+        data: buffer.slice(body + entry.offset, body + entry.offset + entry.length)
+    }));
+}
+
 /**
  * AudioLoader class for managing audio preloading and caching
  */
@@ -17,6 +40,8 @@ export class AudioLoader {
         this.audioContext = null;
         this.loadedAudio = new Map();
         this.loadPromises = new Map();
+        this.clipBlobs = new Map(); // Clip URL -> Blob of the encoded clip, for <audio> elements
+        this.objectUrls = new Map();
         this.initAudioContext();
     }
 
@@ -85,6 +110,58 @@ export class AudioLoader {
         return Promise.all(loadPromises);
     }
 
+    /**
+     * Load all clips of a question with one /api/audio/bundle request
+     *
+     * Each clip is stored under its own /api/audio URL, as if it had been
+     * loaded with loadAudio.
+     * @param {string} bundleUrl - Bundle URL from the question page
+     * @param {Object} options - decode: decode into AudioBuffers (default true);
+     *     without decoding the encoded ArrayBuffer is stored
+     * @returns {Promise<Map>} - Promise resolving to a map of tag -> clip URL
+     */
+    loadBundle(bundleUrl, { decode = true } = {}) {
+        return fetch(bundleUrl)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}`);
+                }
+                return response.arrayBuffer();
+            })
+            .then(buffer => {
+                const clips = parseAudioBundle(buffer);
+                return Promise.all(clips.map(clip => {
+                    // The Blob copies the bytes before decodeAudioData detaches the buffer
+                    this.clipBlobs.set(clip.url, new Blob([clip.data], { type: clip.mime }));
+                    let loaded;
+                    if (decode) {
+                        loaded = this.storeAudio(clip.data, clip.url);
+                    } else {
+                        this.loadedAudio.set(clip.url, clip.data);
+                        loaded = Promise.resolve(clip.data);
+                    }
+                    this.loadPromises.set(clip.url, loaded);
+                    return loaded;
+                })).then(() => new Map(clips.map(clip => [clip.tag, clip.url])));
+            });
+    }
+
+    /**
+     * Object URL of a clip loaded from a bundle, for an <audio> element's src
+     * @param {string} url - /api/audio URL of the clip
+     * @returns {string|null} - blob: URL, or null if the clip was not bundled
+     */
+    objectUrl(url) {
+        if (!this.objectUrls.has(url)) {
+            const blob = this.clipBlobs.get(url);
+            if (!blob) {
+                return null;
+            }
+            this.objectUrls.set(url, URL.createObjectURL(blob));
+        }
+        return this.objectUrls.get(url);
+    }
+
     /**
      * Load a single audio file
      * @param {string} url - URL of the audio file to load
@@ -159,21 +236,31 @@ export class AudioLoader {
      */
     processAudioFile(response, url) {
         return response.arrayBuffer()
-            .then(arrayBuffer => {
-                // If Web Audio API is available, decode the audio
-                if (this.audioContext) {
-                    return this.audioContext.decodeAudioData(arrayBuffer)
-                        .then(audioBuffer => {
-                            // Store the decoded audio buffer
-                            this.loadedAudio.set(url, audioBuffer);
-                            return audioBuffer;
-                        });
-                } else {
-                    // Web Audio API not available, store the raw array buffer
-                    this.loadedAudio.set(url, arrayBuffer);
-                    return arrayBuffer;
-                }
-            });
+            .then(arrayBuffer => this.storeAudio(arrayBuffer, url));
+    }
+
+    /**
+     * Decode (when possible) and store an encoded audio file
+     * @param {ArrayBuffer} arrayBuffer - Encoded audio
+     * @param {string} url - URL the audio is stored under
+     * @returns {Promise} - Promise that resolves to the stored audio
+     */
+    storeAudio(arrayBuffer, url) {
+        // If Web Audio API is available, decode the audio
+        if (this.audioContext) {
+            const decodeStart = performance.now();
+            return this.audioContext.decodeAudioData(arrayBuffer)
+                .then(audioBuffer => {
+                    telemetry.recordDecode(url, performance.now() - decodeStart);
+                    // Store the decoded audio buffer
+                    this.loadedAudio.set(url, audioBuffer);
+                    return audioBuffer;
+                });
+        } else {
+            // Web Audio API not available, store the raw array buffer
+            this.loadedAudio.set(url, arrayBuffer);
+            return Promise.resolve(arrayBuffer);
+        }
     }
 
     /**
@@ -208,7 +295,10 @@ export class AudioLoader {
         
         // If we have a decoded audio buffer, create an object URL
         const audioData = this.getAudio(url);
-        if (audioData instanceof AudioBuffer) {
+        if (this.clipBlobs.has(url)) {
+            // Bundled clips play from their encoded bytes
+            audio.src = this.objectUrl(url);
+        } else if (audioData instanceof AudioBuffer) {
             // Create a blob from the audio buffer
             const wav = this.audioBufferToWav(audioData);
             const blob = new Blob([wav], { type: 'audio/wav' });
@@ -1,4 +1,10 @@
 // Story controller
+import audioLoader from './audioLoader.js';
+import { telemetry } from './telemetry.js';
+
+// API base URL; studies hosted under a URL prefix set window.SCRIPT_ROOT (see base templates)
+const API_ROOT = `${window.SCRIPT_ROOT || ''}/api`;
+
 document.addEventListener('DOMContentLoaded', function() {
     const mainProgressBarFill = document.getElementById('progress-bar-fill');
 
@@ -7,6 +13,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const QUESTION_ID = storyContainer.getAttribute('data-question-id');
     const PROMPT_ID = storyContainer.getAttribute('data-prompt-id');
     const AUDIO_SUBFOLDER = storyContainer.getAttribute('data-audio-subfolder');
+    const AUDIO_BUNDLE_URL = storyContainer.getAttribute('data-audio-bundle'); // One request for all clips, if enabled
     
     // Initialization
     let MODELS = [];
@@ -110,15 +117,41 @@ document.addEventListener('DOMContentLoaded', function() {
         progressSegments.appendChild(segment);
     }
     
+    // Formats this browser can decode, sent to /api/audio so the server can pick
+    // the smallest pre-transcoded variant (falls back to the original mp3)
+    const SUPPORTED_FORMATS = (function detectSupportedFormats() {
+        const probe = document.createElement('audio');
+        const candidates = {
+            opus: 'audio/ogg; codecs="opus"',
+            aac: 'audio/mp4; codecs="mp4a.40.2"',
+            mp3: 'audio/mpeg'
+        };
+        return Object.keys(candidates).filter(format => probe.canPlayType(candidates[format]) !== '');
+    })();
+
+    telemetry.formats = SUPPORTED_FORMATS;
+    telemetry.startPage({ template: QUESTION_ID, prompt: PROMPT_ID, question: window.CURRENT_QUESTION_INDEX });
+
+    function withFormats(url) {
+        if (SUPPORTED_FORMATS.length === 0) return url;
+        const separator = url.includes('?') ? '&' : '?';
+        return `${url}${separator}formats=${SUPPORTED_FORMATS.join(',')}`;
+    }
+
+    // Clip duration, falling back to the server-side hint until metadata has loaded
+    function clipDuration(audio) {
+        if (Number.isFinite(audio.duration) && audio.duration > 0) return audio.duration;
+        const hint = parseFloat(audio.dataset.duration);
+        return Number.isFinite(hint) ? hint : 0;
+    }
+
     // Initialize audio elements
     function initAudio() {
         console.log('Initializing audio elements');
         
         // Prompt audio
         const promptAudio = document.getElementById('prompt-audio');
-        const promptSrc = promptAudio.dataset.src;
-        console.log('Setting prompt audio src:', promptSrc);
-        promptAudio.src = promptSrc;
+        telemetry.trackAudioElement(promptAudio);
         
         // Add event listeners for debugging
         promptAudio.addEventListener('canplaythrough', () => {
@@ -134,9 +167,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Model audios
         MODELS.forEach(model => {
             const modelAudio = document.getElementById(`model-${model}-audio`);
-            const modelSrc = modelAudio.dataset.src;
-            console.log(`Setting ${model} audio src:`, modelSrc);
-            modelAudio.src = modelSrc;
+            telemetry.trackAudioElement(modelAudio);
             
             // Add event listeners for debugging
             modelAudio.addEventListener('canplaythrough', () => {
@@ -150,7 +181,32 @@ document.addEventListener('DOMContentLoaded', function() {
             audioElements[model] = modelAudio;
         });
         
-        // Preload all audio files
+        if (AUDIO_BUNDLE_URL) {
+            // Fetch every clip in one request and play them from memory
+            audioLoader.loadBundle(withFormats(AUDIO_BUNDLE_URL), { decode: false })
+                .then(() => {
+                    Object.entries(audioElements).forEach(([tag, audio]) => {
+                        const src = audioLoader.objectUrl(audio.dataset.src) || withFormats(audio.dataset.src);
+                        console.log(`Setting ${tag} audio src:`, src);
+                        audio.src = src;
+                    });
+                })
+                .catch(err => {
+                    console.error('Error loading audio bundle, loading clips one by one:', err);
+                    loadClips();
+                });
+        } else {
+            loadClips();
+        }
+    }
+
+    // Point each audio element at its own clip URL and preload all audio files
+    function loadClips() {
+        Object.entries(audioElements).forEach(([tag, audio]) => {
+            const src = withFormats(audio.dataset.src);
+            console.log(`Setting ${tag} audio src:`, src);
+            audio.src = src;
+        });
         preloadAudio();
     }
     
@@ -163,7 +219,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 // Preload prompt audio
                 const promptAudioFilename = AUDIO_SUBFOLDER ? `${AUDIO_SUBFOLDER}/${PROMPT_ID}_prompt.mp3` : `${PROMPT_ID}_prompt.mp3`;
-                const promptUrl = `${window.location.origin}/api/audio/${promptAudioFilename}`;
+                const promptUrl = withFormats(`${window.location.origin}${API_ROOT}/audio/${promptAudioFilename}`);
                 console.log('Preloading prompt audio from URL:', promptUrl);
                 
                 // Use fetch instead of cache.add for better error handling
@@ -185,7 +241,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Preload model audios
                 MODELS.forEach(model => {
                     const modelAudioFilename = AUDIO_SUBFOLDER ? `${AUDIO_SUBFOLDER}/${PROMPT_ID}_${model}.mp3` : `${PROMPT_ID}_${model}.mp3`;
-                    const modelUrl = `${window.location.origin}/api/audio/${modelAudioFilename}`;
+                    const modelUrl = withFormats(`${window.location.origin}${API_ROOT}/audio/${modelAudioFilename}`);
                     console.log(`Preloading ${model} audio from URL:`, modelUrl);
                     
                     // Use fetch instead of cache.add for better error handling
@@ -304,8 +360,8 @@ document.addEventListener('DOMContentLoaded', function() {
                         }
 
                         const animateMainProgress = () => {
-                            if (promptAudio.duration > 0) {
-                                const audioProgressRatio = promptAudio.currentTime / promptAudio.duration;
+                            if (clipDuration(promptAudio) > 0) {
+                                const audioProgressRatio = promptAudio.currentTime / clipDuration(promptAudio);
                                 const currentMainBarWidth = mainSegmentStartPct + (audioProgressRatio * (mainSegmentEndPct - mainSegmentStartPct));
                                 mainProgressBarFill.style.width = Math.min(currentMainBarWidth, mainSegmentEndPct) + '%';
                             }
@@ -329,8 +385,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Set up progress tracking for the individual prompt audio bar
                 if (!promptAudio._hasProgressListener) {
                     promptAudio.addEventListener('timeupdate', () => {
-                        if (promptAudio.duration) {
-                            const percent = (promptAudio.currentTime / promptAudio.duration) * 100;
+                        if (clipDuration(promptAudio)) {
+                            const percent = (promptAudio.currentTime / clipDuration(promptAudio)) * 100;
                             if (progressElement) progressElement.style.width = `${percent}%`;
                         }
                     });
@@ -346,7 +402,7 @@ document.addEventListener('DOMContentLoaded', function() {
                             // let statusText = 'Playing reference audio...';
                             let statusText = '';
                             if (DEBUG_MODE) {
-                                const srcFilename = promptAudio.src.split('/').pop();
+                                const srcFilename = promptAudio.dataset.src.split('?')[0].split('/').pop();
                                 const [debugPromptId, debugModelTypeWithExt] = srcFilename.split('_');
                                 const debugModelType = debugModelTypeWithExt.replace('.mp3', '');
                                 statusText += ` (ID: ${debugPromptId}, Type: ${debugModelType})`;
@@ -385,7 +441,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         if (statusElement) {
                             let statusText = 'Click anywhere to play reference audio';
                              if (DEBUG_MODE) {
-                                const srcFilename = promptAudio.src.split('/').pop();
+                                const srcFilename = promptAudio.dataset.src.split('?')[0].split('/').pop();
                                 const [debugPromptId, debugModelTypeWithExt] = srcFilename.split('_');
                                 const debugModelType = debugModelTypeWithExt.replace('.mp3', '');
                                 statusText += ` (ID: ${debugPromptId}, Type: ${debugModelType})`;
@@ -442,8 +498,8 @@ document.addEventListener('DOMContentLoaded', function() {
             // Set up progress tracking if not already set
             if (!modelAudio._hasProgressListener) {
                 modelAudio.addEventListener('timeupdate', () => {
-                    if (modelAudio.duration) {
-                        const percent = (modelAudio.currentTime / modelAudio.duration) * 100;
+                    if (clipDuration(modelAudio)) {
+                        const percent = (modelAudio.currentTime / clipDuration(modelAudio)) * 100;
                         if (progressElement) progressElement.style.width = `${percent}%`;
                     }
                 });
@@ -459,7 +515,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         // let statusText = `Playing sample ${modelIndex + 1}...`;
                         let statusText = '';
                         if (DEBUG_MODE) {
-                            const srcFilename = modelAudio.src.split('/').pop();
+                            const srcFilename = modelAudio.dataset.src.split('?')[0].split('/').pop();
                             const [debugPromptId, debugModelTypeWithExt] = srcFilename.split('_');
                             const debugModelType = debugModelTypeWithExt.replace('.mp3', '');
                             statusText += ` (ID: ${debugPromptId}, Type: ${debugModelType})`;
@@ -497,7 +553,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     if (statusElement) {
                         let statusText = `Click anywhere to play sample ${modelIndex + 1}`;
                         if (DEBUG_MODE) {
-                            const srcFilename = modelAudio.src.split('/').pop();
+                            const srcFilename = modelAudio.dataset.src.split('?')[0].split('/').pop();
                             const [debugPromptId, debugModelTypeWithExt] = srcFilename.split('_');
                             const debugModelType = debugModelTypeWithExt.replace('.mp3', '');
                             statusText += ` (ID: ${debugPromptId}, Type: ${debugModelType})`;
@@ -601,7 +657,7 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log('Attempting to save answer. window.CURRENT_QUESTION_INDEX:', window.CURRENT_QUESTION_INDEX, 'Payload:', payload);
             
             // Save answers
-            const response = await fetch('/api/save', {
+            const response = await fetch(`${API_ROOT}/save`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -615,7 +671,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (IS_LAST) {
                     // This is the last question, call /api/finish before redirecting to thank you page
                     try {
-                        const finishResponse = await fetch('/api/finish', { method: 'POST' });
+                        const finishResponse = await fetch(`${API_ROOT}/finish`, { method: 'POST' });
                         const finishResult = await finishResponse.json();
                         if (finishResult.success) {
                             console.log('Survey finished, final data saved. Redirecting to thank you page.');
@@ -685,7 +741,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 });
                 
                 // Save answers
-                const response = await fetch('/api/save', {
+                const response = await fetch(`${API_ROOT}/save`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json'
@@ -893,7 +949,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Send heartbeat to keep session alive
     setInterval(async function() {
         try {
-            await fetch('/api/heartbeat');
+            await fetch(`${API_ROOT}/heartbeat`);
         } catch (error) {
             console.error('Heartbeat error:', error);
         }
@@ -0,0 +1,178 @@
+/**
+ * Telemetry Module
+ *
+ * Collects client-side timing for audio clips (TTFB, time to canplaythrough,
+ * decode time, stalls) and the time spent on each question page, and sends it
+ * in batches to /api/telemetry. Batches go out with navigator.sendBeacon, so the
+ * last batch still arrives when the participant navigates to the next page.
+ */
+
+const TELEMETRY_ENDPOINT = `${window.SCRIPT_ROOT || ''}/api/telemetry`;
+const MAX_BATCH_SIZE = 50;
+const FLUSH_INTERVAL_MS = 15000;
+
+/**
+ * Network class reported by the Network Information API ('4g', '3g', ...)
+ * @returns {string} - Effective connection type or 'unknown'
+ */
+export function networkClass() {
+    const connection = navigator.connection || navigator.mozConnection || navigator.webkitConnection;
+    return connection && connection.effectiveType ? connection.effectiveType : 'unknown';
+}
+
+/**
+ * Clip path relative to the audio root, e.g. "task_1/001_gt.mp3"
+ * @param {string} url - Audio URL (may be absolute and carry a query string)
+ * @returns {string|null} - Clip path or null for non-audio URLs
+ */
+export function clipFromUrl(url) {
+    const path = new URL(url, window.location.origin).pathname;
+    const marker = '/api/audio/';
+    const index = path.indexOf(marker);
+    return index >= 0 ? decodeURIComponent(path.slice(index + marker.length)) : null;
+}
+
+/**
+ * Telemetry class batching timing events for the server
+ */
+export class Telemetry {
+    /**
+     * Create a new Telemetry instance
+     * @param {string} endpoint - URL events are posted to
+     */
+    constructor(endpoint = TELEMETRY_ENDPOINT) {
+        this.endpoint = endpoint;
+        this.queue = [];
+        this.formats = [];
+        this.trackedClips = [];
+        this.page = null;
+
+        setInterval(() => this.flush(), FLUSH_INTERVAL_MS);
+
+        // Hidden pages may never be shown again (navigation, tab closed, app switch)
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') this.finish();
+        });
+        window.addEventListener('pagehide', () => this.finish());
+    }
+
+    /**
+     * Queue one event, sending the batch once it is full
+     * @param {Object} event - Event with a 'type' of 'clip' or 'page'
+     */
+    record(event) {
+        this.queue.push(event);
+        if (this.queue.length >= MAX_BATCH_SIZE) {
+            this.flush();
+        }
+    }
+
+    /**
+     * Send all queued events
+     */
+    flush() {
+        if (this.queue.length === 0) return;
+        const body = JSON.stringify({
+            network: networkClass(),
+            formats: this.formats,
+            events: this.queue.splice(0)
+        });
+
+        if (navigator.sendBeacon && navigator.sendBeacon(this.endpoint, body)) {
+            return;
+        }
+        // sendBeacon unavailable or its queue is full
+        fetch(this.endpoint, { method: 'POST', body: body, keepalive: true }).catch(() => {});
+    }
+
+    /**
+     * Start timing a question page
+     * @param {Object} page - Page context: template, prompt and question index
+     */
+    startPage(page) {
+        this.page = Object.assign({}, page, { startedAt: performance.now() });
+    }
+
+    /**
+     * Measure loading and playback of an <audio> element
+     * @param {HTMLAudioElement} audio - Element whose clip is about to load
+     */
+    trackAudioElement(audio) {
+        // data-src holds the clip URL even when src is a blob: URL from an audio bundle
+        const clip = clipFromUrl(audio.dataset.src || audio.src);
+        if (!clip) return;
+
+        const entry = { audio: audio, clip: clip, startedAt: performance.now(), stalls: 0, stallMs: 0, stallStart: null, reported: false };
+        this.trackedClips.push(entry);
+
+        audio.addEventListener('canplaythrough', () => {
+            if (entry.load === undefined) {
+                entry.load = performance.now() - entry.startedAt;
+            }
+        }, { once: true });
+
+        // 'waiting' fires when playback stops for lack of data; 'playing' when it resumes
+        audio.addEventListener('waiting', () => {
+            if (audio.currentTime > 0 && entry.stallStart === null) {
+                entry.stalls += 1;
+                entry.stallStart = performance.now();
+            }
+        });
+        audio.addEventListener('playing', () => {
+            if (entry.stallStart !== null) {
+                entry.stallMs += performance.now() - entry.stallStart;
+                entry.stallStart = null;
+            }
+        });
+    }
+
+    /**
+     * Record the decode time of a clip decoded with the Web Audio API
+     * @param {string} url - Audio URL
+     * @param {number} decodeMs - Time spent in decodeAudioData
+     */
+    recordDecode(url, decodeMs) {
+        const clip = clipFromUrl(url);
+        if (clip) {
+            this.record({ type: 'clip', clip: clip, decode: decodeMs });
+        }
+    }
+
+    /**
+     * Report all tracked clips and the page time, then send the batch
+     */
+    finish() {
+        this.trackedClips.forEach(entry => {
+            if (entry.reported) return;
+            entry.reported = true;
+
+            const event = { type: 'clip', clip: entry.clip, stalls: entry.stalls, stallMs: entry.stallMs };
+            if (entry.load !== undefined) event.load = entry.load;
+
+            // Resource Timing gives TTFB and transfer size for same-origin requests
+            const timings = performance.getEntriesByName(entry.audio.currentSrc || entry.audio.src);
+            const timing = timings[timings.length - 1];
+            if (timing && timing.responseStart > 0) {
+                event.ttfb = timing.responseStart - timing.requestStart;
+                if (timing.transferSize > 0) event.bytes = timing.transferSize;
+            }
+            this.record(event);
+        });
+
+        if (this.page && this.page.startedAt !== null) {
+            this.record({
+                type: 'page',
+                template: this.page.template,
+                prompt: this.page.prompt,
+                question: this.page.question,
+                pageTime: performance.now() - this.page.startedAt
+            });
+            this.page.startedAt = null;
+        }
+        this.flush();
+    }
+}
+
+// Create and export a singleton instance
+export const telemetry = new Telemetry();
+export default telemetry;
@@ -5,11 +5,44 @@ import os
 import json
 import unittest
 import tempfile
+import subprocess
+import threading
+import time
 from pathlib import Path
+from unittest import mock
 
-from app import create_app
-from utils.loader import scan_audio_directory, randomize_questions, validate_questions
-from utils.saver import save, load_results
+import numpy as np
+from flask import Flask
+from werkzeug.test import Client
+
+from app import create_app, create_multi_app
+from utils.loader import scan_audio_directory, select_and_randomize_questions_for_session, validate_questions
+from utils.saver import save, load_results, encode_result, decode_result, read_result
+from utils.audio_variants import negotiate_question_variants, prompt_clips
+from utils.audio_bundle import parse_bundle
+from utils.audio_index import build_audio_index, validate_audio_index
+from utils.metrics import MetricsRegistry, mark_process_dead
+from utils.telemetry import TelemetryAggregator, normalize_batch, summarize_events, load_telemetry
+from utils.startup import wait_until_ready
+from utils.admission import AdmissionController
+from utils.quota import QuotaStore, quotas_met, template_total
+from utils.adaptive import AdaptiveScheduler
+from utils.state import MemoryBackend, SQLiteBackend
+from utils.warmer import AudioWarmer
+from utils.screening import screen_result
+from utils.ratings import ratings_table, zscores, reliability, participant_consistency
+from utils import mixed_effects
+from utils.mixed_effects import fit_crossed, fit_mixed_models
+from utils.report import build_report, render_report
+from utils.exports import ROW_FIELDS, iter_result_files, iter_rows, write_rows
+from utils.metric_names import MetricCatalog, derive_id, init_metric_names
+from blueprints.rules import _render_markdown
+from benchmarks.sessions import build_fixture, run_benchmark, compare_to_baseline
+from generate_test_audio import generate_test_tree
+from transcode_audio import transcode_file
+from generate_test_results import build_templates, generate_test_results
+from analyze_results import load_results as load_result_files, extract_metrics_by_template
+from convert_results import convert_results
 
 
 class TestUtils(unittest.TestCase):
@@ -17,13 +50,14 @@ class TestUtils(unittest.TestCase):
     
     def setUp(self):
         """Set up test environment."""
-        self.app = create_app({'TESTING': True})
+        self.app = create_app({'TESTING': True, 'STATE_BACKEND': 'memory://'})  # Keep out of instance/state.sqlite3
+        wait_until_ready(self.app)  # Tests change the audio config afterwards
         self.client = self.app.test_client()
         self.temp_dir = tempfile.TemporaryDirectory()
         
-        # Create test audio files
-        audio_dir = Path(self.temp_dir.name) / 'audio'
-        audio_dir.mkdir()
+        # Create test audio files (one subfolder per question template)
+        audio_dir = Path(self.temp_dir.name) / 'audio' / 'task_1'
+        audio_dir.mkdir(parents=True)
         
         # Create dummy audio files
         (audio_dir / '001_prompt.mp3').touch()
@@ -45,7 +79,7 @@ class TestUtils(unittest.TestCase):
     def test_scan_audio_directory(self):
         """Test scanning audio directory."""
         audio_dir = Path(self.temp_dir.name) / 'audio'
-        audio_models = scan_audio_directory(str(audio_dir))
+        audio_models = scan_audio_directory(str(audio_dir))['task_1']
         
         self.assertIn('001', audio_models)
         self.assertIn('002', audio_models)
@@ -59,31 +93,88 @@ class TestUtils(unittest.TestCase):
         self.assertNotIn('methodB', audio_models['002'])
     
     def test_randomize_questions(self):
-        """Test randomizing questions."""
-        questions = [
-            {'id': 'q1', 'promptId': '001'},
-            {'id': 'q2', 'promptId': '002'},
-            {'id': 'q3', 'promptId': '003'}
+        """Test selecting and randomizing questions for a session."""
+        audio_dir = Path(self.temp_dir.name) / 'audio'
+        audio_models = scan_audio_directory(str(audio_dir))
+        templates = [
+            {'id': 'q1', 'audioSubfolder': 'task_1', 'n_to_present': 2, 'models': ['gt', 'methodA']},
+            {'id': 'q2', 'audioSubfolder': 'task_1', 'n_to_present': 2, 'models': ['gt', 'methodA', 'methodB']},
+            {'id': 'q3', 'audioSubfolder': 'task_9', 'n_to_present': 1, 'models': ['gt']}
         ]
         
         # Run randomization multiple times to ensure it's working
-        all_same = True
-        original_order = [q['id'] for q in questions]
+        model_orders = set()
         
-        for _ in range(10):
-            randomized = randomize_questions(questions)
-            randomized_ids = [q['id'] for q in randomized]
-            
-            # Check that all questions are still present
-            self.assertEqual(set(original_order), set(randomized_ids))
+        for _ in range(20):
+            session_questions = select_and_randomize_questions_for_session(templates, audio_models)
+            selected = sorted((q['original_question_id'], q['promptId']) for q in session_questions)
             
-            # Check if order is different from original
-            if randomized_ids != original_order:
-                all_same = False
+            # Only prompts with every model are used; missing subfolders are skipped
+            self.assertEqual(selected, [('q1', '001'), ('q1', '002'), ('q2', '001')])
+            model_orders.update(tuple(q['models']) for q in session_questions if q['original_question_id'] == 'q1')
         
-        # It's statistically very unlikely to get the same order 10 times
-        self.assertFalse(all_same, "Randomization doesn't appear to be working")
+        # It's statistically very unlikely to get the same model order 40 times
+        self.assertGreater(len(model_orders), 1, "Randomization doesn't appear to be working")
     
+    def test_quota_aware_selection(self):
+        """Test saturated prompts and templates are no longer assigned, and reservations count."""
+        audio_models = scan_audio_directory(str(Path(self.temp_dir.name) / 'audio'))
+        templates = [
+            {'id': 'q1', 'audioSubfolder': 'task_1', 'n_to_present': 2, 'models': ['gt', 'methodA'], 'target_per_model': 1},
+            {'id': 'q2', 'audioSubfolder': 'task_1', 'n_to_present': 2, 'models': ['gt', 'methodA'], 'target_count': 3},
+        ]
+        store = QuotaStore(SQLiteBackend(os.path.join(self.temp_dir.name, 'state.sqlite3')))
+        rated = {'gt': {'Overall': 3}, 'methodA': {'Overall': 4}}
+        store.record({
+            '0': {'original_template_id': 'q1', 'prompt_id_selected': '001', 'metrics_rated': rated},
+            '1': {'original_template_id': 'q2', 'prompt_id_selected': '001', 'metrics_rated': rated},
+            '2': {'original_template_id': 'q2', 'prompt_id_selected': '002', 'metrics_rated': None},  # Not answered
+        })
+        usage = store.usage()
+        self.assertEqual(usage['q1']['001'], {'': 1, 'gt': 1, 'methodA': 1})
+
+        session_questions = select_and_randomize_questions_for_session(templates, audio_models, usage)
+        selected = sorted((q['original_question_id'], q['promptId']) for q in session_questions)
+        # q1/001 is saturated; q2 has 2 of its 3 questions left
+        self.assertEqual(selected, [('q1', '002'), ('q2', '001'), ('q2', '002')])
+
+        # The assigned questions are held until the session finishes
+        store.reserve('ticket', session_questions)
+        usage = store.usage()
+        self.assertEqual(template_total(usage, 'q2'), 3)
+        self.assertTrue(quotas_met(templates, usage, audio_models))
+        self.assertEqual(select_and_randomize_questions_for_session(templates, audio_models, usage), [])
+
+        # Rebuilding from result files replaces the counts
+        save({'name': 'test'}, {'0': {'original_template_id': 'q2', 'prompt_id_selected': '002', 'metrics_rated': rated}},
+             str(self.results_dir))
+        self.assertEqual(store.rebuild(str(self.results_dir)), 1)
+        self.assertEqual(template_total(store.usage(include_reservations=False), 'q2'), 1)
+        self.assertEqual(template_total(store.usage(include_reservations=False), 'q1'), 0)
+
+    def test_adaptive_scheduler_prefers_uncertain_prompts(self):
+        """Test the adaptive scheduler favours prompts with few ratings and keeps all candidates."""
+        template = {'id': 'q1', 'models': ['gt', 'methodA'], 'metrics': [{'name': 'Overall'}]}
+        scheduler = AdaptiveScheduler(SQLiteBackend(os.path.join(self.temp_dir.name, 'state.sqlite3')), seed=0)
+        for rating_gt, rating_a in [(4, 2), (5, 2), (4, 1), (5, 1), (4, 2)]:
+            scheduler.record({'0': {'original_template_id': 'q1', 'prompt_id_selected': '001',
+                                    'metrics_rated': {'gt': {'Overall': rating_gt}, 'methodA': {'Overall': rating_a}}}})
+        scheduler.refresh(force=True)
+
+        scores = scheduler.scores(template, ['001', '002'])
+        self.assertGreater(scores[1], scores[0])  # '002' has no ratings yet
+
+        first_choices = [scheduler.order(template, ['001', '002', '003'], 1)[0] for _ in range(200)]
+        self.assertLess(first_choices.count('001'), 40)
+        self.assertEqual(sorted(scheduler.order(template, ['001', '002', '003'], 1)), ['001', '002', '003'])
+
+        # The loader uses the scheduler's order; the statistics survive a rebuild
+        audio_models = scan_audio_directory(str(Path(self.temp_dir.name) / 'audio'))
+        template.update({'audioSubfolder': 'task_1', 'n_to_present': 1})
+        self.assertEqual(len(select_and_randomize_questions_for_session([template], audio_models, None, scheduler)), 1)
+        self.assertEqual(scheduler.rebuild(str(self.results_dir)), 0)
+        self.assertTrue(scheduler.is_empty())
+
     def test_validate_questions(self):
         """Test question validation."""
         audio_dir = Path(self.temp_dir.name) / 'audio'
@@ -93,8 +184,8 @@ class TestUtils(unittest.TestCase):
         valid_questions = [
             {
                 'id': 'q1',
-                'promptId': '001',
-                'models': ['gt', 'methodA', 'methodB']
+                'audioSubfolder': 'task_1',
+                'models': ['gt', 'methodA']
             }
         ]
         
@@ -105,12 +196,12 @@ class TestUtils(unittest.TestCase):
         invalid_questions = [
             {
                 'id': 'q2',
-                'promptId': '002',
+                'audioSubfolder': 'task_1',
                 'models': ['gt', 'methodA', 'methodB']  # methodB doesn't exist for 002
             },
             {
                 'id': 'q3',
-                'promptId': '003',  # 003 doesn't exist
+                'audioSubfolder': 'task_9',  # task_9 doesn't exist
                 'models': ['gt', 'methodA']
             }
         ]
@@ -151,13 +242,440 @@ class TestUtils(unittest.TestCase):
         self.assertIn('timestamp', loaded_data)
         self.assertIn('uuid', loaded_data)
 
+    def test_compact_result_records(self):
+        """Test compact records round-trip, compress, and convert from indented JSON files."""
+        answers = {
+            '0': {'original_template_id': 'q1', 'audio_subfolder': 'task_1', 'prompt_id_selected': '001',
+                  'models_shuffled_order': ['methodA', 'gt'], 'time_spent_on_question': 12.5,
+                  'metrics_rated': {'gt': {'overall': 4, 'clarity': 2.5}, 'methodA': {'overall': 3.0}}},
+            '1': {'original_template_id': 'q1', 'audio_subfolder': 'task_1', 'prompt_id_selected': '002',
+                  'models_shuffled_order': ['gt', 'methodA', 'methodB'], 'time_spent_on_question': None,
+                  'metrics_rated': {'methodB': {'overall': 5}}},  # Only some models rated
+            '2': {'original_template_id': 'q1', 'prompt_id_selected': '003', 'metrics_rated': None},
+        }
+        data = {'participant': {'name': '測試'}, 'answers': answers, 'timestamp': 1700000000, 'uuid': 'ab' * 16,
+                'metrics': {'overall': 'Overall'}}
+        record = encode_result(data)
+        self.assertEqual(record['schema'], 2)
+        self.assertEqual(record['dictionaries'], {'models': ['methodA', 'gt', 'methodB'],
+                                                  'metrics': ['overall', 'clarity']})
+        self.assertEqual(record['answers']['0']['ratings'], [[3, None], [4, 2.5]])  # Rows in page order
+        self.assertEqual(decode_result(json.loads(json.dumps(record))), data)
+        self.assertIs(decode_result(data), data)  # Schema 1 passes through
+
+        # Old indented files are converted in place, and every format reads the same
+        old_file = save(data['participant'], answers, str(self.results_dir), data['uuid'], data['timestamp'],
+                        data['metrics'], record_format='json')
+        converted, before, after = convert_results(str(self.results_dir), compression='gzip')
+        self.assertEqual(converted, 1)
+        self.assertLess(after, before / 2)
+        self.assertEqual(os.listdir(self.results_dir), [os.path.basename(old_file) + '.gz'])
+        self.assertEqual(read_result(old_file + '.gz'), data)
+
+        # The server's rebuilds read compressed compact files
+        store = QuotaStore(MemoryBackend())
+        self.assertEqual(store.rebuild(str(self.results_dir)), 1)
+        self.assertEqual(template_total(store.usage(), 'q1'), 2)
+
+    def test_generate_test_results(self):
+        """Test synthetic results follow the saved schema, as files and as backend records."""
+        templates = build_templates(1, ['gt', 'methodA'], ['整體評價（Overall Rating）', '豐富性（Richness）'])
+        generate_test_results(str(self.results_dir), 6, templates, n_prompts=3, careless=0.5, seed=1, workers=1)
+
+        results = load_result_files(str(self.results_dir))
+        self.assertEqual(len(results), 6)
+        answer = results[0]['answers']['0']
+        self.assertEqual(set(results[0]), {'participant', 'answers', 'timestamp', 'uuid', 'metrics'})
+        self.assertEqual(results[0]['metrics'], {'overall_rating': '整體評價（Overall Rating）', 'richness': '豐富性（Richness）'})
+        self.assertEqual(set(answer), {'original_template_id', 'audio_subfolder', 'prompt_id_selected',
+                                       'models_shuffled_order', 'metrics_rated', 'time_spent_on_question'})
+        self.assertEqual(len(results[0]['answers']), 2)
+        self.assertEqual(answer['audio_subfolder'], 'task_1')
+        ratings = extract_metrics_by_template(results)['q1']['gt']['metrics']
+        self.assertEqual(set(ratings), {'Overall Rating', 'Richness'})
+        self.assertTrue(all(1 <= r <= 5 for r in ratings['Richness']))
+
+        db_path = os.path.join(self.temp_dir.name, 'state.sqlite3')
+        generate_test_results(None, 6, templates, n_prompts=3, seed=1, workers=1, backend=f"sqlite:///{db_path}")
+        self.assertEqual(len(SQLiteBackend(db_path).hgetall('results')), 6)
+
+    def test_generate_test_tree(self):
+        """Test batch audio generation writes the scanned layout deterministically."""
+        root = Path(self.temp_dir.name) / 'fixture'
+        written = generate_test_tree(str(root / 'a'), 2, ['001', '002'], ['gt', 'custom'], 0.5, silent=True)
+        self.assertEqual(written, 12)
+        scanned = scan_audio_directory(str(root / 'a'))
+        self.assertEqual(sorted(scanned), ['task_1', 'task_2'])
+        self.assertEqual(sorted(scanned['task_2']['002']), ['custom', 'gt', 'prompt'])
+
+        # Tones (written as WAV without ffmpeg) do not depend on the worker count
+        with mock.patch('shutil.which', return_value=None):
+            generate_test_tree(str(root / 'b'), None, ['001', '002'], ['custom'], 0.1, workers=1, seed=7)
+            generate_test_tree(str(root / 'c'), None, ['001', '002'], ['custom'], 0.1, workers=2, seed=7)
+        for name in os.listdir(root / 'b'):
+            self.assertEqual((root / 'b' / name).read_bytes(), (root / 'c' / name).read_bytes())
+
+        # A failed encode is not counted, and leaves no partial file behind
+        def failing(command, **kwargs):
+            Path(command[-1]).write_bytes(b'partial')
+            raise subprocess.CalledProcessError(1, command)
+        with mock.patch('generate_test_audio.shutil.which', return_value='/usr/bin/ffmpeg'), \
+                mock.patch('generate_test_audio.subprocess.run', side_effect=failing):
+            self.assertEqual(generate_test_tree(str(root / 'd'), None, ['001'], ['gt'], 0.1), 0)
+        self.assertEqual(os.listdir(root / 'd'), [])
+
+    def test_rating_normalization_and_reliability(self):
+        """Test z-scores, Krippendorff's alpha and rater consistency on a small design."""
+        def result(uuid_hex, ratings):
+            answers = {str(i): {'original_template_id': 'q1', 'prompt_id_selected': prompt,
+                                'metrics_rated': {m: {'整體評價（Overall Rating）': r} for m, r in models.items()}}
+                       for i, (prompt, models) in enumerate(ratings.items())}
+            return {'uuid': uuid_hex, 'answers': answers}
+
+        ratings = {'001': {'gt': 5, 'methodA': 2}, '002': {'gt': 4, 'methodA': 1}}
+        lenient = {p: {m: r + 1 if r < 5 else 5 for m, r in models.items()} for p, models in ratings.items()}
+        results = [result('a', ratings), result('b', ratings), result('c', lenient),
+                   result('d', {'001': {'gt': 3, 'methodA': 3}})]
+        table = ratings_table(results, lambda name: name.split('（')[1].rstrip('）'))
+        self.assertEqual(table.labels['metric'], ['Overall Rating'])
+        self.assertEqual(len(table), 14)
+
+        z = zscores(table)
+        participant_a = table.codes['participant'] == table.labels['participant'].index('a')
+        self.assertAlmostEqual(z[participant_a].mean(), 0.0)
+        self.assertTrue((z[table.codes['participant'] == 3] == 0).all())  # Constant rater
+
+        row, = reliability(table)
+        self.assertEqual((row['raters'], row['items'], row['ratings']), (4, 4, 14))
+        self.assertTrue(0.5 < row['alpha'] < 1)
+        self.assertEqual(reliability(ratings_table(results[:2]))[0]['alpha'], 1.0)
+
+        consistency = {row['participant']: row for row in participant_consistency(table)}
+        self.assertGreater(consistency['a']['consistency'], 0.9)
+        self.assertNotEqual(consistency['d']['consistency'], consistency['d']['consistency'])  # NaN
+
+    def test_mixed_effects_fit(self):
+        """Test the mixed-effects fit separates model means from rater and prompt effects."""
+        with tempfile.TemporaryDirectory() as tmp:
+            templates = build_templates(2, ['gt', 'methodA'], ['整體評價（Overall Rating）'])
+            generate_test_results(tmp, 300, templates, n_prompts=10, means={'gt': 4.0, 'methodA': 2.5},
+                                  rater_sd=0.6, interaction_sd=0.0, noise=0.5, workers=1)
+            results = load_result_files(tmp)
+            table = ratings_table(results)
+
+        rows = fit_mixed_models(table)
+        self.assertEqual(len(rows), 4)  # 2 templates x 1 metric x 2 models
+        estimates = {(row['template'], row['model']): row for row in rows}
+        for template in ('q1', 'q2'):
+            gt, method = estimates[(template, 'gt')], estimates[(template, 'methodA')]
+            self.assertTrue(gt['converged'])
+            self.assertAlmostEqual(gt['estimate'] - method['estimate'], 1.5, delta=0.15)
+            self.assertTrue(gt['ci_low'] < gt['estimate'] < gt['ci_high'])
+            self.assertAlmostEqual(gt['sd_participant'], 0.6, delta=0.2)
+            self.assertLess(gt['sd_prompt'], 0.2)
+
+        parallel = fit_mixed_models(table, workers=2)
+        self.assertEqual([row['estimate'] for row in parallel], [row['estimate'] for row in rows])
+
+        # A pilot template with one rating per model cannot be fitted, but the others still are
+        pilot = {'uuid': 'pilot', 'answers': {'0': {
+            'original_template_id': 'pilot', 'prompt_id_selected': '001',
+            'metrics_rated': {'gt': {'整體評價（Overall Rating）': 4}, 'methodA': {'整體評價（Overall Rating）': 2}}}}}
+        with_pilot = fit_mixed_models(ratings_table(results + [pilot]))
+        skipped = [row for row in with_pilot if row['template'] == 'pilot']
+        self.assertEqual(len(skipped), 2)
+        self.assertTrue(all(row['error'] and np.isnan(row['estimate']) for row in skipped))
+        self.assertEqual([row['estimate'] for row in with_pilot if row['template'] != 'pilot'],
+                         [row['estimate'] for row in rows])
+
+    def test_mixed_effects_line_search_fallback(self):
+        """Test the fit still converges when the L-BFGS-B line search aborts."""
+        rng = np.random.default_rng(0)
+        participant, prompt = np.repeat(np.arange(20), 6), np.tile(np.arange(6), 20)
+        model = np.tile([0, 1], 60)
+        y = 3.0 + model + rng.normal(0, 0.5, 20)[participant] + rng.normal(0, 0.5, 120)
+        expected = fit_crossed(y, model, participant, prompt)
+
+        minimize = mixed_effects.optimize.minimize
+
+        def aborted(fun, x0, method=None, **kwargs):
+            result = minimize(fun, x0, method=method, **kwargs)
+            if method == 'L-BFGS-B':
+                result.success = False  # e.g. ABNORMAL_TERMINATION_IN_LNSRCH
+            return result
+
+        with mock.patch.object(mixed_effects.optimize, 'minimize', side_effect=aborted):
+            fit = fit_crossed(y, model, participant, prompt)
+        self.assertTrue(fit['converged'])
+        np.testing.assert_allclose(fit['coef'], expected['coef'], atol=1e-3)
+
+    def test_html_report(self):
+        """Test the HTML report is self-contained, escaped and has a row per model and metric."""
+        results = [
+            {'uuid': f"p{i}", 'answers': {'0': {
+                'original_template_id': 'q1', 'prompt_id_selected': f"00{i % 3}",
+                'metrics_rated': {'gt': {'Overall': 4 + i % 2, 'Richness': 4}, '<b>model</b>': {'Overall': 2, 'Richness': 1 + i % 3}},
+                'time_spent_on_question': 30.0 + i}}}
+            for i in range(6)
+        ]
+        report = build_report(ratings_table(results))
+        template, = report['templates']
+        self.assertEqual(len(template['rows']), 4)
+        gt = next(row for row in template['rows'] if row['model'] == 'gt' and row['metric'] == 'Overall')
+        self.assertAlmostEqual(gt['mean'], 4.5)
+        self.assertTrue(gt['ci_low'] < 4.5 < gt['ci_high'])
+
+        html = render_report(report)
+        self.assertEqual(html.count('<svg class="chart"'), 1)
+        self.assertEqual(html.count('<svg class="hist"'), 4)
+        self.assertIn('&lt;b&gt;model&lt;/b&gt;', html)
+        self.assertNotIn('<b>model</b>', html)
+        self.assertNotIn('src=', html)
+        self.assertNotIn('href=', html)
+
+    def test_streaming_row_export(self):
+        """Test raw ratings stream to a gzip CSV with one row per participant, question, model and metric."""
+        import csv
+        import gzip
+        with tempfile.TemporaryDirectory() as tmp:
+            templates = build_templates(2, ['gt', 'methodA', 'methodB'], ['整體評價（Overall Rating）', '豐富性（Richness）'])
+            generate_test_results(os.path.join(tmp, 'results'), 12, templates, workers=1)
+            path = os.path.join(tmp, 'ratings.csv.gz')
+            written = write_rows(iter_rows(iter_result_files(os.path.join(tmp, 'results')),
+                                           MetricCatalog(templates).label), path, chunk_rows=7)
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+                rows = list(csv.reader(f))
+
+            self.assertEqual(written, 12 * 4 * 3 * 2)  # Participants x questions x models x metrics
+            self.assertEqual(tuple(rows[0]), ROW_FIELDS)
+            self.assertEqual(len(rows), written + 1)
+            record = dict(zip(ROW_FIELDS, rows[1]))
+            self.assertIn(record['metric'], ('Overall Rating', 'Richness'))
+            self.assertIn(int(record['position']), (0, 1, 2))
+            self.assertEqual(len({row[0] for row in rows[1:]}), 12)
+            with self.assertRaises(ValueError):
+                write_rows(iter([]), os.path.join(tmp, 'ratings.txt'))
+
+    def test_metric_catalog(self):
+        """Test metric names, language variants and IDs map to one metric without raising."""
+        catalog = MetricCatalog([{'metrics': [{'name': '整體評價（Overall Rating）'},
+                                              {'name': '連貫性（Coherence）', 'id': 'coh', 'aliases': ['流暢度（Fluency）']}]}])
+        for spelling in ('整體評價（Overall Rating）', 'Overall Rating', '整體評價', 'overall_rating'):
+            self.assertEqual(catalog.id_of(spelling), 'overall_rating')
+            self.assertEqual(catalog.label(spelling), 'Overall Rating')
+        self.assertEqual({catalog.id_of(name) for name in ('連貫性（Coherence）', '流暢度（Fluency）', 'coh')}, {'coh'})
+
+        # Unknown names no longer raise; a non-English qualifier stays part of the name
+        self.assertEqual(catalog.label('情感表達評價'), '情感表達評價')
+        self.assertEqual(catalog.label('音質評價（清晰度）'), '音質評價（清晰度）')
+        self.assertEqual(catalog.id_of('Naturalness (Fluency)'), 'naturalness_fluency')
+        self.assertEqual(catalog.label('自然度 (Naturalness)'), 'Naturalness')
+        self.assertEqual(derive_id(derive_id('整體評價（Overall Rating）')), 'overall_rating')
+
+        compact = catalog.compact({'gt': {'整體評價（Overall Rating）': 4, '連貫性（Coherence）': 3}})
+        self.assertEqual(compact, {'gt': {'overall_rating': 4, 'coh': 3}})
+        self.assertEqual(catalog.header(['coh', 'overall_rating']),
+                         {'coh': '連貫性（Coherence）', 'overall_rating': '整體評價（Overall Rating）'})
+
+        # Two names of one ID in one question would lose a rating
+        clashing = [{'id': 'q1', 'metrics': [{'name': '音質（Overall）'}, {'name': '整體（Overall）'}]}]
+        with self.assertRaises(ValueError):
+            MetricCatalog(clashing).compact({'gt': {'音質（Overall）': 2, '整體（Overall）': 5}})
+        app = Flask(__name__)
+        app.config['FORUM'] = {'questions': clashing}
+        with self.assertRaises(ValueError):
+            init_metric_names(app)
+        # Across templates the shared ID is deliberate
+        app.config['FORUM'] = {'questions': [{'id': 'q1', 'metrics': [{'name': '音質（Overall）'}]},
+                                             {'id': 'q2', 'metrics': [{'name': '整體（Overall）'}]}]}
+        self.assertEqual(init_metric_names(app).id_of('整體（Overall）'), 'overall')
+
+    def test_screening_rules(self):
+        """Test screening flags fast, straight-lined and reference-misranking sessions."""
+        def answer(gt, other, seconds=60.0):
+            return {'metrics_rated': {'gt': {'Overall': gt, 'Richness': gt}, 'methodA': {'Overall': other, 'Richness': other}},
+                    'time_spent_on_question': seconds}
+
+        rules = {'min_seconds_per_question': 20, 'max_straightline_fraction': 0.5, 'reference_model': 'gt'}
+        good = {'answers': {'0': answer(5, 3), '1': answer(4, 2)}}
+        self.assertEqual(screen_result(good, rules), [])
+        self.assertEqual(screen_result({'answers': {'0': answer(5, 3, 5.0), '1': answer(4, 2, 8.0)}}, rules),
+                         ['fast: 2/2 questions'])
+        self.assertEqual(screen_result({'answers': {'0': answer(3, 3), '1': answer(3, 3)}}, rules),
+                         ['straightline: 2/2 questions'])
+        self.assertEqual(screen_result({'answers': {'0': answer(2, 4), '1': answer(1, 5)}}, rules),
+                         ['reference_misrank: 2/2 questions'])
+        self.assertEqual(screen_result({'answers': {'0': answer(2, 4), '1': answer(5, 1)}}, rules), [])
+        self.assertEqual(screen_result(good, {}), [])
+
+    def test_negotiate_question_variants(self):
+        """Test picking the smallest audio encoding the client can play for all clips of a question."""
+        variants = [
+            {'path': 'a.48k.opus', 'format': 'opus', 'mime': 'audio/ogg', 'size': 10},
+            {'path': 'a.96k.m4a', 'format': 'aac', 'mime': 'audio/mp4', 'size': 20},
+            {'path': 'a.128k.mp3', 'format': 'mp3', 'mime': 'audio/mpeg', 'size': 30},
+        ]
+
+        def chosen_format(*args):
+            variant = negotiate_question_variants({'a.mp3': variants}, ['a.mp3'], *args)['a.mp3']
+            return variant and variant['format']
+        self.assertEqual(chosen_format(['opus', 'aac']), 'opus')
+        self.assertEqual(chosen_format(['aac', 'mp3']), 'aac')
+        self.assertEqual(chosen_format([], ['audio/mpeg']), 'mp3')
+        # Wildcards say nothing about what the browser can decode
+        self.assertIsNone(chosen_format([], ['*/*', 'audio/*']))
+
+        # A question gets one encoding: the smallest in total that every clip has
+        question = {'p.mp3': variants, 'm.mp3': [dict(variants[1], size=5), dict(variants[2], size=40)]}
+        chosen = negotiate_question_variants(question, ['p.mp3', 'm.mp3'], ['opus', 'aac', 'mp3'])
+        self.assertEqual({clip: v['format'] for clip, v in chosen.items()}, {'p.mp3': 'aac', 'm.mp3': 'aac'})
+        # ... or the originals throughout
+        self.assertEqual(negotiate_question_variants(question, ['p.mp3', 'm.mp3'], ['opus']),
+                         {'p.mp3': None, 'm.mp3': None})
+        self.assertEqual(prompt_clips({'task_1': {'001': ['prompt', 'gt']}}, 'task_1/001_gt.mp3'),
+                         ['task_1/001_prompt.mp3', 'task_1/001_gt.mp3'])
+
+    def test_transcode_reencodes_changed_settings(self):
+        """Test a variant is kept on a re-run only if it was encoded with the same settings."""
+        src = os.path.join(self.temp_dir.name, '001_gt.mp3')
+        Path(src).write_bytes(b'mp3')
+        job = {'src': src, 'dst': os.path.join(self.temp_dir.name, 'variants', '001_gt.48k.opus'),
+               'source': '001_gt.mp3', 'path': '001_gt.48k.opus', 'format': 'opus', 'bitrate': '48k',
+               'loudness': -16.0, 'true_peak': -1.5, 'max_duration': None, 'previous': None}
+
+        def encode(command, **kwargs):
+            Path(command[-1]).write_bytes(b'opus')
+        with mock.patch('transcode_audio.subprocess.run', side_effect=encode) as run:
+            entry = transcode_file(job)
+            transcode_file(dict(job, previous=entry))
+            self.assertEqual(run.call_count, 1)  # Up to date
+            transcode_file(dict(job, previous=entry, loudness=-23.0))
+            transcode_file(dict(job, previous=entry, force=True))
+            self.assertEqual(run.call_count, 3)
+        self.assertEqual((entry['loudness'], entry['truePeak'], entry['size']), (-16.0, -1.5, 4))
+
+    def test_audio_index_flags_corrupt_clips(self):
+        """Test the audio index flags zero-byte and truncated clips."""
+        task_dir = Path(self.temp_dir.name) / 'indexed' / 'task_1'
+        task_dir.mkdir(parents=True)
+        clip = Path('static/audio/task_1/001_gt.mp3').read_bytes()
+        (task_dir / '001_prompt.mp3').write_bytes(clip)
+        (task_dir / '001_gt.mp3').write_bytes(clip)
+        (task_dir / '001_methodA.mp3').write_bytes(clip[:len(clip) // 2])  # Truncated
+        (task_dir / '001_methodB.mp3').touch()  # Zero bytes
+
+        cache_path = Path(self.temp_dir.name) / 'audio_index.json'
+        audio_root = str(task_dir.parent)
+        index = build_audio_index(audio_root, str(cache_path))
+        self.assertAlmostEqual(index['task_1/001_gt.mp3']['duration'], 3.0, delta=0.1)
+        self.assertNotIn('error', index['task_1/001_gt.mp3'])
+        self.assertIn('error', index['task_1/001_methodA.mp3'])
+        self.assertIn('error', index['task_1/001_methodB.mp3'])
+        self.assertTrue(cache_path.exists())
+
+        # Cached entries are reused as long as size and mtime are unchanged
+        self.assertEqual(build_audio_index(audio_root, str(cache_path)), index)
+
+        template = {'id': 'q1', 'audioSubfolder': 'task_1', 'models': ['gt', 'methodA', 'methodB']}
+        errors = validate_audio_index([template], scan_audio_directory(audio_root), index)
+        self.assertEqual(len(errors), 2)
+
+    def test_metrics_multiprocess_aggregation(self):
+        """Test metric snapshots of several workers are summed, dropping dead gauges."""
+        metrics_dir = Path(self.temp_dir.name) / 'metrics'
+        registry = MetricsRegistry(str(metrics_dir))
+        registry.counter('requests_total', 'Requests.').inc(endpoint='cover.index')
+        registry.gauge('in_flight', 'In flight.').inc(endpoint='cover.index')
+        registry.histogram('latency_seconds', 'Latency.', (0.1, 1.0)).observe(0.5, endpoint='cover.index')
+        registry.flush(force=True)
+
+        # A second worker that has since exited
+        dead_pid = 2 ** 22 + 1
+        other = json.loads((metrics_dir / f"metrics_{os.getpid()}.json").read_text())
+        other['pid'] = dead_pid
+        (metrics_dir / f"metrics_{dead_pid}.json").write_text(json.dumps(other))
+
+        text = registry.render()
+        self.assertIn('requests_total{endpoint="cover.index"} 2', text)
+        self.assertIn('in_flight{endpoint="cover.index"} 1', text)
+        self.assertIn('latency_seconds_bucket{endpoint="cover.index",le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{endpoint="cover.index",le="0.1"} 0', text)
+
+        mark_process_dead(str(metrics_dir), dead_pid)
+        self.assertFalse((metrics_dir / f"metrics_{dead_pid}.json").exists())
+        self.assertEqual(registry.render(), text)
+
+    def test_admission_controller_queue(self):
+        """Test sessions over the limit are queued in order and admitted as slots free up."""
+        db_path = os.path.join(self.temp_dir.name, 'admission.sqlite3')
+        admission = AdmissionController(SQLiteBackend(db_path), max_active=2)
+        self.assertEqual(admission.admit('a'), (True, 0))
+        self.assertEqual(admission.admit('b'), (True, 0))
+        self.assertEqual(admission.admit('c'), (False, 1))
+        self.assertEqual(admission.admit('d'), (False, 2))
+        self.assertEqual(admission.admit('a'), (True, 0))  # Already active
+
+        admission.release('a')
+        self.assertEqual(admission.admit('d'), (False, 2))  # 'c' is still ahead
+        self.assertEqual(admission.admit('c'), (True, 0))
+        self.assertEqual(admission.status()['active'], 2)
+        self.assertEqual(admission.status()['queued'], 1)
+
+        # Bandwidth budget shared through the database
+        budget = AdmissionController(MemoryBackend(), audio_budget=1000, window=1.0)
+        self.assertEqual(budget.admit('x'), (True, 0))
+        budget.record_audio_bytes(5000)
+        self.assertEqual(budget.admit('y'), (False, 1))
+
+        # Far back in the queue, the page still retries before its entry expires
+        queue = AdmissionController(MemoryBackend(), max_active=1, queue_timeout=60.0)
+        tickets = [f"t{i}" for i in range(151)]
+        for i, ticket in enumerate(tickets):
+            with mock.patch('utils.admission.time.time', return_value=1000.0 + i / 1000):
+                position = queue.admit(ticket)[1]
+        self.assertEqual(position, 150)
+        for position in (1, 110, 150, 10000):
+            self.assertTrue(all(1 <= queue.retry_after(position, 5) <= 30 for _ in range(50)))
+        retry = max(queue.retry_after(150, 5) for _ in range(50))
+        with mock.patch('utils.admission.time.time', return_value=1000.2 + retry):
+            self.assertEqual(queue.admit(tickets[-1]), (False, 150))
+
+
+    def test_audio_warmer_budget(self):
+        """Test the warmer reads queued files and tracks only what fits in its budget."""
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.temp_dir.name, f"clip_{i}.mp3")
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 1000)
+            paths.append(path)
+        warmer = AudioWarmer(budget=2500)
+        self.assertEqual(warmer.warm(paths), 3)
+        for _ in range(500):
+            if warmer.stats()['queued_files'] == 0 and warmer.stats()['warm_files'] == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(warmer.stats(), {'warm_files': 2, 'warm_bytes': 2000, 'queued_files': 0})
+        self.assertFalse(warmer.is_warm(paths[0]))  # Oldest dropped for the budget
+        self.assertTrue(warmer.is_warm(paths[2]))
+        self.assertEqual(warmer.warm(paths[1:]), 0)  # Already warm
+
+        # Re-planning runs on the warming thread, at most once per refresh interval
+        planned = threading.Event()
+        threads = []
+        plan = lambda: (threads.append(threading.current_thread().name), planned.set())
+        self.assertTrue(warmer.replan(plan))
+        self.assertTrue(planned.wait(5))
+        self.assertEqual(threads, ['forum-audio-warmer'])
+        self.assertFalse(warmer.replan(plan))
 
 class TestApp(unittest.TestCase):
     """Test Flask application."""
     
     def setUp(self):
         """Set up test environment."""
-        self.app = create_app({'TESTING': True})
+        self.app = create_app({'TESTING': True, 'STATE_BACKEND': 'memory://'})  # Keep out of instance/state.sqlite3
+        wait_until_ready(self.app)  # Tests change the audio config afterwards
         self.client = self.app.test_client()
     
     def test_cover_page(self):
@@ -180,6 +698,426 @@ class TestApp(unittest.TestCase):
         response = self.client.get('/questions/0')
         self.assertEqual(response.status_code, 302)  # Redirect to participant page
 
+    def test_heartbeat_does_not_rewrite_session(self):
+        """Test heartbeat and audio requests leave the session cookie alone."""
+        self.client.get('/')  # Creates the permanent session cookie
+
+        response = self.client.get('/api/heartbeat')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.getlist('Set-Cookie'), [])
+
+        response = self.client.get('/static/css/site.css')
+        self.assertEqual(response.headers.getlist('Set-Cookie'), [])
+        response.close()
+
+        # Once the cookie is old enough, the heartbeat re-signs it without decoding
+        self.app.config['SESSION_REFRESH_AFTER'] = 0
+        response = self.client.get('/api/heartbeat')
+        self.assertEqual(len(response.headers.getlist('Set-Cookie')), 1)
+
+        self.assertEqual(self.client.get('/api/session/stats').status_code, 404)  # Only for operators
+        self.app.config['ADMIN_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/admin/session').status_code, 403)
+        stats = self.client.get('/admin/session', headers={'X-Admin-Token': 'secret'}).get_json()
+        self.assertEqual(stats['refreshed'], 1)
+        self.assertGreaterEqual(stats['skipped'], 1)
+
+    def test_serve_audio_variant(self):
+        """Test serve_audio negotiates a transcoded variant from the manifest."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_root = Path(temp_dir) / 'audio'
+            variants_root = Path(temp_dir) / 'variants'
+            (audio_root / 'task_1').mkdir(parents=True)
+            (variants_root / 'task_1').mkdir(parents=True)
+            (audio_root / 'task_1' / '001_gt.mp3').write_bytes(b'original')
+            (variants_root / 'task_1' / '001_gt.48k.opus').write_bytes(b'opus')
+
+            self.app.config['FORUM'] = {'audioRoot': str(audio_root), 'audioVariantsRoot': str(variants_root)}
+            self.app.config['AUDIO_VARIANTS'] = {
+                'task_1/001_gt.mp3': [
+                    {'path': 'task_1/001_gt.48k.opus', 'format': 'opus', 'mime': 'audio/ogg', 'size': 4}
+                ]
+            }
+            self.app.config['AUDIO_MODELS'] = {'task_1': {'001': ['gt']}}
+
+            response = self.client.get('/api/audio/task_1/001_gt.mp3?formats=opus,mp3')
+            self.assertEqual(response.data, b'opus')
+            self.assertEqual(response.mimetype, 'audio/ogg')
+            self.assertIn('Accept', response.vary)
+            response.close()
+
+            response = self.client.get('/api/audio/task_1/001_gt.mp3?formats=mp3')
+            self.assertEqual(response.data, b'original')
+            response.close()
+
+            # With nginx offloading, the app only names the internal location
+            self.app.config['AUDIO_OFFLOAD'] = 'x-accel'
+            response = self.client.get('/api/audio/task_1/001_gt.mp3')
+            self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-audio/task_1/001_gt.mp3')
+            self.assertEqual(response.data, b'')
+            self.assertEqual(self.client.get('/api/audio/task_1/missing.mp3').status_code, 404)
+
+    def test_audio_bundle(self):
+        """Test a question's clips are served as one bundle that splits into the single clips."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_root = Path(temp_dir) / 'audio'
+            variants_root = Path(temp_dir) / 'variants'
+            (audio_root / 'task_1').mkdir(parents=True)
+            (variants_root / 'task_1').mkdir(parents=True)
+            for tag in ('prompt', 'gt', 'methodA'):
+                (audio_root / 'task_1' / f'001_{tag}.mp3').write_bytes(f'mp3 {tag}'.encode() * 100)
+            (variants_root / 'task_1' / '001_gt.48k.opus').write_bytes(b'opus')
+            self.app.config['FORUM'] = {'audioRoot': str(audio_root), 'audioVariantsRoot': str(variants_root)}
+            self.app.config['AUDIO_VARIANTS'] = {
+                'task_1/001_gt.mp3': [{'path': 'task_1/001_gt.48k.opus', 'format': 'opus', 'mime': 'audio/ogg', 'size': 4}]
+            }
+            self.app.config['AUDIO_MODELS'] = {'task_1': {'001': ['prompt', 'gt', 'methodA']}}
+
+            url = '/api/audio/bundle?subfolder=task_1&prompt=001&tags=prompt,gt,methodA&formats=opus,mp3'
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_length, len(response.data))
+            clips = parse_bundle(response.data)
+            self.assertEqual([entry['tag'] for entry, _ in clips], ['prompt', 'gt', 'methodA'])
+            for entry, data in clips:
+                single = self.client.get(entry['url'] + '?formats=opus,mp3')
+                self.assertEqual((data, entry['mime']), (single.data, single.mimetype))
+                single.close()
+            # Only gt has a variant, so the whole question is served as originals
+            self.assertEqual([entry['mime'] for entry, _ in clips], ['audio/mpeg'] * 3)
+            self.assertIn('Accept', response.vary)
+
+            revalidated = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(revalidated.status_code, 304)
+
+            # Once every clip has one, all come in the same encoding
+            for tag in ('prompt', 'methodA'):
+                (variants_root / 'task_1' / f'001_{tag}.48k.opus').write_bytes(b'opus')
+                self.app.config['AUDIO_VARIANTS'][f'task_1/001_{tag}.mp3'] = [
+                    {'path': f'task_1/001_{tag}.48k.opus', 'format': 'opus', 'mime': 'audio/ogg', 'size': 4}]
+            clips = parse_bundle(self.client.get(url).data)
+            self.assertEqual([entry['mime'] for entry, _ in clips], ['audio/ogg'] * 3)
+            self.assertEqual(self.client.get(url.replace('methodA', 'missing')).status_code, 404)
+            self.assertEqual(self.client.get(url.replace('prompt,gt', 'gt,gt')).status_code, 400)
+
+    def test_metrics_endpoint(self):
+        """Test /metrics reports per-endpoint requests, audio cache hits and cookie sizes."""
+        self.app.config['FORUM'] = {'audioRoot': 'static/audio'}
+        self.client.get('/')
+        response = self.client.get('/api/audio/task_1/001_gt.mp3')
+        etag = response.headers['ETag']
+        response.close()
+        response = self.client.get('/api/audio/task_1/001_gt.mp3', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.headers.getlist('Set-Cookie'), [])
+        text = response.get_data(as_text=True)
+        self.assertIn('forum_http_requests_total{endpoint="cover.index",method="GET",status="200"} 1', text)
+        self.assertIn('forum_audio_requests_total{result="hit",source="original"} 1', text)
+        self.assertIn('forum_audio_requests_total{result="miss",source="original"} 1', text)
+        self.assertIn('forum_session_cookie_bytes_count{endpoint="cover.index"} 1', text)
+        self.assertIn('forum_http_requests_in_flight{endpoint="metrics.export"} 1', text)
+
+    def test_profiler_admin_routes(self):
+        """Test profiling captures are token-protected and write collapsed and speedscope files."""
+        with tempfile.TemporaryDirectory() as profile_dir:
+            self.app.config['ADMIN_TOKEN'] = 'secret'
+            self.app.extensions['profiler'].profile_dir = profile_dir
+            headers = {'X-Admin-Token': 'secret'}
+
+            self.assertEqual(self.client.post('/admin/profile/start').status_code, 403)
+            response = self.client.post('/admin/profile/start', json={'sampleRate': 1.0}, headers=headers)
+            self.assertTrue(response.get_json()['status']['active'])
+
+            for _ in range(5):
+                self.client.get('/')
+            status = self.client.get('/admin/profile/status', headers=headers).get_json()
+            self.assertEqual(status['sampledRequests'], {'cover.index': 5})
+
+            # Stacks are sampled on a timer; add a known one so output is deterministic
+            profiler = self.app.extensions['profiler']
+            profiler.stacks[('cover.index', 'index (cover.py:10)', 'render_template (templating.py:139)')] += 3
+
+            files = self.client.post('/admin/profile/stop', headers=headers).get_json()['files']
+            self.assertEqual(len(files), 2)
+            collapsed = Path(files[0]).read_text()
+            self.assertIn('cover.index;index (cover.py:10);render_template (templating.py:139) 3', collapsed)
+            speedscope = json.loads(Path(files[1]).read_text())
+            self.assertIn('cover.index', [p['name'] for p in speedscope['profiles']])
+            self.assertFalse(Path(profile_dir, 'capture.json').exists())
+
+        self.app.config['ADMIN_TOKEN'] = None
+        self.assertEqual(self.client.get('/admin/profile/status').status_code, 404)
+
+    def test_telemetry_endpoint(self):
+        """Test telemetry batches are validated, aggregated per clip and flushed to JSONL."""
+        with tempfile.TemporaryDirectory() as telemetry_dir:
+            aggregator = self.app.extensions['telemetry']
+            aggregator.out_dir = telemetry_dir
+            self.app.config['AUDIO_MODELS'] = {'task_1': {'001': ['gt']}}
+            batch = {
+                'network': '3g',
+                'events': [
+                    {'type': 'clip', 'clip': 'task_1/001_gt.mp3', 'ttfb': 80, 'load': 900, 'stalls': 1},
+                    {'type': 'clip', 'clip': 'task_1/001_gt.mp3', 'ttfb': 120, 'load': 1100, 'stalls': 0},
+                    {'type': 'clip', 'clip': 'task_1/001_gt.mp3', 'load': -1},  # Nothing valid
+                    {'type': 'page', 'template': 'q1', 'question': 0, 'pageTime': 30000},
+                    {'type': 'unknown', 'load': 1},
+                    {'type': 'clip', 'clip': 'task_1/not_a_clip.mp3', 'load': 500}  # Not in AUDIO_MODELS
+                ]
+            }
+            # sendBeacon posts JSON as text/plain and must not touch the session
+            response = self.client.post('/api/telemetry', data=json.dumps(batch), content_type='text/plain')
+            self.assertEqual(response.status_code, 204)
+            self.assertEqual(response.headers.getlist('Set-Cookie'), [])
+            self.assertEqual(self.client.post('/api/telemetry', data='not json').status_code, 400)
+
+            summary = aggregator.summary()
+            self.assertEqual(summary['received'], 3)
+            self.assertEqual(summary['clips']['task_1/001_gt.mp3']['load']['p50'], 1000.0)
+            self.assertEqual(summary['networks']['3g']['pageTime']['count'], 1)
+
+            aggregator.flush(force=True)
+            events = load_telemetry(telemetry_dir)
+            self.assertEqual(len(events), 3)
+            self.assertEqual(events[0]['format'], 'mp3')
+            by_format = summarize_events(events, 'format')
+            self.assertEqual(by_format['mp3']['ttfb']['count'], 2)
+        self.assertEqual(normalize_batch({'events': 'nope'}), [])
+
+        # Past max_keys, new clips share one key instead of growing the aggregator
+        bounded = TelemetryAggregator(tempfile.gettempdir(), max_keys=2)
+        bounded.add([{'type': 'clip', 'clip': f'task_1/{i:03d}_gt.mp3', 'load': 100} for i in range(5)])
+        self.assertEqual(sorted(bounded.summary()['clips']), ['other', 'task_1/000_gt.mp3', 'task_1/001_gt.mp3'])
+        self.assertEqual(bounded.summary()['clips']['other']['load']['count'], 3)
+
+    def test_healthz_reports_readiness(self):
+        """Test /healthz returns 503 while audio is prepared in the background, then 200."""
+        release = threading.Event()
+        with mock.patch('utils.startup.prepare_audio', side_effect=lambda app: release.wait(5)):
+            app = create_app({'TESTING': True, 'AUDIO_INIT_BACKGROUND': True, 'STATE_BACKEND': 'memory://'})
+            client = app.test_client()
+            response = client.get('/healthz')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.get_json()['status'], 'starting')
+            self.assertEqual(response.headers.getlist('Set-Cookie'), [])
+            self.assertFalse(wait_until_ready(app, 0.01))
+
+            release.set()
+            self.assertTrue(wait_until_ready(app, 5))
+        response = client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ready')
+
+    def test_rules_markdown_cached(self):
+        """Test the rules markdown is rendered once per file version."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / 'rules.md'
+            path.write_text('# Rules', encoding='utf-8')
+            mtime = path.stat().st_mtime_ns
+            html = _render_markdown(str(path), mtime)
+            self.assertIn('<h1>Rules</h1>', html)
+            path.write_text('# Changed', encoding='utf-8')
+            self.assertEqual(_render_markdown(str(path), mtime), html)  # Same version: cached
+            self.assertIn('Changed', _render_markdown(str(path), mtime + 1))
+
+    def test_multi_study_hosting(self):
+        """Test studies mounted under URL prefixes share audio data but not results or sessions."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            forum_config = build_fixture(temp_dir, n_prompts=2, n_templates=1, duration=0.5)
+            multi = create_multi_app(
+                {'/study-a': {'FORUM_CONFIG': forum_config}, '/study-b': {'FORUM_CONFIG': forum_config}},
+                {'TESTING': True, 'AUDIO_INIT_BACKGROUND': False, 'STATE_BACKEND': 'memory://',
+                 'RESULTS_DIR': os.path.join(temp_dir, 'results'),
+                 'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json')}
+            )
+            app_a, app_b = multi.mounts['/study-a'], multi.mounts['/study-b']
+            self.assertIs(app_a.config['AUDIO_MODELS'], app_b.config['AUDIO_MODELS'])
+            self.assertNotEqual(app_a.config['RESULTS_DIR'], app_b.config['RESULTS_DIR'])
+            self.assertEqual(app_a.config['SESSION_COOKIE_NAME'], 'session_study-a')
+
+            client = Client(multi)
+            response = client.get('/study-a/')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'window.SCRIPT_ROOT = "/study-a"', response.data)
+            self.assertIn(b'/study-a/static/', response.data)
+            self.assertEqual(client.get('/study-b/healthz').status_code, 200)
+            self.assertEqual(client.get('/').status_code, 404)
+
+    def test_admission_waiting_page(self):
+        """Test rules.begin sends participants over the session limit to the waiting page."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            app = create_app({'TESTING': True, 'ADMISSION_MAX_ACTIVE': 1,
+                              'FORUM_CONFIG': build_fixture(temp_dir, n_prompts=2, n_templates=1, duration=0.5),
+                              'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json'),
+                              'STATE_BACKEND': 'memory://'})
+            wait_until_ready(app)
+            first, second = app.test_client(), app.test_client()
+            for client in (first, second):
+                with client.session_transaction() as sess:
+                    sess['participant'] = {'name': 'test'}
+
+            self.assertEqual(first.get('/rules/begin').status_code, 302)  # Admitted
+            response = second.get('/rules/begin')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'http-equiv="refresh"', response.data)
+            self.assertIn(b'class="position">1<', response.data)
+
+            # Freeing the first slot admits the queued participant on the next retry
+            with first.session_transaction() as sess:
+                app.extensions['admission'].release(sess['admission_ticket'])
+            with second.session_transaction() as sess:
+                self.assertEqual(app.extensions['admission'].admit(sess['admission_ticket']), (True, 0))
+
+    def test_audio_warmed_at_startup(self):
+        """Test the clips of valid prompts are warmed once audio is ready and count as warm hits."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            app = create_app({'TESTING': True, 'STATE_BACKEND': 'memory://',
+                              'FORUM_CONFIG': build_fixture(temp_dir, n_prompts=2, n_templates=1, duration=0.5),
+                              'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json')})
+            wait_until_ready(app)
+            warmer = app.extensions['warmer']
+            for _ in range(500):
+                if warmer.stats()['warm_files'] == 10:  # 2 prompts x (prompt + 4 models)
+                    break
+                time.sleep(0.01)
+            self.assertEqual(warmer.stats()['warm_files'], 10)
+
+            client = app.test_client()
+            client.get('/api/audio/task_1/001_gt.mp3').close()
+            text = client.get('/metrics').get_data(as_text=True)
+            self.assertIn('forum_audio_warm_requests_total{result="warm"} 1', text)
+            self.assertIn('forum_audio_warmer{stat="warm_files"} 10', text)
+
+    def test_scale_out_nodes_share_state(self):
+        """Test any node can serve a session and a retried finish saves the result once."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            forum_config_path = build_fixture(temp_dir, n_prompts=3, n_templates=1, duration=0.5)
+            with open(forum_config_path, 'r', encoding='utf-8') as f:
+                forum_config = json.load(f)
+            forum_config['questions'][0]['target_count'] = 100
+            with open(forum_config_path, 'w', encoding='utf-8') as f:
+                json.dump(forum_config, f)
+
+            backend = MemoryBackend()  # Stands in for a Redis server shared by the nodes
+            nodes = [create_app({'TESTING': True, 'AUDIO_INIT_BACKGROUND': False, 'STATE_BACKEND': backend,
+                                 'FORUM_CONFIG': forum_config_path,
+                                 'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json'),
+                                 'RESULTS_DIR': os.path.join(temp_dir, f"results_{i}")}) for i in range(2)]
+            first, second = nodes[0].test_client(), nodes[1].test_client()
+            with first.session_transaction() as sess:
+                sess['participant'] = {'name': 'test'}
+            self.assertEqual(first.get('/rules/begin').status_code, 302)
+            with first.session_transaction() as sess:
+                questions = sess['session_questions']
+            for index, question in enumerate(questions):
+                answers = {model: {'Overall': 4} for model in question['models']}
+                response = first.post('/api/save', json={'originalQuestionId': 'q1', 'questionIndex': index, 'answers': answers})
+                self.assertTrue(response.get_json()['success'])
+
+            # The next request lands on the other node; the response is lost and the
+            # participant's browser retries on the first node with the old cookie
+            second.set_cookie('session', first.get_cookie('session').value)
+            saved = second.post('/api/finish').get_json()
+            retried = first.post('/api/finish').get_json()
+            self.assertTrue(saved['success'] and retried['success'])
+            self.assertEqual(saved['resultFile'], retried['resultFile'])
+
+            self.assertEqual(len(os.listdir(os.path.join(temp_dir, 'results_1'))), 1)
+            result = load_results(os.path.join(temp_dir, 'results_1', saved['resultFile']))
+            self.assertEqual(result['metrics'], {'overall': 'Overall'})  # Ratings are stored under metric IDs
+            self.assertEqual(set(result['answers']['0']['metrics_rated'][questions[0]['models'][0]]), {'overall'})
+            self.assertEqual(os.listdir(os.path.join(temp_dir, 'results_0')), [])
+            self.assertEqual(len(backend.hgetall('results')), 1)
+            self.assertEqual(json.loads(backend.hget('results', result['uuid']))['schema'], 2)  # RESULTS_FORMAT
+            self.assertEqual(template_total(nodes[0].extensions['quota'].usage(), 'q1'), len(questions))
+
+    def test_screened_session_frees_its_quota(self):
+        """Test an excluded session is not counted and its prompts are released."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            forum_config_path = build_fixture(temp_dir, n_prompts=3, n_templates=1, duration=0.5)
+            with open(forum_config_path, 'r', encoding='utf-8') as f:
+                forum_config = json.load(f)
+            forum_config['questions'][0]['target_count'] = 100
+            forum_config['screening'] = {'max_straightline_fraction': 0.5}
+            with open(forum_config_path, 'w', encoding='utf-8') as f:
+                json.dump(forum_config, f)
+
+            app = create_app({'TESTING': True, 'AUDIO_INIT_BACKGROUND': False, 'STATE_BACKEND': 'memory://',
+                              'FORUM_CONFIG': forum_config_path, 'ADMIN_TOKEN': 'secret',
+                              'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json'),
+                              'RESULTS_DIR': os.path.join(temp_dir, 'results')})
+            client = app.test_client()
+            for rating in (None, 4):
+                with client.session_transaction() as sess:
+                    sess['participant'] = {'name': 'test'}
+                client.get('/rules/begin')
+                with client.session_transaction() as sess:
+                    questions = sess['session_questions']
+                for index, question in enumerate(questions):
+                    # None: every model gets a different rating; 4: straight-lined
+                    answers = {model: {'Overall': rating or i + 1} for i, model in enumerate(question['models'])}
+                    client.post('/api/save', json={'originalQuestionId': 'q1', 'questionIndex': index, 'answers': answers})
+                self.assertTrue(client.post('/api/finish').get_json()['success'])
+
+            self.assertEqual(len(os.listdir(os.path.join(temp_dir, 'results'))), 2)
+            quota = app.extensions['quota']
+            # Only the first session counts; the excluded one released its reservation
+            self.assertEqual(template_total(quota.usage(include_reservations=False), 'q1'), len(questions))
+            self.assertEqual(template_total(quota.usage(), 'q1'), len(questions))
+            status = client.get('/admin/screening', headers={'X-Admin-Token': 'secret'}).get_json()
+            self.assertEqual((status['screened'], status['excluded']), (2, 1))
+
+    def test_finish_survives_bookkeeping_failure(self):
+        """Test a failed quota update and a debug run both finish the session and free its reservation."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            forum_config_path = build_fixture(temp_dir, n_prompts=3, n_templates=1, duration=0.5)
+            with open(forum_config_path, 'r', encoding='utf-8') as f:
+                forum_config = json.load(f)
+            forum_config['questions'][0]['target_count'] = 100
+            with open(forum_config_path, 'w', encoding='utf-8') as f:
+                json.dump(forum_config, f)
+
+            app = create_app({'TESTING': True, 'AUDIO_INIT_BACKGROUND': False, 'STATE_BACKEND': 'memory://',
+                              'FORUM_CONFIG': forum_config_path,
+                              'AUDIO_INDEX_CACHE': os.path.join(temp_dir, 'audio_index.json'),
+                              'RESULTS_DIR': os.path.join(temp_dir, 'results')})
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['participant'] = {'name': 'test'}
+            client.get('/rules/begin')
+            quota = app.extensions['quota']
+            self.assertGreater(template_total(quota.usage(), 'q1'), 0)  # Reserved
+
+            with mock.patch.object(quota, 'record', side_effect=RuntimeError('backend down')):
+                self.assertTrue(client.post('/api/finish').get_json()['success'])
+            self.assertEqual(len(os.listdir(os.path.join(temp_dir, 'results'))), 1)
+            self.assertEqual(template_total(quota.usage(), 'q1'), 0)
+
+            # A debug run is not counted, but its reservation is released as well
+            app.config['FORUM']['debug'] = True
+            app.config['DEBUG_RESULTS_DIR'] = os.path.join(temp_dir, 'debug')
+            with client.session_transaction() as sess:
+                sess['participant'] = {'name': 'test'}
+            client.get('/rules/begin')
+            self.assertGreater(template_total(quota.usage(), 'q1'), 0)
+            self.assertTrue(client.post('/api/finish').get_json()['success'])
+            self.assertEqual(template_total(quota.usage(), 'q1'), 0)
+
+    def test_benchmark_sessions(self):
+        """Test the session benchmark completes simulated participants without errors."""
+        report = run_benchmark(participants=2, concurrency=2, fixture={'n_prompts': 3, 'n_templates': 1, 'duration': 1.0})
+        self.assertEqual(report['completed_sessions'], 2)
+        self.assertEqual(report['error_rate'], 0.0)
+        self.assertEqual(report['routes']['questions.show']['count'], 4)
+        self.assertEqual(report['routes']['api.serve_audio_bundle']['count'], 4)  # One audio request per question
+        self.assertEqual(compare_to_baseline(report, report), [])
+
+        slower = json.loads(json.dumps(report))
+        slower['routes']['api.finish']['p95_ms'] += 1000
+        self.assertEqual(len(compare_to_baseline(slower, report)), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Script to prepare loudness-normalized, transcoded variants of a listening test audio tree.
+
+Every clip under the input directory is normalized with ffmpeg's loudnorm filter
+and encoded into one or more compact variants (Opus, AAC, MP3 at chosen bitrates).
+A manifest.json is written next to the variants so that the forum can serve the
+smallest format each participant's browser supports, the same for every clip of
+a question (see utils/audio_variants.py). Each manifest entry records the
+normalization it was encoded with; on a re-run, a variant is only kept if it is
+newer than its source and was encoded with the same settings (or use --force).
+"""
+import os
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.audio_variants import MANIFEST_NAME, load_variant_manifest
+
+# Encoder settings per output format
+FORMATS = {
+    'opus': {'codec': 'libopus', 'ext': 'opus', 'mime': 'audio/ogg', 'sample_rate': 48000},
+    'aac': {'codec': 'aac', 'ext': 'm4a', 'mime': 'audio/mp4', 'sample_rate': 44100},
+    'mp3': {'codec': 'libmp3lame', 'ext': 'mp3', 'mime': 'audio/mpeg', 'sample_rate': 44100},
+}
+
+ENCODING_KEYS = ('bitrate', 'loudness', 'truePeak', 'maxDuration')  # Manifest entry fields that change the output
+
+
+def parse_variants(spec):
+    """
+    Parse a variant specification string.
+
+    Args:
+        spec: Comma-separated list of format:bitrate pairs, e.g. "opus:48k,aac:96k,mp3:128k"
+
+    Returns:
+        List of (format, bitrate) tuples
+    """
+    variants = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        fmt, _, bitrate = item.partition(':')
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}'. Choose from: {', '.join(FORMATS)}")
+        variants.append((fmt, bitrate or '96k'))
+    return variants
+
+
+def variant_path(relative_source, fmt, bitrate):
+    """
+    Build the relative output path of a variant.
+
+    Args:
+        relative_source: Source path relative to the input root (e.g. "task_1/001_gt.mp3")
+        fmt: Output format key
+        bitrate: Target bitrate string
+
+    Returns:
+        Relative variant path (e.g. "task_1/001_gt.48k.opus")
+    """
+    source = Path(relative_source)
+    return (source.parent / f"{source.stem}.{bitrate}.{FORMATS[fmt]['ext']}").as_posix()
+
+
+def build_ffmpeg_command(src, dst, fmt, bitrate, loudness=-16.0, true_peak=-1.5, max_duration=None):
+    """
+    Build the ffmpeg command for one normalized variant.
+
+    Args:
+        src: Input audio file
+        dst: Output audio file
+        fmt: Output format key
+        bitrate: Target bitrate string
+        loudness: Integrated loudness target in LUFS
+        true_peak: True peak ceiling in dBTP
+        max_duration: Optional maximum duration in seconds (trims longer clips)
+
+    Returns:
+        List of command-line arguments
+    """
+    settings = FORMATS[fmt]
+    command = ['ffmpeg', '-y', '-i', str(src), '-vn', '-map_metadata', '-1']
+    if max_duration:
+        command += ['-t', str(max_duration)]
+    command += [
+        '-af', f'loudnorm=I={loudness}:TP={true_peak}:LRA=11',
+        # loudnorm resamples internally, so the output rate must be set explicitly
+        '-ar', str(settings['sample_rate']),
+        '-codec:a', settings['codec'], '-b:a', bitrate,
+    ]
+    if fmt == 'aac':
+        command += ['-movflags', '+faststart']
+    command.append(str(dst))
+    return command
+
+
+def transcode_file(job):
+    """
+    Transcode one source clip into one variant (runs in a worker process).
+
+    Args:
+        job: Dictionary with src, dst, relative paths, encoder options, the
+            'previous' manifest entry of the variant (or None) and 'force'
+
+    Returns:
+        Manifest entry dictionary, with an 'error' key if ffmpeg failed
+    """
+    src, dst = Path(job['src']), Path(job['dst'])
+    entry = {
+        'source': job['source'],
+        'path': job['path'],
+        'format': job['format'],
+        'mime': FORMATS[job['format']]['mime'],
+        'bitrate': job['bitrate'],
+        'loudness': job['loudness'],
+        'truePeak': job['true_peak'],
+        'maxDuration': job['max_duration'],
+    }
+    dst.parent.mkdir(parents=True, exist_ok=True)
+
+    # Keep a variant only if it is newer than its source and was encoded with the same settings
+    previous = job.get('previous') or {}
+    up_to_date = (not job.get('force') and dst.exists() and dst.stat().st_mtime >= src.stat().st_mtime
+                  and all(previous.get(key) == entry[key] for key in ENCODING_KEYS))
+    if not up_to_date:
+        try:
+            subprocess.run(
+                build_ffmpeg_command(src, dst, job['format'], job['bitrate'],
+                                     job['loudness'], job['true_peak'], job['max_duration']),
+                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except subprocess.CalledProcessError as e:
+            dst.unlink(missing_ok=True)  # Don't let a partial file look up to date next run
+            entry['error'] = e.stderr.decode('utf-8', errors='replace')[-500:]
+            return entry
+        except FileNotFoundError:
+            entry['error'] = 'ffmpeg not found'
+            return entry
+
+    entry['size'] = dst.stat().st_size
+    return entry
+
+
+def transcode_tree(input_dir, output_dir, variants, workers=None, loudness=-16.0,
+                   true_peak=-1.5, max_duration=None, pattern='*.mp3', force=False):
+    """
+    Transcode every clip under input_dir into the requested variants and write a manifest.
+
+    Args:
+        input_dir: Root of the source audio tree (the forum's audioRoot)
+        output_dir: Root directory for the variants and manifest
+        variants: List of (format, bitrate) tuples
+        workers: Number of worker processes (default: CPU count)
+        loudness: Integrated loudness target in LUFS
+        true_peak: True peak ceiling in dBTP
+        max_duration: Optional maximum duration in seconds
+        pattern: Glob pattern for source files
+        force: Re-encode every variant, even if it looks up to date
+
+    Returns:
+        Manifest dictionary
+    """
+    input_root = Path(input_dir)
+    output_root = Path(output_dir)
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    # Settings the existing variants were encoded with
+    previous = {}
+    for entries in load_variant_manifest(str(output_root)).values():
+        previous.update((entry['path'], entry) for entry in entries)
+
+    jobs = []
+    resolved_output = output_root.resolve()
+    for src in sorted(input_root.rglob(pattern)):
+        if resolved_output in src.resolve().parents:
+            continue  # Never re-encode our own output when it lives inside the input tree
+        source = src.relative_to(input_root).as_posix()
+        for fmt, bitrate in variants:
+            path = variant_path(source, fmt, bitrate)
+            jobs.append({
+                'src': str(src), 'dst': str(output_root / path),
+                'source': source, 'path': path,
+                'format': fmt, 'bitrate': bitrate,
+                'loudness': loudness, 'true_peak': true_peak, 'max_duration': max_duration,
+                'previous': previous.get(path), 'force': force,
+            })
+
+    files = {}
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(transcode_file, job) for job in jobs]
+        for future in as_completed(futures):
+            entry = future.result()
+            if 'error' in entry:
+                errors += 1
+                print(f"Error transcoding {entry['source']} -> {entry['path']}: {entry['error']}")
+                continue
+            files.setdefault(entry.pop('source'), []).append(entry)
+
+    # Smallest variant first, so the server can take the first supported one
+    for entries in files.values():
+        entries.sort(key=lambda e: e['size'])
+
+    manifest = {
+        'version': 1,
+        'loudness': loudness,
+        'truePeak': true_peak,
+        'files': dict(sorted(files.items())),
+    }
+    temp_file = output_root / f".{MANIFEST_NAME}.tmp"
+    with temp_file.open('w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, ensure_ascii=False, indent=2)
+    temp_file.rename(output_root / MANIFEST_NAME)
+
+    print(f"Transcoded {len(files)} clips into {len(jobs) - errors} variants ({errors} errors)")
+    return manifest
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description='Normalize and transcode listening test audio.')
+    parser.add_argument('--input-dir', default='static/audio',
+                        help='Root directory of the source audio tree')
+    parser.add_argument('--output-dir', required=True,
+                        help='Directory for variants and manifest.json (set as audioVariantsRoot)')
+    parser.add_argument('--variants', default='opus:48k,aac:96k,mp3:128k',
+                        help='Comma-separated format:bitrate list (formats: opus, aac, mp3)')
+    parser.add_argument('--loudness', type=float, default=-16.0,
+                        help='Integrated loudness target in LUFS')
+    parser.add_argument('--true-peak', type=float, default=-1.5,
+                        help='True peak ceiling in dBTP')
+    parser.add_argument('--max-duration', type=float, default=None,
+                        help='Trim clips longer than this many seconds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of parallel ffmpeg processes')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-encode all variants, even those that look up to date')
+
+    args = parser.parse_args()
+
+    variants = parse_variants(args.variants)
+    print(f"Transcoding {args.input_dir} -> {args.output_dir}")
+    print(f"Variants: {variants}, loudness target: {args.loudness} LUFS")
+
+    transcode_tree(args.input_dir, args.output_dir, variants, args.workers,
+                   args.loudness, args.true_peak, args.max_duration, force=args.force)
+    print("Done!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+Utility module for adaptive prompt scheduling from running rating statistics.
+
+With ADAPTIVE_MODE set, session creation prefers prompts where the differences
+between models are least certain, instead of picking prompts uniformly. For every
+(template, prompt, model, metric) cell the scheduler keeps sufficient statistics
+(count, sum, sum of squares) of the ratings in completed results. Posterior cell
+means shrink towards the template's metric mean with one pseudo-rating; the
+rating variance is pooled per (model, metric) and shrunk towards
+ADAPTIVE_PRIOR_VARIANCE.
+
+The criterion ('information') is the expected reduction of the variance of each
+prompt's pairwise model differences from one more rating, weighted by the normal
+density at the z-score of the pair's overall difference: pairs whose sign is
+still uncertain count most, pairs that are already separated stop counting.
+Prompts are drawn without replacement with probability proportional to it, so
+concurrent sessions spread over the useful prompts.
+
+Only the pairs in a template's 'adaptive_pairs' (e.g. [["cp", "cpdelay"]]) are
+scored when given, otherwise all model pairs. Statistics are shared by all workers
+and nodes through the state backend (see utils/state.py), updated on api.finish,
+and reloaded into
+cached numpy arrays at most every ADAPTIVE_REFRESH_INTERVAL seconds, so that
+choosing the prompts of a session costs tens of microseconds.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+from flask import Flask
+
+from utils.metric_names import MetricCatalog
+from utils.saver import read_result, result_paths
+from utils.screening import result_uuid
+from utils.state import StateBackend, join_field, split_field
+
+MODES = ('information',)
+
+STATS = 'adaptive:stats'  # join_field(template, prompt, model, metric, statistic) -> value
+STATISTICS = ('n', 'total', 'total_sq')  # Count, sum and sum of squares of the ratings
+
+PRIOR_WEIGHT = 1.0  # Pseudo-ratings at the template's metric mean
+DEFAULT_PRIOR_MEAN = 3.0  # Middle of a 1-5 scale, used before any rating exists
+VARIANCE_PRIOR_DOF = 4.0  # Weight of ADAPTIVE_PRIOR_VARIANCE in the pooled rating variance
+
+
+def _rating_cells(answer: Dict[str, Any], metric_names: MetricCatalog) -> List[Tuple[str, str, str, str, float]]:
+    # (template, prompt, model, metric ID, rating) of one answered question; old
+    # result files store full metric names, new ones metric IDs
+    template = answer.get('original_template_id')
+    prompt = answer.get('prompt_id_selected')
+    rated = answer.get('metrics_rated')
+    if not template or prompt is None or not isinstance(rated, dict):
+        return []
+    cells = []
+    for model, metrics in rated.items():
+        for metric, rating in (metrics or {}).items():
+            if isinstance(rating, (int, float)) and not isinstance(rating, bool):
+                cells.append((template, str(prompt), model, metric_names.id_of(metric), float(rating)))
+    return cells
+
+
+def _metric_ids(q_template: Dict[str, Any], metric_names: MetricCatalog) -> List[str]:
+    ids = []
+    for metric in q_template.get('metrics', []):
+        name = metric.get('name') if isinstance(metric, dict) else metric
+        if name:
+            ids.append(metric_names.id_of(name))
+    return ids
+
+
+def _pairs(q_template: Dict[str, Any]) -> List[Tuple[int, int]]:
+    models = q_template.get('models', [])
+    configured = q_template.get('adaptive_pairs')
+    if configured:
+        return [(models.index(a), models.index(b)) for a, b in configured if a in models and b in models]
+    return list(itertools.combinations(range(len(models)), 2))
+
+
+class _TemplateArrays:
+    """
+    Posterior means and variances of one template, shape (prompts + 1, models, metrics).
+
+    The last row is the prior, used for prompts without ratings.
+    """
+
+    def __init__(self, np, q_template: Dict[str, Any], stats: Dict[tuple, List[float]], prior_variance: float,
+                 metric_names: MetricCatalog):
+        template_id = q_template.get('id')
+        models = q_template.get('models', [])
+        metrics = _metric_ids(q_template, metric_names)
+        self.pairs = _pairs(q_template)
+        prompts = sorted({key[1] for key in stats if key[0] == template_id})
+        self.row = {prompt: i for i, prompt in enumerate(prompts)}
+        self.prior_row = len(prompts)
+
+        shape = (len(prompts) + 1, len(models), len(metrics))
+        n, total, total_sq = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        for (template, prompt, model, metric), (cn, ct, cs) in stats.items():
+            if template != template_id or model not in models or metric not in metrics:
+                continue
+            index = (self.row[prompt], models.index(model), metrics.index(metric))
+            n[index], total[index], total_sq[index] = cn, ct, cs
+
+        # Prior per metric: the template's mean rating of that metric
+        metric_n = n.sum(axis=(0, 1))
+        prior_mean = np.where(metric_n > 0, total.sum(axis=(0, 1)) / np.maximum(metric_n, 1), DEFAULT_PRIOR_MEAN)
+
+        n_eff = n + PRIOR_WEIGHT
+        self.mean = (total + PRIOR_WEIGHT * prior_mean) / n_eff
+
+        # Within-cell variance: pooled per (model, metric) over all prompts, shrunk
+        # towards prior_variance; single cells have too few ratings to estimate it
+        dof = np.maximum(n - 1, 0)
+        cell_ss = np.where(n >= 1, total_sq - total ** 2 / np.maximum(n, 1), 0.0)
+        pooled_dof = dof.sum(axis=0)
+        pooled = (VARIANCE_PRIOR_DOF * prior_variance + np.maximum(cell_ss, 0).sum(axis=0)) / (VARIANCE_PRIOR_DOF + pooled_dof)
+        self.s2 = np.broadcast_to(pooled, shape)
+        self.n_eff = n_eff
+        self.var = self.s2 / n_eff
+        self.information = self._information(np)
+
+    def _information(self, np):
+        # Expected reduction of the variance of each prompt's model differences from
+        # one more rating, weighted by how uncertain the sign of the pair's overall
+        # difference still is (pairs that are already separated stop counting)
+        if not self.pairs:
+            return np.ones(self.mean.shape[0])
+        a, b = (np.array(index) for index in zip(*self.pairs))
+        diff = self.mean[:, a] - self.mean[:, b]
+        var = self.var[:, a] + self.var[:, b]
+        var_next = self.s2[:, a] / (self.n_eff[:, a] + 1) + self.s2[:, b] / (self.n_eff[:, b] + 1)
+
+        rated = (self.n_eff[:-1] > PRIOR_WEIGHT).any(axis=(1, 2))
+        if rated.any():
+            # Overall difference over rated prompts; its standard error includes the
+            # spread between prompts (prompt x model interaction) once there is one
+            prompt_diff = diff[:-1][rated]
+            count = prompt_diff.shape[0]
+            se2 = var[:-1][rated].sum(axis=0) / count ** 2
+            if count >= 2:
+                se2 = np.maximum(se2, prompt_diff.var(axis=0, ddof=1) / count)
+            z = prompt_diff.mean(axis=0) / np.sqrt(se2)
+            weight = np.exp(-0.5 * z ** 2)  # Normal density relative to its peak
+        else:
+            weight = np.ones(diff.shape[1:])
+        return (weight * (var - var_next)).sum(axis=(1, 2))
+
+    def rows(self, np, prompt_ids: List[str]):
+        return np.fromiter((self.row.get(p_id, self.prior_row) for p_id in prompt_ids), dtype=int, count=len(prompt_ids))
+
+
+class AdaptiveScheduler:
+    """
+    Shared rating statistics and the prompt-ordering criterion.
+
+    Attributes:
+        backend: Shared state backend
+        mode: Scheduling criterion (see MODES)
+        refresh_interval: Seconds between reloads of the statistics
+        prior_variance: Rating variance assumed for cells with few ratings
+        metric_names: Maps stored metric names and IDs to metric IDs
+    """
+
+    def __init__(self, backend: StateBackend, mode: str = 'information', refresh_interval: float = 10.0,
+                 prior_variance: float = 1.0, seed: Optional[int] = None,
+                 metric_names: Optional[MetricCatalog] = None):
+        import numpy as np  # Only needed when adaptive scheduling is enabled
+
+        if mode not in MODES:
+            raise ValueError(f"Unknown adaptive mode '{mode}' (expected one of {', '.join(MODES)})")
+        self.np = np
+        self.backend = backend
+        self.mode = mode
+        self.refresh_interval = refresh_interval
+        self.prior_variance = prior_variance
+        self.metric_names = metric_names or MetricCatalog()
+        self.rng = np.random.default_rng(seed)
+        self._rng_pid = os.getpid()
+        self._lock = threading.Lock()
+        self._rng_lock = threading.Lock()  # numpy generators are not thread-safe
+        self._stats: Dict[tuple, List[float]] = {}
+        self._arrays: Dict[str, _TemplateArrays] = {}
+        self._loaded_at = None
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Reload the statistics of all workers if the refresh interval has passed.
+
+        Args:
+            force: Reload now
+        """
+        if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        stats: Dict[tuple, List[float]] = defaultdict(lambda: [0.0, 0.0, 0.0])
+        for field, value in self.backend.hgetall(STATS).items():
+            template, prompt, model, metric, statistic = split_field(field)
+            # Statistics recorded before metric IDs are keyed by full name; merge them
+            key = (template, prompt, model, self.metric_names.id_of(metric))
+            stats[key][STATISTICS.index(statistic)] += float(value)
+        with self._lock:
+            self._stats = dict(stats)
+            self._arrays = {}
+            self._loaded_at = time.monotonic()
+
+    def _template_arrays(self, q_template: Dict[str, Any]) -> _TemplateArrays:
+        template_id = q_template.get('id')
+        arrays = self._arrays.get(template_id)
+        if arrays is None:
+            arrays = _TemplateArrays(self.np, q_template, self._stats, self.prior_variance, self.metric_names)
+            with self._lock:
+                self._arrays[template_id] = arrays
+        return arrays
+
+    def scores(self, q_template: Dict[str, Any], prompt_ids: List[str]):
+        """
+        Criterion value of each candidate prompt (higher: more useful to rate next).
+
+        Args:
+            q_template: Question template
+            prompt_ids: Candidate prompt IDs
+
+        Returns:
+            numpy array of scores, one per prompt
+        """
+        np = self.np
+        arrays = self._template_arrays(q_template)
+        rows = arrays.rows(np, prompt_ids)
+        return arrays.information[rows]
+
+    def order(self, q_template: Dict[str, Any], prompt_ids: List[str], n: int) -> List[str]:
+        """
+        Order candidate prompts so that the first n are the ones to present.
+
+        Args:
+            q_template: Question template
+            prompt_ids: Candidate prompt IDs (already filtered for audio and quotas)
+            n: Number of prompts that will be presented
+
+        Returns:
+            Reordered prompt IDs
+        """
+        if len(prompt_ids) <= 1:
+            return list(prompt_ids)
+        self.refresh()
+        np = self.np
+        n = min(n, len(prompt_ids))
+        with self._rng_lock:
+            if self._rng_pid != os.getpid():
+                # Forked workers would otherwise all draw the same sequence
+                self.rng, self._rng_pid = np.random.default_rng(), os.getpid()
+            scores = self.scores(q_template, prompt_ids)
+            # Sample in proportion to the score, so concurrent sessions spread over
+            # the uncertain prompts instead of all rating the single best one
+            weights = np.maximum(scores, 0) + 1e-12
+            chosen = self.rng.choice(len(prompt_ids), size=n, replace=False, p=weights / weights.sum())
+        chosen_set = set(chosen.tolist())
+        return [prompt_ids[i] for i in chosen] + [p for i, p in enumerate(prompt_ids) if i not in chosen_set]
+
+    def record(self, answers: Dict[str, Any]) -> int:
+        """
+        Add the ratings of a finished session to the shared statistics.
+
+        Args:
+            answers: Answers as saved to the result file (keyed by presentation index)
+
+        Returns:
+            Number of ratings added
+        """
+        cells = [cell for answer in answers.values() for cell in _rating_cells(answer, self.metric_names)]
+        increments: Dict[str, float] = defaultdict(float)
+        for *key, rating in cells:
+            for statistic, value in zip(STATISTICS, (1.0, rating, rating ** 2)):
+                increments[join_field(*key, statistic)] += value
+        self.backend.hincr(STATS, increments)
+        return len(cells)
+
+    def is_empty(self) -> bool:
+        """
+        Whether no rating has been recorded yet.
+
+        Returns:
+            True for a new backend
+        """
+        return not self.backend.hgetall(STATS)
+
+    def rebuild(self, results_dir: str, excluded: Iterable[str] = ()) -> int:
+        """
+        Recompute the statistics from the result files.
+
+        Args:
+            results_dir: Directory of result JSON files
+            excluded: UUIDs of results left out (see utils/screening.py)
+
+        Returns:
+            Number of result files read
+        """
+        stats: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        files = result_paths(results_dir)
+        excluded = set(excluded)
+        for path in files:
+            try:
+                data = read_result(path)
+            except (OSError, ValueError):
+                continue
+            if excluded and result_uuid(data, path) in excluded:
+                continue
+            answers = data.get('answers', {})
+            for answer in answers.values():
+                for *key, rating in _rating_cells(answer, self.metric_names):
+                    cell = stats[tuple(key)]
+                    cell[0] += 1
+                    cell[1] += rating
+                    cell[2] += rating ** 2
+
+        self.backend.replace(STATS, {
+            join_field(*key, statistic): value
+            for key, cell in stats.items() for statistic, value in zip(STATISTICS, cell)
+        })
+        self.refresh(force=True)
+        return len(files)
+
+
+def init_adaptive(app: Flask) -> Optional[AdaptiveScheduler]:
+    """
+    Create the app's adaptive scheduler when ADAPTIVE_MODE is set.
+
+    Empty statistics are filled from the result files already in RESULTS_DIR,
+    leaving out sessions excluded by screening.
+
+    Args:
+        app: Flask application with its state backend (see utils/state.py)
+
+    Returns:
+        The scheduler, also stored as app.extensions['adaptive'], or None
+    """
+    mode = app.config['ADAPTIVE_MODE']
+    if not mode:
+        return None
+
+    scheduler = AdaptiveScheduler(
+        app.extensions['state'],
+        mode,
+        app.config['ADAPTIVE_REFRESH_INTERVAL'],
+        app.config['ADAPTIVE_PRIOR_VARIANCE'],
+        metric_names=app.extensions['metric_names'],
+    )
+    if scheduler.is_empty():
+        screener = app.extensions.get('screening')
+        counted = scheduler.rebuild(app.config['RESULTS_DIR'], screener.excluded() if screener else ())
+        app.logger.info(f"Adaptive scheduling statistics rebuilt from {counted} result files")
+    app.extensions['adaptive'] = scheduler
+    app.logger.info(f"Adaptive prompt scheduling enabled ({mode})")
+    return scheduler
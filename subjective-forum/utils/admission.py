@@ -0,0 +1,248 @@
+"""
+Utility module for admission control of participant sessions.
+
+When many participants arrive at once (e.g. right after a recruitment email),
+every started session downloads several clips in parallel. To keep the server
+responsive, rules.begin only admits a new session while fewer than
+ADMISSION_MAX_ACTIVE sessions are active and the audio served over the last
+ADMISSION_BANDWIDTH_WINDOW seconds stays below ADMISSION_AUDIO_BUDGET_MBPS.
+Everyone else is queued first-come first-served and shown a waiting page that
+retries by itself.
+
+State lives in the shared state backend (see utils/state.py) so that all
+workers, and all nodes of a scale-out deployment, share the same counts and
+queue. Admission state is process-wide: studies hosted together
+(create_multi_app) share the limits. A session stays active
+until it finishes or has not been seen for ADMISSION_IDLE_TIMEOUT seconds; a
+queue entry is dropped when its page has stopped retrying for
+ADMISSION_QUEUE_TIMEOUT seconds. The retry interval handed to the waiting page
+(retry_after) therefore stays at most half of that timeout.
+"""
+import random
+import secrets
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from flask import Flask
+
+from utils.state import PREFIX, StateBackend
+
+ACTIVE = 'admission:active'  # ticket -> last seen
+QUEUE = 'admission:queue'  # ticket -> "enqueued_at last_seen"
+AUDIO_BYTES = 'admission:audio_bytes'  # second -> bytes served
+
+
+def new_ticket() -> str:
+    """
+    Random identifier of one participant session for the admission controller.
+
+    Returns:
+        URL-safe ticket string
+    """
+    return secrets.token_urlsafe(12)
+
+
+class AdmissionController:
+    """
+    Shared limit on active participant sessions and audio bandwidth.
+
+    Attributes:
+        backend: Shared state backend
+        max_active: Maximum concurrently active sessions (0: unlimited)
+        audio_budget: Maximum audio bytes per second across workers (0: unlimited)
+        window: Seconds over which audio bandwidth is averaged
+        idle_timeout: Seconds after which an inactive session stops counting
+        queue_timeout: Seconds after which a waiting participant who stopped retrying is dropped
+    """
+
+    def __init__(self, backend: StateBackend, max_active: int = 0, audio_budget: float = 0,
+                 window: float = 10.0, idle_timeout: float = 1200.0, queue_timeout: float = 60.0):
+        self.backend = backend
+        self.max_active = max_active
+        self.audio_budget = audio_budget
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._pending_bytes: Dict[int, int] = {}
+        self._last_flush = time.monotonic()
+
+    def _active(self, now: float) -> Dict[str, float]:
+        # Active sessions seen within the idle timeout; expired ones are removed
+        active = {ticket: float(seen) for ticket, seen in self.backend.hgetall(ACTIVE).items()}
+        expired = [ticket for ticket, seen in active.items() if seen < now - self.idle_timeout]
+        if expired:
+            self.backend.hdel(ACTIVE, expired)
+        return {ticket: seen for ticket, seen in active.items() if seen >= now - self.idle_timeout}
+
+    def _queue(self, now: float) -> Dict[str, Tuple[float, float]]:
+        # Waiting sessions that still retry: ticket -> (enqueued_at, last_seen)
+        queue = {}
+        for ticket, value in self.backend.hgetall(QUEUE).items():
+            enqueued_at, last_seen = (float(v) for v in value.split())
+            queue[ticket] = (enqueued_at, last_seen)
+        expired = [ticket for ticket, (_, seen) in queue.items() if seen < now - self.queue_timeout]
+        if expired:
+            self.backend.hdel(QUEUE, expired)
+        return {ticket: entry for ticket, entry in queue.items() if entry[1] >= now - self.queue_timeout}
+
+    def _bandwidth(self, now: float) -> float:
+        # Audio bytes per second over the window; older seconds are removed
+        counts = {int(second): float(n) for second, n in self.backend.hgetall(AUDIO_BYTES).items()}
+        old = [str(second) for second in counts if second < int(now - self.window) - 1]
+        if old:
+            self.backend.hdel(AUDIO_BYTES, old)
+        return sum(n for second, n in counts.items() if second >= int(now - self.window)) / self.window
+
+    def admit(self, ticket: str) -> Tuple[bool, int]:
+        """
+        Admit a session if there is capacity and nobody is waiting ahead of it.
+
+        Args:
+            ticket: Ticket of the session (see new_ticket)
+
+        Returns:
+            (admitted, queue position); the position is 0 when admitted, 1 for
+            the head of the queue
+        """
+        self.flush_audio_bytes(force=True)
+        with self.backend.lock('admission'):  # Serialize decisions across workers
+            now = time.time()
+            active = self._active(now)
+            if ticket in active:
+                self.backend.hset(ACTIVE, {ticket: now})
+                return True, 0
+
+            queue = self._queue(now)
+            enqueued_at = queue[ticket][0] if ticket in queue else now
+            ahead = sum(1 for other, (at, _) in queue.items() if (at, other) < (enqueued_at, ticket))
+
+            # Several slots may free up at once; admit that many from the head of the
+            # queue. With only a bandwidth budget, admit one at a time and re-measure.
+            free_slots = self.max_active - len(active) if self.max_active else 1
+            over_budget = self.audio_budget and self._bandwidth(now) >= self.audio_budget
+
+            if ahead < free_slots and not over_budget:
+                self.backend.hdel(QUEUE, [ticket])
+                self.backend.hset(ACTIVE, {ticket: now})
+                return True, 0
+
+            self.backend.hset(QUEUE, {ticket: f"{enqueued_at} {now}"})
+            return False, ahead + 1
+
+    def retry_after(self, position: int, base: int) -> int:
+        """
+        Seconds the waiting page waits before retrying.
+
+        Retries come sooner near the head of the queue, and jitter spreads them
+        out. Jitter included, the interval stays at most half of queue_timeout,
+        so a participant who keeps retrying never loses their place.
+
+        Args:
+            position: Queue position (1 for the head of the queue)
+            base: Base retry interval in seconds (ADMISSION_RETRY_SECONDS)
+
+        Returns:
+            Retry interval in whole seconds (at least 1)
+        """
+        ceiling = max(1, int(self.queue_timeout / 2))
+        jitter = min(int(base), ceiling // 2)
+        return max(1, min(int(base) * (1 + position // 10), ceiling - jitter) + random.randint(0, jitter))
+
+    def touch(self, ticket: str) -> None:
+        """
+        Mark an admitted session as still active.
+
+        Args:
+            ticket: Ticket of the session
+        """
+        with self.backend.lock('admission'):  # A concurrent release must not be undone
+            if self.backend.hget(ACTIVE, ticket) is not None:
+                self.backend.hset(ACTIVE, {ticket: time.time()})
+
+    def release(self, ticket: str) -> None:
+        """
+        Free the slot of a finished session.
+
+        Args:
+            ticket: Ticket of the session
+        """
+        self.backend.hdel(ACTIVE, [ticket])
+
+    def record_audio_bytes(self, size: int) -> None:
+        """
+        Count audio bytes sent to a client towards the bandwidth budget.
+
+        Bytes are buffered per process and written at most once per second.
+
+        Args:
+            size: Bytes sent
+        """
+        if not self.audio_budget or size <= 0:
+            return
+        second = int(time.time())
+        with self._lock:
+            self._pending_bytes[second] = self._pending_bytes.get(second, 0) + size
+        self.flush_audio_bytes()
+
+    def flush_audio_bytes(self, force: bool = False) -> None:
+        """
+        Write buffered audio byte counts to the shared database.
+
+        Args:
+            force: Write even if less than a second has passed since the last write
+        """
+        with self._lock:
+            if not self._pending_bytes or (not force and time.monotonic() - self._last_flush < 1.0):
+                return
+            pending, self._pending_bytes = self._pending_bytes, {}
+            self._last_flush = time.monotonic()
+        self.backend.hincr(AUDIO_BYTES, {str(second): size for second, size in pending.items()})
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Current counts and limits.
+
+        Returns:
+            Dictionary with active and queued sessions and audio bandwidth (bytes/s)
+        """
+        self.flush_audio_bytes(force=True)
+        now = time.time()
+        return {
+            'active': len(self._active(now)),
+            'queued': len(self._queue(now)),
+            'audioBytesPerSecond': round(self._bandwidth(now), 1),
+            'maxActive': self.max_active,
+            'audioBudgetBytesPerSecond': self.audio_budget,
+        }
+
+
+def init_admission(app: Flask) -> Optional[AdmissionController]:
+    """
+    Create the app's admission controller when a limit is configured.
+
+    Args:
+        app: Flask application with its state backend (see utils/state.py)
+
+    Returns:
+        The controller, also stored as app.extensions['admission'], or None
+        when neither ADMISSION_MAX_ACTIVE nor ADMISSION_AUDIO_BUDGET_MBPS is set
+    """
+    max_active = int(app.config['ADMISSION_MAX_ACTIVE'] or 0)
+    budget_mbps = float(app.config['ADMISSION_AUDIO_BUDGET_MBPS'] or 0)
+    if not max_active and not budget_mbps:
+        return None
+
+    controller = AdmissionController(
+        app.extensions['state'].with_prefix(PREFIX),  # Shared by all studies of the process
+        max_active=max_active,
+        audio_budget=budget_mbps * 1e6 / 8,
+        window=app.config['ADMISSION_BANDWIDTH_WINDOW'],
+        idle_timeout=app.config['ADMISSION_IDLE_TIMEOUT'],
+        queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+    )
+    app.extensions['admission'] = controller
+    app.logger.info(f"Admission control: max {max_active or 'unlimited'} active sessions, "
+                    f"audio budget {budget_mbps or 'unlimited'} Mbit/s")
+    return controller
@@ -0,0 +1,114 @@
+"""
+Utility module for audio bundles: all clips of a question in one response.
+
+A question page needs the prompt and every model's clip. Fetched one by one,
+each clip is a separate request with its own cookie, proxy and tunnel
+overhead. /api/audio/bundle sends them as one length-prefixed stream:
+
+    b'AUDB' | index length (uint32, big-endian) | index (UTF-8 JSON) | clip bodies
+
+The index is a list with one entry per clip:
+
+    {"tag": "gt", "url": "/api/audio/task_1/001_gt.mp3", "mime": "audio/mpeg",
+     "offset": 0, "length": 48213, "duration": 9.84}
+
+offset counts from the first byte after the index, and "duration" is only
+present when the audio index knows it. "url" is the clip's own /api/audio URL,
+so the client can key the clips like individually fetched ones
+(static/js/modules/audioLoader.js). Bodies are streamed from disk in chunks,
+and the total length is known up front for Content-Length.
+"""
+import hashlib
+import json
+import os
+import struct
+from typing import Dict, List, Any, Iterator, Tuple
+
+MAGIC = b'AUDB'
+MAX_CLIPS = 16  # Clips per bundle; a question has the prompt plus its models
+CHUNK_SIZE = 256 * 1024  # Bytes read per write
+
+
+def bundle_header(clips: List[Dict[str, Any]]) -> Tuple[bytes, int]:
+    """
+    Build the bundle header and compute the total size.
+
+    Args:
+        clips: Clips in bundle order with 'tag', 'url', 'mime', 'size' and
+            optional 'duration'
+
+    Returns:
+        (header bytes including the index, total bundle size in bytes)
+    """
+    index, offset = [], 0
+    for clip in clips:
+        entry = {'tag': clip['tag'], 'url': clip['url'], 'mime': clip['mime'], 'offset': offset,
+                 'length': clip['size']}
+        if clip.get('duration'):
+            entry['duration'] = round(clip['duration'], 3)
+        index.append(entry)
+        offset += clip['size']
+    encoded = json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header = MAGIC + struct.pack('>I', len(encoded)) + encoded
+    return header, len(header) + offset
+
+
+def iter_bundle(header: bytes, clips: List[Dict[str, Any]], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Stream a bundle: the header, then every clip's file.
+
+    Args:
+        header: Header from bundle_header
+        clips: The same clips, with their file 'path'
+        chunk_size: Bytes read per chunk
+
+    Yields:
+        Bundle bytes
+    """
+    yield header
+    for clip in clips:
+        remaining = clip['size']
+        with open(clip['path'], 'rb') as f:
+            # Never send more than the index announced, even if the file grew
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise OSError(f"{clip['path']} shrank while it was sent")
+                remaining -= len(chunk)
+                yield chunk
+
+
+def parse_bundle(data: bytes) -> List[Tuple[Dict[str, Any], bytes]]:
+    """
+    Split a bundle into its clips (the client does the same in JavaScript).
+
+    Args:
+        data: Whole bundle
+
+    Returns:
+        (index entry, clip bytes) per clip
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("Not an audio bundle")
+    index_length, = struct.unpack('>I', data[4:8])
+    index = json.loads(data[8:8 + index_length].decode('utf-8'))
+    body = 8 + index_length
+    return [(entry, data[body + entry['offset']:body + entry['offset'] + entry['length']]) for entry in index]
+
+
+def bundle_etag(clips: List[Dict[str, Any]]) -> str:
+    """
+    Entity tag of a bundle, from the identity of its files.
+
+    The same on every worker serving the same files, so a browser or proxy
+    cache can revalidate a bundle against any of them.
+
+    Args:
+        clips: Clips with 'tag', 'path', 'size' and 'mtime' (os.stat st_mtime_ns)
+
+    Returns:
+        ETag value that changes when any clip file is replaced
+    """
+    identity = '|'.join(f"{clip['tag']}:{os.path.basename(clip['path'])}:{clip['size']}:{clip['mtime']}"
+                        for clip in clips)
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]
@@ -0,0 +1,323 @@
+"""
+Utility module for indexing audio clips: decoded duration, bitrate, size and checksum.
+
+The index is built once at startup, in parallel, and cached on disk keyed by each
+file's size and mtime so that restarts only re-read clips that changed. It is used
+to flag corrupt, truncated or length-mismatched clips before participants hit them,
+and to give the client duration/size hints without a metadata round trip.
+"""
+import hashlib
+import json
+import os
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+INDEX_VERSION = 1
+
+# Bitrates in kbps, indexed by [version_is_mpeg1][layer][bitrate_index]
+_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz, indexed by version bits (0: MPEG2.5, 2: MPEG2, 3: MPEG1)
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+def _parse_frame_header(header: bytes) -> Optional[Dict[str, int]]:
+    """
+    Decode a 4-byte MPEG audio frame header.
+
+    Args:
+        header: Four bytes starting at a candidate frame sync
+
+    Returns:
+        Dictionary with frame length, samples and sample rate, or None if invalid
+    """
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None  # Reserved values or free-format streams
+
+    is_mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[is_mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or is_mpeg1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576  # Layer III, MPEG2/2.5
+        length = 72 * bitrate // sample_rate + padding
+
+    return {'length': length, 'samples': samples, 'sample_rate': sample_rate, 'bitrate': bitrate}
+
+
+def probe_mp3_bytes(data: bytes) -> Dict[str, Any]:
+    """
+    Walk the MPEG audio frames of an mp3 file held in memory.
+
+    Args:
+        data: Complete file contents
+
+    Returns:
+        Dictionary with duration (seconds), bitrate (kbps), frames and, for
+        damaged files, an 'error' message
+    """
+    result: Dict[str, Any] = {'duration': 0.0, 'bitrate': 0, 'frames': 0}
+    if not data:
+        result['error'] = 'empty file'
+        return result
+
+    offset = 0
+    end = len(data)
+
+    # Skip an ID3v2 tag (size is a 28-bit syncsafe integer)
+    if data[:3] == b'ID3' and end >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        offset = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+
+    # Ignore a trailing ID3v1 tag
+    if end - offset >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    total_samples = 0
+    audio_bytes = 0
+    sample_rate = None
+    skipped = 0
+
+    while offset + 4 <= end:
+        frame = _parse_frame_header(data[offset:offset + 4])
+        if frame is None:
+            # Resynchronize on the next frame sync byte
+            next_sync = data.find(b'\xff', offset + 1, end)
+            if next_sync < 0:
+                skipped += end - offset
+                break
+            skipped += next_sync - offset
+            offset = next_sync
+            continue
+
+        if offset + frame['length'] > end:
+            result['error'] = 'truncated final frame'
+            break
+
+        # A leading Xing/Info frame holds encoder metadata, not audio
+        is_info_frame = result['frames'] == 0 and (
+            data.find(b'Xing', offset + 4, offset + 48) >= 0 or data.find(b'Info', offset + 4, offset + 48) >= 0
+        )
+        if not is_info_frame:
+            total_samples += frame['samples']
+            audio_bytes += frame['length']
+        sample_rate = frame['sample_rate']
+        result['frames'] += 1
+        offset += frame['length']
+
+    if result['frames'] == 0:
+        result['error'] = 'no MPEG audio frames found'
+        return result
+
+    result['duration'] = round(total_samples / sample_rate, 3)
+    result['bitrate'] = int(round(audio_bytes * 8 / result['duration'] / 1000)) if result['duration'] else 0
+    result['sample_rate'] = sample_rate
+    if skipped:
+        result['junk_bytes'] = skipped
+    return result
+
+
+def probe_clip(path: str) -> Dict[str, Any]:
+    """
+    Read one clip, checksum it and decode its frame structure.
+
+    Args:
+        path: Path to the mp3 file
+
+    Returns:
+        Index entry dictionary
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as fp:
+        data = fp.read()
+
+    entry = probe_mp3_bytes(data)
+    entry['size'] = stat.st_size
+    entry['mtime_ns'] = stat.st_mtime_ns
+    entry['sha1'] = hashlib.sha1(data).hexdigest()
+    return entry
+
+
+def _load_cache(cache_path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not cache_path or not os.path.isfile(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as fp:
+            cached = json.load(fp)
+    except (json.JSONDecodeError, IOError):
+        return {}
+    if cached.get('version') != INDEX_VERSION:
+        return {}
+    return cached.get('clips', {})
+
+
+def _save_cache(cache_path: Optional[str], audio_root: str, clips: Dict[str, Dict[str, Any]]) -> None:
+    if not cache_path:
+        return
+    cache_file = Path(cache_path)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = cache_file.with_name(f".{cache_file.name}.tmp")
+    with temp_file.open('w', encoding='utf-8') as fp:
+        json.dump({'version': INDEX_VERSION, 'audioRoot': audio_root, 'clips': clips}, fp)
+    temp_file.replace(cache_file)
+
+
+def build_audio_index(
+    audio_root: str,
+    cache_path: Optional[str] = None,
+    max_workers: int = 8
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the duration/integrity index for every clip under audio_root.
+
+    Follows the same layout as scan_audio_directory (one level of subfolders with
+    mp3 files). Clips whose size and mtime match the cache are not re-read.
+
+    Args:
+        audio_root: Path to the root audio directory
+        cache_path: Optional JSON file used to persist the index between runs
+        max_workers: Number of parallel reader threads
+
+    Returns:
+        Dictionary mapping "subfolder/filename.mp3" to its index entry
+    """
+    root_path = Path(audio_root)
+    if not root_path.is_dir():
+        return {}
+
+    cached = _load_cache(cache_path)
+    index: Dict[str, Dict[str, Any]] = {}
+    to_probe: Dict[str, str] = {}
+
+    for subfolder_path in root_path.iterdir():
+        if not subfolder_path.is_dir():
+            continue
+        for file_path in subfolder_path.glob("*.mp3"):
+            relative = f"{subfolder_path.name}/{file_path.name}"
+            stat = file_path.stat()
+            entry = cached.get(relative)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                index[relative] = entry
+            else:
+                to_probe[relative] = str(file_path)
+
+    if to_probe:
+        # Reading clips is I/O bound (often a network mount); hashing releases the GIL
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for relative, entry in zip(to_probe, executor.map(probe_clip, to_probe.values())):
+                index[relative] = entry
+        _save_cache(cache_path, audio_root, index)
+
+    return index
+
+
+def exclude_corrupt_clips(
+    scanned_audio_data: Dict[str, Dict[str, List[str]]],
+    audio_index: Dict[str, Dict[str, Any]]
+) -> int:
+    """
+    Remove clips the index marks as unreadable from the scanned audio data, so
+    prompts with a broken clip are never assigned to participants.
+
+    Args:
+        scanned_audio_data: Nested dictionary from scan_audio_directory (modified in place)
+        audio_index: Index from build_audio_index
+
+    Returns:
+        Number of clips removed
+    """
+    removed = 0
+    for subfolder, prompts in scanned_audio_data.items():
+        for prompt_id, model_tags in prompts.items():
+            for model_tag in list(model_tags):
+                entry = audio_index.get(f"{subfolder}/{prompt_id}_{model_tag}.mp3")
+                if entry and 'error' in entry:
+                    model_tags.remove(model_tag)
+                    removed += 1
+    return removed
+
+
+def validate_audio_index(
+    questions: List[Dict[str, Any]],
+    scanned_audio_data: Dict[str, Dict[str, List[str]]],
+    audio_index: Dict[str, Dict[str, Any]],
+    duration_tolerance: float = 1.0
+) -> List[str]:
+    """
+    Validates that the clips of every prompt are readable and of consistent length.
+
+    Model clips of one prompt are compared against their median duration; the
+    'prompt' clip is excluded because it is often a shorter excerpt. A template
+    can override the tolerance with 'durationTolerance' (seconds).
+
+    Args:
+        questions: List of question templates from forum.json
+        scanned_audio_data: Nested dictionary from scan_audio_directory
+        audio_index: Index from build_audio_index
+        duration_tolerance: Allowed deviation from the median duration, in seconds
+
+    Returns:
+        List of error messages, empty if all valid
+    """
+    errors = []
+
+    for q_template in questions:
+        template_id = q_template.get('id', 'UnknownTemplate')
+        audio_subfolder = q_template.get('audioSubfolder')
+        tolerance = q_template.get('durationTolerance', duration_tolerance)
+        prompts_in_subfolder = scanned_audio_data.get(audio_subfolder) or {}
+        tags = ['prompt'] + q_template.get('models', [])
+
+        for p_id in sorted(prompts_in_subfolder):
+            durations = {}
+            for tag in tags:
+                relative = f"{audio_subfolder}/{p_id}_{tag}.mp3"
+                entry = audio_index.get(relative)
+                if entry is None:
+                    continue
+                if 'error' in entry:
+                    errors.append(f"Template '{template_id}': Corrupt audio file {relative} for promptId '{p_id}' ({entry['error']}).")
+                elif tag != 'prompt':
+                    durations[tag] = entry['duration']
+
+            if len(durations) < 2:
+                continue
+            median = statistics.median(durations.values())
+            for tag, duration in durations.items():
+                if abs(duration - median) > tolerance:
+                    errors.append(f"Template '{template_id}': Audio file {audio_subfolder}/{p_id}_{tag}.mp3 is {duration:.2f}s, but the other clips of promptId '{p_id}' are about {median:.2f}s.")
+
+    return errors
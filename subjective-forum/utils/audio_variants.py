@@ -0,0 +1,100 @@
+"""
+Utility module for choosing pre-transcoded audio variants per request.
+
+Variants and their manifest are produced offline by transcode_audio.py. All
+clips of a question are served in one encoding (format and bitrate), so the
+models are never compared across codecs or against un-normalized originals.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Any, Iterable, Optional
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def load_variant_manifest(variants_root: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Load the variant manifest written by transcode_audio.py.
+
+    Args:
+        variants_root: Directory holding the variants and manifest.json (may be None)
+
+    Returns:
+        Dictionary mapping source paths (relative to audioRoot) to variant entries,
+        smallest first. Empty if no manifest is configured or found.
+    """
+    if not variants_root:
+        return {}
+    manifest_path = Path(variants_root) / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return {}
+    with manifest_path.open('r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+
+    files = manifest.get('files', {})
+    for entries in files.values():
+        entries.sort(key=lambda e: e.get('size', 0))
+    return files
+
+
+def prompt_clips(audio_models: Dict[str, Dict[str, List[str]]], clip: str) -> List[str]:
+    """
+    Clips of the prompt a clip belongs to: the prompt and every model's clip.
+
+    Args:
+        audio_models: Scanned audio (AUDIO_MODELS): subfolder -> prompt ID -> tags
+        clip: Clip path relative to the audio root, e.g. "task_1/001_gt.mp3"
+
+    Returns:
+        Clip paths of the prompt, or just [clip] if it is not in the scan
+    """
+    subfolder, _, filename = clip.rpartition('/')
+    prompt_id = os.path.splitext(filename)[0].partition('_')[0]
+    prefix = f"{subfolder}/" if subfolder else ''
+    clips = [f"{prefix}{prompt_id}_{tag}.mp3" for tag in audio_models.get(subfolder, {}).get(prompt_id, [])]
+    return clips if clip in clips else [clip]
+
+
+def negotiate_question_variants(
+    all_variants: Dict[str, List[Dict[str, Any]]],
+    clips: List[str],
+    client_formats: Iterable[str] = (),
+    accepted_mimetypes: Iterable[str] = ()
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Pick one encoding the client can play for all clips of a question.
+
+    Among the encodings (format and bitrate) that every clip has a variant in,
+    the one with the smallest total size is chosen. If there is none, every
+    clip is served as the original file.
+
+    The client states what it can decode through the 'formats' query parameter
+    (filled from HTMLMediaElement.canPlayType). Without it, only audio types named
+    explicitly in the Accept header count; wildcards such as */* are ignored because
+    browsers send them for formats they cannot actually play.
+
+    Args:
+        all_variants: Variant entries per clip (AUDIO_VARIANTS)
+        clips: Clips of the question, e.g. from prompt_clips
+        client_formats: Format keys reported by the client (e.g. ["opus", "mp3"])
+        accepted_mimetypes: Explicit mimetypes from the Accept header
+
+    Returns:
+        Dictionary mapping each clip to its variant entry, or None for the original file
+    """
+    formats = {f.strip().lower() for f in client_formats if f.strip()}
+    mimetypes = {m.lower() for m in accepted_mimetypes if '*' not in m}
+    options = []
+    for clip in clips:
+        playable: Dict[tuple, Dict[str, Any]] = {}
+        for variant in all_variants.get(clip, []):
+            if variant.get('format') in formats or variant.get('mime') in mimetypes:
+                playable.setdefault((variant.get('format'), variant.get('bitrate')), variant)
+        options.append(playable)
+
+    common = set(options[0]).intersection(*options[1:]) if options else set()
+    if not common:
+        return dict.fromkeys(clips)
+    best = min(common, key=lambda key: (sum(o[key].get('size', 0) for o in options), str(key)))
+    return {clip: option[best] for clip, option in zip(clips, options)}
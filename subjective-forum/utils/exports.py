@@ -0,0 +1,224 @@
+"""
+Utility module for streaming exports of the raw ratings.
+
+One row is written per (participant, question, model, metric), straight from
+the result files or the shared state backend. Results are read one at a time
+and rows are written in chunks, so memory stays constant however large the
+study is:
+
+    rows = iter_rows(iter_result_files('results'), translate_metric_name)
+    write_rows(rows, 'ratings.csv.gz')
+
+The format follows the file name: .csv, .csv.gz, .csv.zst or .parquet.
+zstd needs the 'zstandard' package and Parquet the 'pyarrow' package; both are
+optional and only imported when used.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+from itertools import islice
+from typing import Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from utils.saver import decode_result, read_result, result_paths
+from utils.screening import result_uuid
+from utils.state import StateBackend
+
+ROW_FIELDS = ('participant', 'timestamp', 'question', 'template', 'prompt', 'position', 'model', 'metric',
+              'rating', 'time_spent')
+CHUNK_ROWS = 65536  # Rows buffered per write
+
+
+def iter_result_files(results_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read result files one at a time, oldest first.
+
+    Args:
+        results_dir: Directory of result files, in any format (see utils/saver.py)
+
+    Yields:
+        Result dictionaries; unreadable files are skipped
+    """
+    # File names start with the date and time, so sorting them sorts by time
+    for path in result_paths(results_dir):
+        try:
+            data = read_result(path)
+        except (OSError, ValueError):
+            continue
+        data['uuid'] = result_uuid(data, path)
+        yield data
+
+
+def iter_backend_results(backend: StateBackend, hash_name: str = 'results') -> Iterator[Dict[str, Any]]:
+    """
+    Read the results stored in the shared state backend.
+
+    The backend returns the hash at once, but records are only parsed as they
+    are consumed.
+
+    Args:
+        backend: Shared state backend
+        hash_name: 'results' or 'debug_results'
+
+    Yields:
+        Result dictionaries
+    """
+    for uuid_hex, value in backend.hgetall(hash_name).items():
+        data = decode_result(json.loads(value))
+        data.setdefault('uuid', uuid_hex)
+        yield data
+
+
+def iter_rows(results: Iterable[Dict[str, Any]],
+              metric_name: Optional[Callable[[str], str]] = None) -> Iterator[Tuple]:
+    """
+    Flatten results into one row per (participant, question, model, metric).
+
+    Args:
+        results: Result dictionaries, e.g. from iter_result_files
+        metric_name: Maps stored metric names to labels, e.g. translate_metric_name
+
+    Yields:
+        Tuples in ROW_FIELDS order; position is the model's place on the page
+        (0-based), time_spent the seconds spent on the question or None
+    """
+    labels: Dict[str, str] = {}  # Stored metric name -> label, so metric_name runs once per name
+    for result in results:
+        participant = result.get('uuid')
+        timestamp = result.get('timestamp')
+        for question, answer in (result.get('answers') or {}).items():
+            question = int(question) if str(question).isdigit() else question  # Index in the session
+            metrics_rated = answer.get('metrics_rated')
+            if not metrics_rated:
+                continue
+            template = answer.get('original_template_id')
+            prompt = answer.get('prompt_id_selected')
+            order = answer.get('models_shuffled_order') or []
+            seconds = answer.get('time_spent_on_question')
+            seconds = seconds if isinstance(seconds, (int, float)) else None
+            for model, ratings in metrics_rated.items():
+                position = order.index(model) if model in order else None
+                for stored, rating in ratings.items():
+                    if not isinstance(rating, (int, float)) or isinstance(rating, bool):
+                        continue
+                    if stored not in labels:
+                        labels[stored] = metric_name(stored) if metric_name else stored
+                    yield (participant, timestamp, question, template, prompt, position, model, labels[stored],
+                           rating, seconds)
+
+
+def _chunks(rows: Iterable[Tuple], size: int) -> Iterator[list]:
+    # Consecutive lists of at most size rows
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_text(path: str, compression: Optional[str] = None):
+    """
+    Open a text file for writing, compressed by its suffix or the given method.
+
+    Args:
+        path: Output path; '.gz' selects gzip and '.zst' zstd
+        compression: 'gzip', 'zstd' or None to infer from the suffix
+
+    Returns:
+        Writable text file object (newline='' for the csv module)
+    """
+    if compression is None:
+        compression = {'.gz': 'gzip', '.zst': 'zstd'}.get(os.path.splitext(path)[1])
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard)") from e
+        raw = open(path, 'wb')
+        writer = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def write_csv(rows: Iterable[Tuple], path: str, compression: Optional[str] = None,
+              chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Stream rows to a CSV file with a ROW_FIELDS header.
+
+    Args:
+        rows: Tuples from iter_rows
+        path: Output path (.csv, .csv.gz, .csv.zst)
+        compression: 'gzip', 'zstd' or None to infer from the suffix
+        chunk_rows: Rows buffered per write
+
+    Returns:
+        Number of rows written
+    """
+    written = 0
+    with open_text(path, compression) as f:
+        writer = csv.writer(f)
+        writer.writerow(ROW_FIELDS)
+        for chunk in _chunks(rows, chunk_rows):
+            writer.writerows(chunk)
+            written += len(chunk)
+    return written
+
+
+def write_parquet(rows: Iterable[Tuple], path: str, compression: str = 'zstd',
+                  chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Stream rows to a Parquet file, one row group per chunk.
+
+    Args:
+        rows: Tuples from iter_rows
+        path: Output path
+        compression: Parquet codec, e.g. 'zstd', 'gzip', 'snappy' or 'none'
+        chunk_rows: Rows per row group
+
+    Returns:
+        Number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export needs the 'pyarrow' package (pip install pyarrow)") from e
+
+    schema = pa.schema([
+        ('participant', pa.string()), ('timestamp', pa.int64()), ('question', pa.int32()),
+        ('template', pa.string()), ('prompt', pa.string()), ('position', pa.int16()),
+        ('model', pa.string()), ('metric', pa.string()), ('rating', pa.float64()),
+        ('time_spent', pa.float64()),
+    ])
+    written = 0
+    # String columns are dictionary-encoded by default, which suits the few distinct labels
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for chunk in _chunks(rows, chunk_rows):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.table([pa.array(column, type=field.type)
+                                         for column, field in zip(columns, schema)], schema=schema))
+            written += len(chunk)
+    return written
+
+
+def write_rows(rows: Iterable[Tuple], path: str, chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Stream rows to a CSV or Parquet file chosen by the file name.
+
+    Args:
+        rows: Tuples from iter_rows
+        path: .csv, .csv.gz, .csv.zst or .parquet
+        chunk_rows: Rows buffered per write
+
+    Returns:
+        Number of rows written
+    """
+    if path.endswith('.parquet'):
+        return write_parquet(rows, path, chunk_rows=chunk_rows)
+    if path.endswith(('.csv', '.csv.gz', '.csv.zst')):
+        return write_csv(rows, path, chunk_rows=chunk_rows)
+    raise ValueError(f"Unknown export format: {path} (use .csv, .csv.gz, .csv.zst or .parquet)")
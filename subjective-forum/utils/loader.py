@@ -4,7 +4,9 @@ Utility module for loading and randomizing questions from the forum configuratio
 import os
 import random
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+
+from utils.quota import Usage, QUESTION, template_total, prompt_needs_ratings
 
 
 def scan_audio_directory(audio_root: str) -> Dict[str, Dict[str, List[str]]]:
@@ -54,18 +56,28 @@ def scan_audio_directory(audio_root: str) -> Dict[str, Dict[str, List[str]]]:
 
 def select_and_randomize_questions_for_session(
     question_templates: List[Dict[str, Any]],
-    scanned_audio_data: Dict[str, Dict[str, List[str]]]
+    scanned_audio_data: Dict[str, Dict[str, List[str]]],
     # n_questions_to_present: int # This global parameter is removed
+    quota_usage: Optional[Usage] = None,
+    scheduler: Optional[Any] = None
 ) -> List[Dict[str, Any]]:
     """
     Selects prompt IDs for each question template based on its 'n_to_present' value,
     shuffles models, and prepares a list of fully resolved question instances.
 
+    Templates with 'target_count' or 'target_per_model' quotas (see utils/quota.py)
+    only present prompts that still need ratings, least-rated prompts first, and
+    are skipped once their target count is met. With an adaptive scheduler
+    (see utils/adaptive.py) the prompts whose model differences are least
+    certain are preferred.
+
     Args:
         question_templates: List of question configurations (templates) from forum.json.
                             Each template should have an 'n_to_present' key.
         scanned_audio_data: Nested dictionary from scan_audio_directory:
                             {"subfolderName": {"promptId": ["model_tag1", ...]}}
+        quota_usage: Ratings so far from QuotaStore.usage (optional)
+        scheduler: AdaptiveScheduler ordering the candidate prompts (optional)
 
     Returns:
         A list of resolved question instance dictionaries for the session.
@@ -111,7 +123,23 @@ def select_and_randomize_questions_for_session(
             continue
 
         random.shuffle(valid_prompt_ids) # Shuffle available valid prompts for this subfolder
+
+        # Rating quotas: skip saturated prompts and templates, least-rated prompts first
+        has_quota = q_template.get("target_count") or q_template.get("target_per_model")
+        if quota_usage is not None and has_quota:
+            if q_template.get("target_count"):
+                remaining = q_template["target_count"] - template_total(quota_usage, template_id)
+                if remaining <= 0:
+                    continue
+                n_to_present_for_template = min(n_to_present_for_template, remaining)
+            valid_prompt_ids = [p_id for p_id in valid_prompt_ids if prompt_needs_ratings(quota_usage, q_template, p_id)]
+            prompt_counts = quota_usage.get(template_id, {})
+            valid_prompt_ids.sort(key=lambda p_id: prompt_counts.get(p_id, {}).get(QUESTION, 0)) # Stable: ties stay shuffled
         
+        # Adaptive scheduling: most informative prompts first
+        if scheduler is not None:
+            valid_prompt_ids = scheduler.order(q_template, valid_prompt_ids, n_to_present_for_template)
+
         # Determine how many prompts to actually select for this template
         num_to_select_for_this_template = min(n_to_present_for_template, len(valid_prompt_ids))
         
@@ -0,0 +1,237 @@
+"""
+Utility module for metric names: IDs, display labels and language variants.
+
+Metrics are configured in forum.json by name, usually "中文（English）":
+
+    "metrics": [
+        {"name": "整體評價（Overall Rating）", "description": "..."},
+        {"name": "連貫性（Coherence）", "id": "coherence", "aliases": ["流暢度（Fluency）"]}
+    ]
+
+Each metric has a compact ID: the optional "id", or else the English part of
+the name in snake_case ("overall_rating"). Result files store ratings under
+the ID and map the IDs back to full names in a "metrics" header. Old result
+files store full names instead. The catalog maps every known spelling to the
+same ID (the full name, either language part, "aliases" and the ID itself),
+so results from differently configured studies combine in one analysis.
+
+Lookups are memoized per name, and an unknown name never raises: it gets the
+ID and label derived from the name itself. Two metrics of one template must
+have distinct IDs (give one an explicit "id"); the same ID in different
+templates is how a metric is analyzed across templates.
+"""
+import re
+from typing import Dict, Any, Iterable, Optional, Tuple, Union
+
+from flask import Flask
+
+_ENGLISH = re.compile(r'^(.*?)\s*[（(]\s*(.+?)\s*[）)]\s*$')  # "中文（English）" or "中文 (English)"
+
+
+def split_name(name: str) -> Tuple[str, Optional[str]]:
+    """
+    Split a metric name into its native and English parts.
+
+    Args:
+        name: Metric name, e.g. "整體評價（Overall Rating）"
+
+    Returns:
+        (native part, English part or None), e.g. ("整體評價", "Overall Rating")
+    """
+    match = _ENGLISH.match(name)
+    # Only an English part after a non-English one is a translation; "音質評價（清晰度）"
+    # and "Naturalness (Fluency)" are single names
+    if match and match.group(1) and not match.group(1).isascii() and match.group(2).isascii():
+        return match.group(1), match.group(2)
+    return name.strip(), None
+
+
+def derive_id(name: str) -> str:
+    """
+    Default metric ID: the English part of the name (or the name) in snake_case.
+
+    Deriving the ID of an ID gives the ID back.
+
+    Args:
+        name: Metric name
+
+    Returns:
+        ID, e.g. "overall_rating"
+    """
+    native, english = split_name(name)
+    return re.sub(r'\W+', '_', (english or native).lower()).strip('_') or name
+
+
+class MetricCatalog:
+    """
+    Known metrics of one or more forum configs, with memoized name lookups.
+
+    Attributes:
+        names: Metric ID -> configured full name
+        labels: Metric ID -> display label (the English part of the name)
+    """
+
+    def __init__(self, questions: Iterable[Dict[str, Any]] = ()):
+        self.names: Dict[str, str] = {}
+        self.labels: Dict[str, str] = {}
+        self._ids: Dict[str, str] = {}  # Any spelling -> ID; also caches derived IDs
+        self._derived: set = set()  # IDs only seen as unknown names, until they are registered
+        self.register_questions(questions)
+
+    def register(self, metric: Union[Dict[str, Any], str]) -> str:
+        """
+        Add a metric definition from forum.json.
+
+        Args:
+            metric: Metric object with 'name' and optional 'id', 'label' and
+                'aliases', or just a name
+
+        Returns:
+            The metric ID
+        """
+        if isinstance(metric, str):
+            metric = {'name': metric}
+        name = metric['name']
+        metric_id = metric.get('id') or derive_id(name)
+        native, english = split_name(name)
+        if metric_id in self._derived:
+            self._derived.discard(metric_id)
+            self.names.pop(metric_id, None)
+            self.labels.pop(metric_id, None)
+        self.names.setdefault(metric_id, name)
+        self.labels.setdefault(metric_id, metric.get('label') or english or native)
+        for spelling in (name, native, english, metric_id, *metric.get('aliases', [])):
+            if spelling:
+                self._ids[spelling] = metric_id
+        return metric_id
+
+    def register_questions(self, questions: Iterable[Dict[str, Any]]) -> None:
+        """
+        Add the metrics of all question templates of a forum config.
+
+        Args:
+            questions: The "questions" of forum.json
+        """
+        for q_template in questions:
+            for metric in q_template.get('metrics', []):
+                if isinstance(metric, str) or (isinstance(metric, dict) and metric.get('name')):
+                    self.register(metric)
+
+    def register_header(self, header: Optional[Dict[str, str]]) -> None:
+        """
+        Add the "metrics" header of a result file (ID -> full name).
+
+        Args:
+            header: Header dictionary, or None for old result files
+        """
+        for metric_id, name in (header or {}).items():
+            if metric_id not in self.names or metric_id in self._derived:
+                self.register({'id': metric_id, 'name': name})
+
+    def id_of(self, name: str) -> str:
+        """
+        ID of a metric name, alias or ID.
+
+        Args:
+            name: Any spelling of the metric
+
+        Returns:
+            The registered ID, or the ID derived from the name
+        """
+        metric_id = self._ids.get(name)
+        if metric_id is None:
+            # Not configured: the first spelling seen names the derived ID in headers
+            metric_id = self._ids[name] = derive_id(name)
+            if metric_id not in self.names:
+                self.names[metric_id] = name
+                self._derived.add(metric_id)
+        return metric_id
+
+    def label(self, name: str) -> str:
+        """
+        Display label of a metric name, alias or ID.
+
+        Args:
+            name: Any spelling of the metric
+
+        Returns:
+            The English label, e.g. "Overall Rating"; for unknown names without
+            an English part, the name itself
+        """
+        metric_id = self.id_of(name)
+        label = self.labels.get(metric_id)
+        if label is None:
+            native, english = split_name(name)
+            label = self.labels[metric_id] = english or native
+        return label
+
+    def compact(self, metrics_rated: Optional[Dict[str, Dict[str, Any]]]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Ratings of one question with metric names replaced by IDs.
+
+        Args:
+            metrics_rated: model -> {metric name: rating}, as posted by the page
+
+        Returns:
+            model -> {metric ID: rating}; None stays None
+
+        Raises:
+            ValueError: If two rated names of one model map to the same ID
+        """
+        if not metrics_rated:
+            return metrics_rated
+        compacted = {}
+        for model, ratings in metrics_rated.items():
+            by_id, names = {}, {}
+            for name, rating in (ratings or {}).items():
+                metric_id = self.id_of(name)
+                if metric_id in by_id:
+                    raise ValueError(f"Metrics '{names[metric_id]}' and '{name}' both map to the ID '{metric_id}'")
+                by_id[metric_id], names[metric_id] = rating, name
+            compacted[model] = by_id
+        return compacted
+
+    def header(self, metric_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        "metrics" header of a result file.
+
+        Args:
+            metric_ids: IDs used in the result
+
+        Returns:
+            ID -> full name, sorted by ID
+        """
+        return {metric_id: self.names.get(metric_id, metric_id) for metric_id in sorted(set(metric_ids))}
+
+
+def init_metric_names(app: Flask) -> MetricCatalog:
+    """
+    Create the catalog of the metrics in the app's forum config.
+
+    Args:
+        app: Flask application with FORUM loaded
+
+    Returns:
+        The catalog, also stored as app.extensions['metric_names']
+
+    Raises:
+        ValueError: If two metrics of one template share an ID, so one of
+            their ratings would be lost when results are saved
+    """
+    catalog = MetricCatalog(app.config.get('FORUM', {}).get('questions', []))
+    clashes = {}
+    for q_template in app.config.get('FORUM', {}).get('questions', []):
+        template_names = {}
+        for metric in q_template.get('metrics', []):
+            if isinstance(metric, dict) and metric.get('name'):
+                metric_id = catalog.id_of(metric['name'])
+                other = template_names.setdefault(metric_id, metric['name'])
+                if other != metric['name']:
+                    raise ValueError(f"Template '{q_template.get('id')}': metrics '{other}' and '{metric['name']}' "
+                                     f"share the ID '{metric_id}'; give one of them an explicit \"id\"")
+                clashes.setdefault(metric_id, set()).add(metric['name'])
+    for metric_id, names in clashes.items():
+        if len(names) > 1:
+            app.logger.info(f"Metrics {sorted(names)} share the ID '{metric_id}' and are analyzed together")
+    app.extensions['metric_names'] = catalog
+    return catalog
@@ -0,0 +1,426 @@
+"""
+Utility module for request instrumentation and a Prometheus-style metrics endpoint.
+
+Each process keeps its metrics in memory. When METRICS_DIR is set (as it is under
+gunicorn, see gunicorn.conf.py), every process also writes a snapshot file
+metrics_<pid>.json there at most every METRICS_FLUSH_INTERVAL seconds, and
+/metrics sums the snapshots of all workers. Counters and histograms of workers
+that have exited are folded into metrics_dead.json by mark_process_dead, so
+totals stay monotonic across worker restarts; their gauges are dropped.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Iterable, Optional, Tuple
+
+from flask import Flask, g, request, request_finished
+
+# Seconds; tuned for page renders (ms) up to slow result writes and audio streams
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes; from JSON replies up to full audio clips
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Bytes; the browser limit for one cookie is about 4 KB
+COOKIE_BUCKETS = (128, 256, 512, 1024, 2048, 3072, 4096)
+
+SNAPSHOT_PREFIX = 'metrics_'
+DEAD_SNAPSHOT = 'metrics_dead.json'
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    """Base class holding one metric family and its labelled values."""
+    kind = 'untyped'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, Any] = {}
+
+
+class Counter(_Metric):
+    """Monotonic counter; summed across processes."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Current value (e.g. in-flight requests); summed across live processes only."""
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self.registry.lock:
+            self.values[_label_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution with sum and count; summed across processes."""
+    kind = 'histogram'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, buckets: Iterable[float]):
+        super().__init__(registry, name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['buckets'][index] += 1  # Per-bucket counts; made cumulative when rendered
+            entry['sum'] += value
+            entry['count'] += 1
+
+
+class MetricsRegistry:
+    """
+    In-process metric store with optional multiprocess snapshots.
+
+    Attributes:
+        metrics_dir: Directory shared by all worker processes (None: this process only)
+        flush_interval: Minimum seconds between snapshot writes
+    """
+
+    def __init__(self, metrics_dir: Optional[str] = None, flush_interval: float = 5.0):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Tuple[str, str, str, Callable[[], Dict[LabelKey, float]]]] = []
+        self._last_flush = 0.0
+        if metrics_dir:
+            Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+
+        # A worker forked from a preloaded master must not report the master's values
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset_after_fork())
+
+    def _reset_after_fork(self) -> None:
+        self.lock = threading.Lock()
+        self._last_flush = 0.0
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+    def _register(self, metric: _Metric) -> Any:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(self, name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(self, name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, buckets))
+
+    def register_collector(self, name: str, kind: str, documentation: str,
+                           collect: Callable[[], Dict[str, float]], label: str) -> None:
+        """
+        Add a metric whose values are read from elsewhere when a snapshot is taken.
+
+        Args:
+            name: Metric name
+            kind: 'counter' or 'gauge'
+            documentation: HELP text
+            collect: Callable returning {label value: number}
+            label: Label name for the keys returned by collect
+        """
+        self.collectors.append((name, kind, documentation,
+                                lambda: {((label, str(k)),): float(v) for k, v in collect().items()}))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Serializable copy of all metrics of this process.
+
+        Returns:
+            Dictionary {name: {'kind', 'help', 'buckets'?, 'samples': [[labels, value], ...]}}
+        """
+        families: Dict[str, Any] = {}
+        with self.lock:
+            for metric in self.metrics.values():
+                family = {'kind': metric.kind, 'help': metric.documentation,
+                          'samples': [[list(map(list, key)), json.loads(json.dumps(value))]
+                                      for key, value in metric.values.items()]}
+                if isinstance(metric, Histogram):
+                    family['buckets'] = list(metric.buckets)
+                families[metric.name] = family
+        for name, kind, documentation, collect in self.collectors:
+            families[name] = {'kind': kind, 'help': documentation,
+                              'samples': [[list(map(list, key)), value] for key, value in collect().items()]}
+        return families
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Write this process's snapshot to METRICS_DIR, at most every flush_interval seconds.
+
+        Args:
+            force: Write even if the last flush was recent
+        """
+        if not self.metrics_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        pid = os.getpid()
+        target = Path(self.metrics_dir) / f"{SNAPSHOT_PREFIX}{pid}.json"
+        temp_file = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+        with temp_file.open('w', encoding='utf-8') as fp:
+            json.dump({'pid': pid, 'families': self.snapshot()}, fp)
+        temp_file.replace(target)
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        Aggregate metrics over all processes sharing METRICS_DIR (or this process only).
+
+        Returns:
+            Snapshot-shaped dictionary with samples merged by labels
+        """
+        if not self.metrics_dir:
+            return _merge([self.snapshot()])
+        self.flush(force=True)
+        snapshots = []
+        for path in Path(self.metrics_dir).glob(f"{SNAPSHOT_PREFIX}*.json"):
+            data = _read_snapshot(path)
+            if data is None:
+                continue
+            pid = data.get('pid')
+            if pid is not None and not _pid_alive(pid):
+                data['families'] = _drop_gauges(data['families'])
+            snapshots.append(data['families'])
+        return _merge(snapshots)
+
+    def render(self) -> str:
+        """
+        Render the aggregated metrics in the Prometheus text exposition format.
+
+        Returns:
+            Text body for the /metrics endpoint
+        """
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for labels, value in sorted(family['samples'], key=lambda s: s[0]):
+                if family['kind'] == 'histogram':
+                    cumulative = 0
+                    bounds = [_format_value(b) for b in family['buckets']] + ['+Inf']
+                    for bound, count in zip(bounds, value['buckets']):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels + [['le', bound]])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _read_snapshot(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with path.open('r', encoding='utf-8') as fp:
+            return json.load(fp)
+    except (json.JSONDecodeError, IOError):
+        return None  # Removed or being replaced by its worker
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _drop_gauges(families: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: family for name, family in families.items() if family['kind'] != 'gauge'}
+
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for families in snapshots:
+        for name, family in families.items():
+            target = merged.setdefault(name, {k: v for k, v in family.items() if k != 'samples'})
+            samples = target.setdefault('_by_labels', {})
+            for labels, value in family['samples']:
+                key = json.dumps(labels)
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = json.loads(json.dumps(value))
+                elif family['kind'] == 'histogram':
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+                else:
+                    samples[key] = current + value
+    for family in merged.values():
+        family['samples'] = [[json.loads(key), value] for key, value in family.pop('_by_labels', {}).items()]
+    return merged
+
+
+def _format_labels(labels: List[List[str]]) -> str:
+    if not labels:
+        return ''
+    escaped = (k + '="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def mark_process_dead(metrics_dir: Optional[str], pid: int) -> None:
+    """
+    Fold an exited worker's counters and histograms into metrics_dead.json.
+
+    Called from gunicorn's child_exit hook so that snapshot files do not pile up
+    when workers are recycled (max_requests).
+
+    Args:
+        metrics_dir: Shared metrics directory
+        pid: Process ID of the exited worker
+    """
+    if not metrics_dir:
+        return
+    snapshot_path = Path(metrics_dir) / f"{SNAPSHOT_PREFIX}{pid}.json"
+    data = _read_snapshot(snapshot_path)
+    if data is None:
+        return
+    dead_path = Path(metrics_dir) / DEAD_SNAPSHOT
+    previous = _read_snapshot(dead_path) or {'families': {}}
+    merged = _merge([previous['families'], _drop_gauges(data['families'])])
+    temp_file = dead_path.with_name(f".{dead_path.name}.tmp")
+    with temp_file.open('w', encoding='utf-8') as fp:
+        json.dump({'pid': None, 'families': merged}, fp)
+    temp_file.replace(dead_path)
+    snapshot_path.unlink()
+
+
+def clear_metrics_dir(metrics_dir: Optional[str]) -> None:
+    """
+    Remove snapshots left over from a previous server run, including those in
+    per-study subdirectories.
+
+    Args:
+        metrics_dir: Shared metrics directory
+    """
+    if not metrics_dir or not os.path.isdir(metrics_dir):
+        return
+    for path in Path(metrics_dir).rglob(f"*{SNAPSHOT_PREFIX}*"):
+        path.unlink()
+
+
+def _set_cookie_sizes(response) -> List[int]:
+    sizes = []
+    for header in response.headers.getlist('Set-Cookie'):
+        name, _, rest = header.partition('=')
+        sizes.append(len(rest.split(';', 1)[0]))
+    return sizes
+
+
+def init_metrics(app: Flask) -> MetricsRegistry:
+    """
+    Create the app's metrics registry and register the request instrumentation.
+
+    Records, per endpoint: request count by status, latency, in-flight requests,
+    response bytes and the size of session cookies written.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        The registry, also stored as app.extensions['metrics']
+    """
+    registry = MetricsRegistry(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_INTERVAL', 5.0))
+    app.extensions['metrics'] = registry
+
+    requests_total = registry.counter('forum_http_requests_total', 'HTTP requests by endpoint, method and status.')
+    latency = registry.histogram('forum_http_request_duration_seconds', 'Time to build the response, by endpoint.')
+    in_flight = registry.gauge('forum_http_requests_in_flight', 'Requests currently being handled, by endpoint.')
+    response_bytes = registry.histogram('forum_http_response_bytes', 'Response body size, by endpoint.', SIZE_BUCKETS)
+    cookie_bytes = registry.histogram('forum_session_cookie_bytes', 'Size of session cookies written, by endpoint.', COOKIE_BUCKETS)
+
+    interface = app.session_interface
+    if hasattr(interface, 'stats'):
+        registry.register_collector(
+            'forum_session_events_total', 'counter',
+            'Session interface decisions (skipped, touched, refreshed, written, avoided).',
+            interface.stats, 'event'
+        )
+
+    def _endpoint() -> str:
+        return request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_start = time.perf_counter()
+        g._metrics_endpoint = _endpoint()
+        in_flight.inc(endpoint=g._metrics_endpoint)
+
+    def record_response(sender, response, **extra):
+        # request_finished is sent after the session cookie has been written
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        endpoint = g._metrics_endpoint
+        latency.observe(time.perf_counter() - start, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.content_length is not None:
+            response_bytes.observe(response.content_length, endpoint=endpoint)
+        for size in _set_cookie_sizes(response):
+            cookie_bytes.observe(size, endpoint=endpoint)
+
+    # Keep a strong reference: blinker holds receivers weakly
+    app.extensions['metrics_receiver'] = record_response
+    request_finished.connect(record_response, app)
+
+    @app.teardown_request
+    def finish_request(exc=None):
+        endpoint = g.pop('_metrics_endpoint', None)
+        if endpoint is not None:
+            in_flight.dec(endpoint=endpoint)
+        registry.flush()
+
+    return registry
+
+
+def get_registry(app: Flask) -> Optional[MetricsRegistry]:
+    """
+    Metrics registry of an app, or None if metrics are disabled.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        MetricsRegistry or None
+    """
+    return app.extensions.get('metrics')
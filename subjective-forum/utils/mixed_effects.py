@@ -0,0 +1,197 @@
+"""
+Utility module for linear mixed models of the ratings with crossed random effects.
+
+For every template and metric the ratings are fitted with
+
+    rating ~ 0 + model + (1 | participant) + (1 | prompt)
+
+by restricted maximum likelihood (REML). The model coefficients are the
+model means with the participant and prompt effects averaged out, so a
+model is not favoured because lenient participants or easy prompts happened
+to rate it more often.
+
+The fit follows the penalized least squares formulation of lme4: for given
+relative standard deviations theta of the random effects, one symmetric
+system (the mixed model equations) gives the fixed and random effects, the
+penalized residual sum of squares and the log-determinant of the REML
+criterion. The two thetas are optimized with L-BFGS-B.
+
+The designs are sparse matrices with one column per participant and prompt.
+Every rating has exactly one participant, so the participant block of the
+system is diagonal and is eliminated in closed form; what remains is a small
+dense system over the prompts and models, solved by Cholesky factorization.
+A criterion evaluation is linear in the number of ratings. Templates and
+metrics can be fitted in parallel worker processes.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from scipy import linalg, optimize, sparse
+
+from utils.ratings import RatingsTable
+
+
+class _Design:
+    # Cross products of the sparse design, reused by every criterion evaluation.
+    # The factor with more levels ("first", usually participants) has a diagonal
+    # block in the mixed model equations and is eliminated in closed form; the
+    # Schur complement over the other factor and the fixed effects is small and dense.
+
+    def __init__(self, y: np.ndarray, fixed: np.ndarray, first: np.ndarray, second: np.ndarray):
+        n = len(y)
+        self.n, self.p = n, int(fixed.max()) + 1
+        self.n_first, self.n_second = int(first.max()) + 1, int(second.max()) + 1
+        rows = np.arange(n)
+        z1 = sparse.csr_matrix((np.ones(n), (rows, first)), shape=(n, self.n_first))
+        # Second factor and fixed effects side by side
+        w = sparse.csr_matrix((np.ones(2 * n), (np.concatenate([rows, rows]),
+                                                 np.concatenate([second, self.n_second + fixed]))),
+                              shape=(n, self.n_second + self.p))
+        self.counts = np.bincount(first, minlength=self.n_first).astype(float)  # Diagonal of Z1'Z1
+        self.z1tw = (z1.T @ w).tocsr()
+        self.wtw = (w.T @ w).toarray()
+        self.z1ty = z1.T @ y
+        self.wty = w.T @ y
+        self.yty = float(y @ y)
+
+    def solve(self, theta: np.ndarray):
+        # Mixed model equations for relative standard deviations theta = (first, second)
+        scale = np.concatenate([np.full(self.n_second, theta[1]), np.ones(self.p)])
+        diagonal = theta[0] ** 2 * self.counts + 1.0
+        weights = sparse.diags(theta[0] ** 2 / diagonal)
+        schur = scale[:, None] * (self.wtw - (self.z1tw.T @ weights @ self.z1tw).toarray()) * scale[None, :]
+        schur[np.arange(self.n_second), np.arange(self.n_second)] += 1.0
+        chol = linalg.cho_factor(schur)
+
+        rhs1 = theta[0] * self.z1ty
+        rhs2 = scale * self.wty
+        reduced = rhs2 - scale * (self.z1tw.T @ (theta[0] * rhs1 / diagonal))
+        solution2 = linalg.cho_solve(chol, reduced)
+        solution1 = (rhs1 - theta[0] * (self.z1tw @ (scale * solution2))) / diagonal
+
+        prss = max(self.yty - float(rhs1 @ solution1) - float(rhs2 @ solution2), 1e-12)  # Penalized RSS
+        log_det = float(np.sum(np.log(diagonal))) + 2 * float(np.sum(np.log(np.diag(chol[0]))))
+        return chol, solution2[self.n_second:], prss, log_det
+
+    def reml(self, theta: np.ndarray) -> float:
+        # REML deviance (-2 log restricted likelihood), profiled over the residual variance
+        _, _, prss, log_det = self.solve(theta)
+        dof = self.n - self.p
+        return log_det + dof * (1 + math.log(2 * math.pi * prss / dof))
+
+
+def fit_crossed(y: np.ndarray, fixed: np.ndarray, participant: np.ndarray, prompt: np.ndarray) -> Dict[str, Any]:
+    """
+    Fit y ~ 0 + fixed + (1 | participant) + (1 | prompt) by REML.
+
+    Args:
+        y: Ratings
+        fixed: Fixed-effect level (model code, 0..p-1) of each rating
+        participant: Participant code (0..n-1) of each rating
+        prompt: Prompt code (0..m-1) of each rating
+
+    Returns:
+        Dictionary with 'coef' and 'cov' (fixed-effect means and their
+        covariance), 'sd_participant', 'sd_prompt', 'sd_residual', 'reml'
+        (deviance) and 'converged'
+    """
+    # Eliminate the factor with more levels in closed form
+    swap = int(prompt.max()) > int(participant.max())
+    first, second = (prompt, participant) if swap else (participant, prompt)
+    design = _Design(np.asarray(y, dtype=float), fixed, first, second)
+    if design.n <= design.p:
+        raise ValueError("Not enough ratings to fit the model")
+
+    bounds = [(0.0, None), (0.0, None)]
+    result = optimize.minimize(design.reml, np.array([0.5, 0.5]), method='L-BFGS-B', bounds=bounds)
+    if not result.success:
+        # The finite-difference line search can abort next to a zero variance;
+        # finish derivative-free from where it stopped
+        result = optimize.minimize(design.reml, result.x, method='Powell', bounds=bounds)
+    theta = result.x
+    chol, coef, prss, _ = design.solve(theta)
+    sigma2 = prss / (design.n - design.p)
+
+    # Covariance of the fixed effects: sigma^2 times the fixed block of the inverse
+    unit = np.zeros((design.n_second + design.p, design.p))
+    unit[design.n_second + np.arange(design.p), np.arange(design.p)] = 1.0
+    cov = sigma2 * linalg.cho_solve(chol, unit)[design.n_second:, :]
+
+    sigma = math.sqrt(sigma2)
+    sd_first, sd_second = float(theta[0]) * sigma, float(theta[1]) * sigma
+    return {
+        'coef': coef, 'cov': (cov + cov.T) / 2,
+        'sd_participant': sd_second if swap else sd_first, 'sd_prompt': sd_first if swap else sd_second,
+        'sd_residual': sigma, 'reml': float(result.fun), 'converged': bool(result.success),
+    }
+
+
+def _fit_group(args):
+    # Fit one (template, metric) group; module level so worker processes can run it
+    key, y, model, participant, prompt = args
+    # Codes local to the group, so absent levels get no columns
+    model_labels, model_codes = np.unique(model, return_inverse=True)
+    _, participant_codes = np.unique(participant, return_inverse=True)
+    _, prompt_codes = np.unique(prompt, return_inverse=True)
+    try:
+        fit = fit_crossed(y, model_codes, participant_codes, prompt_codes)
+        fit['error'] = None
+    except (ValueError, linalg.LinAlgError) as e:
+        # E.g. a pilot template with a single rating per model; one such group
+        # must not stop the fits of all others
+        p = len(model_labels)
+        fit = {'coef': np.full(p, np.nan), 'cov': np.full((p, p), np.nan), 'sd_participant': math.nan,
+               'sd_prompt': math.nan, 'sd_residual': math.nan, 'reml': math.nan, 'converged': False,
+               'error': str(e)}
+    fit.update(key=key, models=model_labels, n=len(y),
+               participants=int(participant_codes.max()) + 1, prompts=int(prompt_codes.max()) + 1)
+    return fit
+
+
+def fit_mixed_models(table: RatingsTable, workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Fit rating ~ model + (1|participant) + (1|prompt) per template and metric.
+
+    Args:
+        table: Ratings table (see utils/ratings.py)
+        workers: Worker processes for fitting groups in parallel (default: 1)
+
+    Returns:
+        One dictionary per (template, metric, model) with 'estimate', 'se',
+        'ci_low', 'ci_high' (95%, normal approximation), 'ratings' of the group,
+        'participants', 'prompts', the random-effect standard deviations,
+        'converged' and 'error'. A group that cannot be fitted (too few
+        ratings) gets NaN estimates and the reason in 'error'
+    """
+    group = table.codes['template'] * table.size('metric') + table.codes['metric']
+    order = np.argsort(group, kind='stable')
+    keys, starts = np.unique(group[order], return_index=True)
+    bounds = list(zip(starts, list(starts[1:]) + [len(order)]))
+    tasks = []
+    for key, (start, stop) in zip(keys, bounds):
+        rows = order[start:stop]
+        tasks.append((int(key), table.rating[rows], table.codes['model'][rows],
+                      table.codes['participant'][rows], table.codes['prompt'][rows]))
+
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            fits = list(pool.map(_fit_group, tasks))
+    else:
+        fits = [_fit_group(task) for task in tasks]
+
+    rows = []
+    for fit in fits:
+        template, metric = divmod(fit['key'], table.size('metric'))
+        se = np.sqrt(np.maximum(np.diag(fit['cov']), 0.0))
+        for model, estimate, error in zip(fit['models'], fit['coef'], se):
+            rows.append({
+                'template': table.labels['template'][template], 'metric': table.labels['metric'][metric],
+                'model': table.labels['model'][model], 'estimate': float(estimate), 'se': float(error),
+                'ci_low': float(estimate - 1.96 * error), 'ci_high': float(estimate + 1.96 * error),
+                'ratings': fit['n'], 'participants': fit['participants'], 'prompts': fit['prompts'],
+                'sd_participant': fit['sd_participant'], 'sd_prompt': fit['sd_prompt'],
+                'sd_residual': fit['sd_residual'], 'converged': fit['converged'], 'error': fit['error'],
+            })
+    return rows
@@ -0,0 +1,329 @@
+"""
+Utility module for an opt-in sampling profiler of request handling.
+
+While a capture is running, a fraction of requests (PROFILE_SAMPLE_RATE) is
+marked for sampling. One background thread takes a stack snapshot of each marked
+request thread every PROFILE_INTERVAL seconds through sys._current_frames(), so
+unsampled requests pay nothing beyond a random() call and the profiled ones only
+pay for the snapshots. Stacks are aggregated per endpoint and written as
+collapsed stacks (flamegraph.pl, speedscope, inferno) and as a speedscope JSON
+file to PROFILE_DIR.
+
+Captures are started and stopped through the admin routes (blueprints/admin.py).
+Under a multi-worker server the request reaches one worker; it writes a control
+file in PROFILE_DIR that the other workers pick up within a second, and each
+worker writes its own files when it sees the capture end.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from flask import Flask, g, request
+
+CONTROL_FILE = 'capture.json'
+MAX_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+def _stack(frame) -> Tuple[str, ...]:
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()  # Root first
+    return tuple(labels)
+
+
+class SamplingProfiler:
+    """
+    Process-wide sampler for the requests marked by the request hooks.
+
+    Attributes:
+        profile_dir: Output directory for profiles and the control file
+        interval: Seconds between stack snapshots
+        sample_rate: Fraction of requests profiled during a capture
+        active: True while a capture is running in this process
+    """
+
+    def __init__(self, profile_dir: str, interval: float = 0.005, sample_rate: float = 0.1):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.active = False
+        self.started_at: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.requests: Counter = Counter()
+        self._targets: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._control_checked = 0.0
+        self._control_mtime: Optional[float] = None
+
+        # Threads do not survive fork: restart sampling in workers of a preloaded master
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._restart_after_fork())
+
+    def _restart_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._targets.clear()
+        if self.active:
+            self._thread = threading.Thread(target=self._run, name='forum-profiler', daemon=True)
+            self._thread.start()
+
+    # Capture control
+
+    def start(self, sample_rate: Optional[float] = None) -> None:
+        """
+        Start a capture in this process and announce it to the other workers.
+
+        Args:
+            sample_rate: Fraction of requests to profile (default: configured rate)
+        """
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+        control = Path(self.profile_dir) / CONTROL_FILE
+        temp_file = control.with_name(f".{control.name}.{os.getpid()}.tmp")
+        temp_file.write_text(json.dumps({'sampleRate': self.sample_rate, 'interval': self.interval}))
+        temp_file.replace(control)
+        self._control_mtime = control.stat().st_mtime
+        self._activate()
+
+    def stop(self) -> List[str]:
+        """
+        Stop the capture everywhere and write this process's profiles.
+
+        Returns:
+            Paths of the files written (empty if nothing was sampled)
+        """
+        control = Path(self.profile_dir) / CONTROL_FILE
+        if control.exists():
+            control.unlink()
+        self._control_mtime = None
+        return self._deactivate()
+
+    def sync_control(self) -> None:
+        """Follow captures started or stopped by another worker (checked at most once per second)."""
+        now = time.monotonic()
+        if now - self._control_checked < 1.0:
+            return
+        self._control_checked = now
+        control = Path(self.profile_dir) / CONTROL_FILE
+        try:
+            mtime = control.stat().st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime is not None and (not self.active or mtime != self._control_mtime):
+            try:
+                settings = json.loads(control.read_text())
+            except (json.JSONDecodeError, IOError):
+                return
+            self._control_mtime = mtime
+            self.sample_rate = settings.get('sampleRate', self.sample_rate)
+            self.interval = settings.get('interval', self.interval)
+            self._activate()
+        elif mtime is None and self.active:
+            self._control_mtime = None
+            self._deactivate()
+
+    def _activate(self) -> None:
+        with self._lock:
+            if self.active:
+                return
+            self.active = True
+            self.started_at = time.time()
+            self.stacks.clear()
+            self.requests.clear()
+            self._thread = threading.Thread(target=self._run, name='forum-profiler', daemon=True)
+            self._thread.start()
+
+    def _deactivate(self) -> List[str]:
+        with self._lock:
+            if not self.active:
+                return []
+            self.active = False
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=1.0)
+        return self.dump()
+
+    # Sampling
+
+    def begin_request(self, endpoint: str) -> bool:
+        """
+        Decide whether the current request is profiled, and if so register its thread.
+
+        Args:
+            endpoint: Endpoint name used to group the stacks
+
+        Returns:
+            True if the request is being sampled
+        """
+        if not self.active or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            self._targets[threading.get_ident()] = endpoint
+            self.requests[endpoint] += 1
+        return True
+
+    def end_request(self) -> None:
+        """Stop sampling the current thread."""
+        with self._lock:
+            self._targets.pop(threading.get_ident(), None)
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while self.active:
+            time.sleep(self.interval)
+            with self._lock:
+                targets = dict(self._targets)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for ident, endpoint in targets.items():
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack = _stack(frame)
+                with self._lock:
+                    self.stacks[(endpoint,) + stack] += 1
+
+    # Output
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Current capture state of this process.
+
+        Returns:
+            Dictionary with active flag, rate, interval, sampled requests and stack samples
+        """
+        with self._lock:
+            return {
+                'active': self.active,
+                'pid': os.getpid(),
+                'sampleRate': self.sample_rate,
+                'interval': self.interval,
+                'startedAt': self.started_at,
+                'sampledRequests': dict(self.requests),
+                'samples': sum(self.stacks.values()),
+            }
+
+    def collapsed(self) -> str:
+        """
+        Aggregated stacks in the collapsed format ("endpoint;frame;frame count").
+
+        Returns:
+            One line per distinct stack
+        """
+        with self._lock:
+            items = sorted(self.stacks.items())
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in items)
+
+    def speedscope(self) -> Dict[str, Any]:
+        """
+        Aggregated stacks as a speedscope file, one sampled profile per endpoint.
+
+        Returns:
+            Dictionary in the speedscope file format
+        """
+        with self._lock:
+            items = sorted(self.stacks.items())
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[str, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for (endpoint, *stack), count in items:
+            indices = []
+            for label in stack:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    name, _, location = label.rpartition(' (')
+                    file_name, _, line = location.rstrip(')').rpartition(':')
+                    frames.append({'name': name, 'file': file_name, 'line': int(line) if line.isdigit() else None})
+                indices.append(frame_index[label])
+            profile = profiles.setdefault(endpoint, {
+                'type': 'sampled', 'name': endpoint, 'unit': 'seconds',
+                'startValue': 0, 'endValue': 0, 'samples': [], 'weights': []
+            })
+            weight = count * self.interval
+            profile['samples'].append(indices)
+            profile['weights'].append(weight)
+            profile['endValue'] += weight
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"subjective-forum pid {os.getpid()}",
+            'exporter': 'subjective-forum utils/profiler.py',
+            'shared': {'frames': frames},
+            'profiles': list(profiles.values()),
+        }
+
+    def dump(self) -> List[str]:
+        """
+        Write the aggregated stacks of this process to PROFILE_DIR.
+
+        Returns:
+            Paths of the collapsed-stack and speedscope files (empty if nothing was sampled)
+        """
+        if not self.stacks:
+            return []
+        Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started_at or time.time()))
+        base = Path(self.profile_dir) / f"profile_{stamp}_{os.getpid()}"
+        collapsed_path = base.with_suffix('.collapsed')
+        speedscope_path = base.with_suffix('.speedscope.json')
+        collapsed_path.write_text(self.collapsed(), encoding='utf-8')
+        with speedscope_path.open('w', encoding='utf-8') as fp:
+            json.dump(self.speedscope(), fp)
+        return [str(collapsed_path), str(speedscope_path)]
+
+
+def init_profiler(app: Flask) -> SamplingProfiler:
+    """
+    Create the app's profiler and register the request hooks.
+
+    With PROFILE_ENABLED the capture starts right away; otherwise it is started
+    through the admin routes.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        The profiler, also stored as app.extensions['profiler']
+    """
+    profiler = SamplingProfiler(
+        app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles'),
+        app.config['PROFILE_INTERVAL'],
+        app.config['PROFILE_SAMPLE_RATE'],
+    )
+    app.extensions['profiler'] = profiler
+
+    @app.before_request
+    def start_profiling():
+        profiler.sync_control()
+        endpoint = request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+        if endpoint.startswith('admin.'):
+            return  # Capture control requests would only show up as noise
+        if profiler.begin_request(endpoint):
+            g._profiling = True
+
+    @app.teardown_request
+    def stop_profiling(exc=None):
+        if g.pop('_profiling', False):
+            profiler.end_request()
+
+    if app.config['PROFILE_ENABLED']:
+        profiler.start()
+    return profiler
@@ -0,0 +1,268 @@
+"""
+Utility module for rating quotas: stop assigning items that already have enough ratings.
+
+Question templates in forum.json may set
+- 'target_count': answered questions wanted for the template in total, and
+- 'target_per_model': ratings wanted for every (prompt, model) cell.
+
+Counts live in the shared state backend (see utils/state.py), so all workers and
+nodes see the same numbers. They are incremented when a participant finishes
+(api.finish), unless screening excludes the session. Questions assigned to
+participants still taking the test are held as reservations, so a surge of
+participants cannot overshoot a target. Reservations expire after
+QUOTA_RESERVATION_TTL seconds when a participant abandons the test.
+
+The item key for template-level counts is the model '' (one count per answered
+question), so a single hash holds both kinds of counts.
+"""
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Iterable, Optional
+
+from flask import Flask
+
+from utils.saver import read_result, result_paths
+from utils.screening import result_uuid
+from utils.state import StateBackend, join_field, split_field
+
+COUNTS = 'quota:counts'  # join_field(template, prompt, model) -> ratings
+RESERVATIONS = 'quota:reservations'  # ticket -> JSON {"expires": ..., "cells": [...]}
+
+QUESTION = ''  # Model key of per-question (template-level) counts
+
+Usage = Dict[str, Dict[str, Dict[str, int]]]  # template -> prompt -> model -> ratings
+
+
+def _answer_cells(answer: Dict[str, Any]) -> List[tuple]:
+    # (template, prompt, model) cells an answered question counts towards
+    template = answer.get('original_template_id')
+    prompt = answer.get('prompt_id_selected')
+    rated = answer.get('metrics_rated')
+    if not template or prompt is None or not rated:
+        return []
+    return [(template, str(prompt), QUESTION)] + [(template, str(prompt), model) for model in rated]
+
+
+def has_quotas(question_templates: Iterable[Dict[str, Any]]) -> bool:
+    """
+    Whether any template sets a target count.
+
+    Args:
+        question_templates: Question templates from forum.json
+
+    Returns:
+        True if quotas are configured
+    """
+    return any(t.get('target_count') or t.get('target_per_model') for t in question_templates)
+
+
+def template_total(usage: Usage, template_id: str) -> int:
+    """
+    Answered (and reserved) questions of a template.
+
+    Args:
+        usage: Result of QuotaStore.usage
+        template_id: Template ID
+
+    Returns:
+        Number of questions
+    """
+    return sum(models.get(QUESTION, 0) for models in usage.get(template_id, {}).values())
+
+
+def prompt_needs_ratings(usage: Usage, q_template: Dict[str, Any], prompt_id: str) -> bool:
+    """
+    Whether any (prompt, model) cell of a template is still under 'target_per_model'.
+
+    Args:
+        usage: Result of QuotaStore.usage
+        q_template: Question template
+        prompt_id: Prompt ID
+
+    Returns:
+        True if the prompt should still be presented
+    """
+    target = q_template.get('target_per_model')
+    if not target:
+        return True
+    cells = usage.get(q_template.get('id'), {}).get(prompt_id, {})
+    return any(cells.get(model, 0) < target for model in q_template.get('models', []))
+
+
+def quotas_met(question_templates: List[Dict[str, Any]], usage: Usage,
+               scanned_audio_data: Dict[str, Dict[str, List[str]]]) -> bool:
+    """
+    Whether every template with quotas has reached them (the study is complete).
+
+    Args:
+        question_templates: Question templates from forum.json
+        usage: Result of QuotaStore.usage
+        scanned_audio_data: Result of scan_audio_directory
+
+    Returns:
+        True if no template has items left to rate
+    """
+    for q_template in question_templates:
+        if q_template.get('n_to_present', 0) <= 0:
+            continue
+        target = q_template.get('target_count')
+        if target and template_total(usage, q_template.get('id')) >= target:
+            continue
+        if q_template.get('target_per_model') and not any(
+            prompt_needs_ratings(usage, q_template, p_id)
+            for p_id in scanned_audio_data.get(q_template.get('audioSubfolder'), {})
+        ):
+            continue
+        return False  # Under quota, or no quota at all
+    return True
+
+
+class QuotaStore:
+    """
+    Rating counts and reservations shared by all workers.
+
+    Attributes:
+        backend: Shared state backend
+        reservation_ttl: Seconds an unfinished session holds its questions
+    """
+
+    def __init__(self, backend: StateBackend, reservation_ttl: float = 3600.0):
+        self.backend = backend
+        self.reservation_ttl = reservation_ttl
+
+    def usage(self, include_reservations: bool = True) -> Usage:
+        """
+        Ratings per (template, prompt, model), plus unexpired reservations.
+
+        Args:
+            include_reservations: Count questions assigned to unfinished sessions
+
+        Returns:
+            Nested dictionary {template: {prompt: {model: count}}}; model '' holds
+            the number of answered questions of the prompt
+        """
+        usage: Usage = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+        for field, n in self.backend.hgetall(COUNTS).items():
+            template, prompt, model = split_field(field)
+            usage[template][prompt][model] += int(float(n))
+        if include_reservations:
+            now, expired = time.time(), []
+            for ticket, value in self.backend.hgetall(RESERVATIONS).items():
+                reservation = json.loads(value)
+                if reservation['expires'] < now:
+                    expired.append(ticket)
+                    continue
+                for template, prompt, model in reservation['cells']:
+                    usage[template][prompt][model] += 1
+            if expired:
+                self.backend.hdel(RESERVATIONS, expired)
+        return usage
+
+    def reserve(self, ticket: str, session_questions: List[Dict[str, Any]]) -> None:
+        """
+        Hold the questions assigned to a session until it finishes or expires.
+
+        Args:
+            ticket: Session ticket
+            session_questions: Result of select_and_randomize_questions_for_session
+        """
+        cells = []
+        for instance in session_questions:
+            template, prompt = instance.get('original_question_id'), str(instance.get('promptId'))
+            cells.append((template, prompt, QUESTION))
+            cells.extend((template, prompt, model) for model in instance.get('models', []))
+        reservation = {'expires': time.time() + self.reservation_ttl, 'cells': cells}
+        self.backend.hset(RESERVATIONS, {ticket: json.dumps(reservation)})
+
+    def record(self, answers: Dict[str, Any], ticket: Optional[str] = None) -> int:
+        """
+        Count the answered questions of a finished session and drop its reservations.
+
+        Args:
+            answers: Answers as saved to the result file (keyed by presentation index)
+            ticket: Session ticket whose reservations are released
+
+        Returns:
+            Number of questions counted
+        """
+        cells = [cell for answer in answers.values() for cell in _answer_cells(answer)]
+        increments: Dict[str, float] = defaultdict(float)
+        for cell in cells:
+            increments[join_field(*cell)] += 1
+        self.backend.hincr(COUNTS, increments)
+        if ticket is not None:
+            self.backend.hdel(RESERVATIONS, [ticket])
+        return sum(1 for cell in cells if cell[2] == QUESTION)
+
+    def release(self, ticket: str) -> None:
+        """
+        Drop the reservations of a session without counting its ratings.
+
+        Args:
+            ticket: Session ticket
+        """
+        self.backend.hdel(RESERVATIONS, [ticket])
+
+    def is_empty(self) -> bool:
+        """
+        Whether no rating has been counted yet.
+
+        Returns:
+            True for a new backend
+        """
+        return not self.backend.hgetall(COUNTS)
+
+    def rebuild(self, results_dir: str, excluded: Iterable[str] = ()) -> int:
+        """
+        Recount all ratings from the result files, e.g. when quotas are added mid-study.
+
+        Args:
+            results_dir: Directory of result JSON files
+            excluded: UUIDs of results left out (see utils/screening.py)
+
+        Returns:
+            Number of result files counted
+        """
+        counts: Dict[str, int] = defaultdict(int)
+        files = result_paths(results_dir)
+        excluded = set(excluded)
+        for path in files:
+            try:
+                data = read_result(path)
+            except (OSError, ValueError):
+                continue
+            if excluded and result_uuid(data, path) in excluded:
+                continue
+            answers = data.get('answers', {})
+            for answer in answers.values():
+                for cell in _answer_cells(answer):
+                    counts[join_field(*cell)] += 1
+
+        self.backend.replace(COUNTS, counts)
+        return len(files)
+
+
+def init_quota(app: Flask) -> Optional[QuotaStore]:
+    """
+    Create the app's quota store when a template sets a target count.
+
+    Empty counts are filled from the result files already in RESULTS_DIR,
+    leaving out sessions excluded by screening.
+
+    Args:
+        app: Flask application with FORUM loaded and its state backend
+
+    Returns:
+        The store, also stored as app.extensions['quota'], or None
+    """
+    if not has_quotas(app.config.get('FORUM', {}).get('questions', [])):
+        return None
+
+    store = QuotaStore(app.extensions['state'], app.config['QUOTA_RESERVATION_TTL'])
+    if store.is_empty():
+        screener = app.extensions.get('screening')
+        counted = store.rebuild(app.config['RESULTS_DIR'], screener.excluded() if screener else ())
+        app.logger.info(f"Quota counts rebuilt from {counted} result files")
+    app.extensions['quota'] = store
+    return store
@@ -0,0 +1,335 @@
+"""
+Utility module for rating normalization and inter-rater reliability over all results of a study.
+
+Results are flattened into a long-format RatingsTable: one row per
+(participant, question, model, metric) with integer-coded columns. All
+statistics are computed with numpy group sums (np.bincount) and sparse
+participant x item matrices, so they scale to thousands of raters:
+
+- zscores: ratings standardized per participant and metric, which removes
+  harsh and lenient rating styles before ratings are pooled
+- reliability: Krippendorff's alpha (interval) and the one-way ICC per template
+  and metric, with items = (prompt, model) cells
+- participant_consistency: correlation of every participant's ratings with the
+  mean rating of the other participants on the same items
+
+The one-way ICC is used because participants rate different subsets of the
+items (an incomplete design); two-way ICCs need every rater to rate every item.
+"""
+import math
+from typing import Dict, List, Any, Callable, Iterable, Optional
+
+import numpy as np
+from scipy import sparse
+
+COLUMNS = ('participant', 'template', 'prompt', 'model', 'metric')  # Integer-coded columns
+
+
+class RatingsTable:
+    """
+    Long-format ratings, one row per (participant, question, model, metric).
+
+    Attributes:
+        codes: Column name -> int array of codes into labels[column]
+        labels: Column name -> list of labels
+        rating: Float array of ratings
+        time_spent: Float array of the question's time in seconds (NaN if unknown)
+    """
+
+    def __init__(self, codes: Dict[str, np.ndarray], labels: Dict[str, List[str]],
+                 rating: np.ndarray, time_spent: np.ndarray):
+        self.codes = codes
+        self.labels = labels
+        self.rating = rating
+        self.time_spent = time_spent
+
+    def __len__(self) -> int:
+        return len(self.rating)
+
+    def size(self, column: str) -> int:
+        """
+        Number of distinct labels of a column.
+
+        Args:
+            column: One of COLUMNS
+
+        Returns:
+            Number of labels
+        """
+        return len(self.labels[column])
+
+
+def ratings_table(results: Iterable[Dict[str, Any]],
+                  metric_name: Optional[Callable[[str], str]] = None) -> RatingsTable:
+    """
+    Flatten result dictionaries into a RatingsTable.
+
+    Args:
+        results: Result dictionaries as loaded from the result files
+        metric_name: Maps stored metric names to labels, e.g. translate_metric_name
+
+    Returns:
+        The table; participants are identified by the result UUID
+    """
+    index: Dict[str, Dict[str, int]] = {column: {} for column in COLUMNS}
+    codes: Dict[str, List[int]] = {column: [] for column in COLUMNS}
+    rating, time_spent = [], []
+    metric_codes: Dict[str, int] = {}  # Stored metric name -> code, so metric_name runs once per name
+
+    def code(column, label):
+        return index[column].setdefault(label, len(index[column]))
+
+    for n, result in enumerate(results):
+        participant = code('participant', str(result.get('uuid') or n))
+        for answer in (result.get('answers') or {}).values():
+            metrics_rated = answer.get('metrics_rated')
+            if not metrics_rated:
+                continue
+            template = code('template', str(answer.get('original_template_id', 'unknown')))
+            prompt = code('prompt', str(answer.get('prompt_id_selected', 'unknown')))
+            seconds = answer.get('time_spent_on_question')
+            seconds = float(seconds) if isinstance(seconds, (int, float)) else math.nan
+            for model_name, model_ratings in metrics_rated.items():
+                model = code('model', model_name)
+                k = len(rating)
+                for stored, value in model_ratings.items():
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        continue
+                    if stored not in metric_codes:
+                        metric_codes[stored] = code('metric', metric_name(stored) if metric_name else stored)
+                    codes['metric'].append(metric_codes[stored])
+                    rating.append(float(value))
+                k = len(rating) - k
+                for column, value_code in (('participant', participant), ('template', template),
+                                           ('prompt', prompt), ('model', model)):
+                    codes[column].extend([value_code] * k)
+                time_spent.extend([seconds] * k)
+
+    return RatingsTable(
+        {column: np.asarray(values, dtype=np.int64) for column, values in codes.items()},
+        {column: list(labels) for column, labels in index.items()},
+        np.asarray(rating, dtype=float),
+        np.asarray(time_spent, dtype=float),
+    )
+
+
+def _group_moments(groups: np.ndarray, values: np.ndarray, n_groups: int):
+    # Count, mean and population standard deviation per group
+    count = np.bincount(groups, minlength=n_groups).astype(float)
+    total = np.bincount(groups, weights=values, minlength=n_groups)
+    total_sq = np.bincount(groups, weights=values * values, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0.0))
+    return count, mean, std
+
+
+def zscores(table: RatingsTable, by_metric: bool = True) -> np.ndarray:
+    """
+    Ratings standardized per participant (and metric).
+
+    A participant who gives the same rating everywhere has no spread; their
+    z-scores are 0.
+
+    Args:
+        table: Ratings table
+        by_metric: Standardize every metric separately
+
+    Returns:
+        Float array aligned with table.rating
+    """
+    groups = table.codes['participant']
+    n_groups = table.size('participant')
+    if by_metric:
+        groups = groups * table.size('metric') + table.codes['metric']
+        n_groups *= table.size('metric')
+    _, mean, std = _group_moments(groups, table.rating, n_groups)
+    spread = std[groups]
+    return np.where(spread > 0, (table.rating - mean[groups]) / np.where(spread > 0, spread, 1.0), 0.0)
+
+
+def summarize_by(table: RatingsTable, values: np.ndarray,
+                 columns: Iterable[str] = ('template', 'model', 'metric')) -> List[Dict[str, Any]]:
+    """
+    Mean, standard deviation and 95% confidence interval of values per group.
+
+    Args:
+        table: Ratings table
+        values: Array aligned with table.rating, e.g. the result of zscores
+        columns: Columns to group by
+
+    Returns:
+        One dictionary per group with the column labels, 'count', 'mean', 'std',
+        'ci_low' and 'ci_high' (normal approximation)
+    """
+    columns = list(columns)
+    groups = np.zeros(len(table), dtype=np.int64)
+    for column in columns:
+        groups = groups * table.size(column) + table.codes[column]
+    keys, groups = np.unique(groups, return_inverse=True)
+    count, mean, std = _group_moments(groups, values, len(keys))
+
+    rows = []
+    for g, key in enumerate(keys):
+        labels = []
+        for column in reversed(columns):
+            key, code = divmod(int(key), table.size(column))
+            labels.append(table.labels[column][code])
+        row = dict(zip(columns, reversed(labels)))
+        half = 1.96 * std[g] / math.sqrt(count[g] - 1) if count[g] > 1 else math.nan  # Sample SD
+        row.update(count=int(count[g]), mean=float(mean[g]), std=float(std[g]),
+                   ci_low=float(mean[g] - half), ci_high=float(mean[g] + half))
+        rows.append(row)
+    return rows
+
+
+def rating_matrix(table: RatingsTable, values: Optional[np.ndarray] = None):
+    """
+    Sparse participant x item matrix of ratings.
+
+    Items are (template, metric, prompt, model) cells. A participant who rated a
+    cell more than once gets the mean of their ratings.
+
+    Args:
+        table: Ratings table
+        values: Array aligned with table.rating (default: the ratings)
+
+    Returns:
+        (CSR matrix of cell ratings, int array of the (template, metric) group of
+        each item column, int array of the item column of each table row)
+    """
+    values = table.rating if values is None else values
+    item_key = table.codes['template']
+    for column in ('metric', 'prompt', 'model'):
+        item_key = item_key * table.size(column) + table.codes[column]
+    item_keys, item = np.unique(item_key, return_inverse=True)
+    n_items = len(item_keys)
+
+    # Average repeated ratings of a cell before building the matrix
+    cell_keys, cell = np.unique(table.codes['participant'] * n_items + item, return_inverse=True)
+    cell_count = np.bincount(cell)
+    cell_mean = np.bincount(cell, weights=values) / cell_count
+    matrix = sparse.csr_matrix((cell_mean, (cell_keys // n_items, cell_keys % n_items)),
+                               shape=(table.size('participant'), n_items))
+
+    per_group = table.size('prompt') * table.size('model')
+    item_group = item_keys // per_group  # template * n_metrics + metric
+    return matrix, item_group, item
+
+
+def _item_sums(matrix: sparse.csr_matrix):
+    # Ratings, sum and sum of squares per item column
+    pattern = matrix.copy()
+    pattern.data = np.ones_like(pattern.data)
+    squares = matrix.copy()
+    squares.data = squares.data ** 2
+    return (np.asarray(pattern.sum(axis=0)).ravel(), np.asarray(matrix.sum(axis=0)).ravel(),
+            np.asarray(squares.sum(axis=0)).ravel())
+
+
+def reliability(table: RatingsTable) -> List[Dict[str, Any]]:
+    """
+    Inter-rater reliability per template and metric.
+
+    Only items rated by at least two participants (pairable values) count.
+
+    Args:
+        table: Ratings table
+
+    Returns:
+        One dictionary per (template, metric) with 'raters', 'items', 'ratings',
+        'alpha' (Krippendorff, interval), 'icc1' (single rating) and 'icc1k'
+        (mean rating of an item); NaN when not computable
+    """
+    matrix, item_group, _ = rating_matrix(table)
+    m, s1, s2 = _item_sums(matrix)
+    pairable = m >= 2
+    n_groups = table.size('template') * table.size('metric')
+
+    def per_group(weights):
+        return np.bincount(item_group[pairable], weights=weights[pairable], minlength=n_groups)
+
+    n = per_group(m)
+    total = per_group(s1)
+    total_sq = per_group(s2)
+    items = per_group(np.ones_like(m))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Krippendorff's alpha: 1 - observed / expected disagreement, over ordered pairs
+        within = np.where(pairable, 2 * (m * s2 - s1 * s1) / np.where(pairable, m - 1, 1), 0.0)
+        observed = per_group(within) / n
+        expected = 2 * (n * total_sq - total * total) / (n * (n - 1))
+        alpha = 1 - observed / expected
+
+        # One-way ANOVA with unequal group sizes
+        ss_within = per_group(np.where(pairable, s2 - s1 * s1 / np.where(pairable, m, 1), 0.0))
+        ss_total = total_sq - total * total / n
+        ms_between = (ss_total - ss_within) / (items - 1)
+        ms_within = ss_within / (n - items)
+        k0 = (n - per_group(m * m) / n) / (items - 1)
+        icc1 = (ms_between - ms_within) / (ms_between + (k0 - 1) * ms_within)
+        icc1k = (ms_between - ms_within) / ms_between
+
+    # Raters per group: participants with a rating on a pairable item of the group
+    coo = matrix.tocoo()
+    rated = pairable[coo.col]
+    rater_group = np.unique(item_group[coo.col[rated]] * table.size('participant') + coo.row[rated])
+    raters = np.bincount(rater_group // table.size('participant'), minlength=n_groups)
+
+    rows = []
+    for g in np.flatnonzero(items):
+        template, metric = divmod(int(g), table.size('metric'))
+        rows.append({
+            'template': table.labels['template'][template], 'metric': table.labels['metric'][metric],
+            'raters': int(raters[g]), 'items': int(items[g]), 'ratings': int(n[g]),
+            'alpha': float(alpha[g]), 'icc1': float(icc1[g]), 'icc1k': float(icc1k[g]),
+        })
+    return rows
+
+
+def participant_consistency(table: RatingsTable) -> List[Dict[str, Any]]:
+    """
+    Agreement of every participant with the other participants.
+
+    Each rating is compared with the mean rating of the same item by everyone
+    else (leave-one-out), over items rated by at least two participants.
+
+    Args:
+        table: Ratings table
+
+    Returns:
+        One dictionary per participant with 'ratings', 'compared' (ratings with
+        a leave-one-out mean), 'consistency' (Pearson correlation, NaN when
+        nothing was compared or either side is constant), 'mean_abs_deviation'
+        and 'rating_std'
+    """
+    matrix, _, _ = rating_matrix(table)
+    m, s1, _ = _item_sums(matrix)
+    coo = matrix.tocoo()
+    rater, item, x = coo.row, coo.col, coo.data
+    keep = m[item] >= 2
+    rater, item, x = rater[keep], item[keep], x[keep]
+    y = (s1[item] - x) / (m[item] - 1)
+
+    n_raters = table.size('participant')
+    count = np.bincount(rater, minlength=n_raters).astype(float)
+
+    def total(weights):
+        return np.bincount(rater, weights=weights, minlength=n_raters)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mx, my = total(x) / count, total(y) / count
+        cov = total(x * y) / count - mx * my
+        var_x = total(x * x) / count - mx * mx
+        var_y = total(y * y) / count - my * my
+        correlation = np.where((var_x > 1e-12) & (var_y > 1e-12), cov / np.sqrt(var_x * var_y), np.nan)
+        deviation = total(np.abs(x - y)) / count
+    ratings, _, rating_std = _group_moments(table.codes['participant'], table.rating, n_raters)
+
+    return [
+        {
+            'participant': table.labels['participant'][p], 'ratings': int(ratings[p]), 'compared': int(count[p]),
+            'consistency': float(correlation[p]), 'mean_abs_deviation': float(deviation[p]),
+            'rating_std': float(rating_std[p]),
+        }
+        for p in range(n_raters)
+    ]
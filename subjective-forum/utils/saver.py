@@ -1,21 +1,239 @@
 """
 Utility module for saving participant results atomically.
+
+Results are written in one of two record formats:
+- 'json' (schema 1): the result dictionary as is, indented
+- 'compact' (schema 2): models and metric IDs are interned in per-file
+  dictionaries, every answer stores its ratings as an integer matrix (one row
+  per model in page order, one column per metric), and the JSON has no
+  whitespace. Files can be gzip or zstd compressed (.json.gz, .json.zst).
+
+read_result loads every format and returns the schema 1 dictionary, so the
+rest of the code only knows one layout; convert_results.py rewrites existing
+result directories.
+
+With a shared state backend (see utils/state.py), save_once also stores every
+result in the backend under the participant's session UUID. The first write
+wins, so a retried or duplicated finish request, on this node or another one,
+neither writes a second result nor counts the ratings twice. export_results
+writes the stored results of all nodes as result files.
 """
+import glob
+import gzip
 import json
+import os
 import time
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, List, Any, Optional, Tuple
 from uuid import uuid4
 from datetime import datetime, timezone as dt_timezone # Renamed to avoid conflict if pytz.timezone is used
 import pytz # For timezone conversion
 
+SCHEMA_VERSION = 2  # Schema of the 'compact' record format
+RECORD_FORMATS = ('json', 'compact')
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+RESULT_PATTERNS = ('*.json', '*.json.gz', '*.json.zst')  # Result files in a results directory
+_ANSWER_FIELDS = {  # Schema 1 answer field -> schema 2 field
+    'original_template_id': 'template',
+    'audio_subfolder': 'subfolder',
+    'prompt_id_selected': 'prompt',
+    'time_spent_on_question': 'time',
+}
+
+
+def _zstandard():
+    # zstd support is optional, like the Redis backend
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd result files need the 'zstandard' package (pip install zstandard)") from e
+    return zstandard
+
+
+def encode_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compact (schema 2) record of a result dictionary.
+
+    Args:
+        data: Result dictionary as built by save (schema 1)
+
+    Returns:
+        Record with 'schema', 'dictionaries' ('models', 'metrics') and answers
+        whose 'ratings' rows follow 'models' (codes in page order) and whose
+        columns follow the metric dictionary; missing ratings are null
+    """
+    answers = data.get('answers') or {}
+    models: Dict[str, int] = {}
+    metrics: Dict[str, int] = {name: i for i, name in enumerate(data.get('metrics') or {})}
+    for answer in answers.values():
+        for model in answer.get('models_shuffled_order') or []:
+            models.setdefault(model, len(models))
+        for model, ratings in (answer.get('metrics_rated') or {}).items():
+            models.setdefault(model, len(models))
+            for metric in ratings or {}:
+                metrics.setdefault(metric, len(metrics))
+
+    encoded = {}
+    for key, answer in answers.items():
+        entry = {new: answer[old] for old, new in _ANSWER_FIELDS.items() if old in answer}
+        entry.update({k: v for k, v in answer.items()
+                      if k not in _ANSWER_FIELDS and k not in ('models_shuffled_order', 'metrics_rated')})
+        order = answer.get('models_shuffled_order')
+        rated = answer.get('metrics_rated')
+        if order is not None:
+            entry['models'] = [models[model] for model in order]
+        if rated is None:
+            if 'metrics_rated' in answer:
+                entry['ratings'] = None
+        else:
+            rows = list(order or [])
+            if set(rated) != set(rows):
+                # Rated models differ from the page order; list them explicitly
+                rows = list(rated)
+                entry['rated'] = [models[model] for model in rows]
+            entry['ratings'] = [
+                [_compact_rating((rated.get(model) or {}).get(metric)) for metric in metrics]
+                for model in rows
+            ]
+        encoded[key] = entry
+
+    record = {'schema': SCHEMA_VERSION}
+    record.update({k: v for k, v in data.items() if k != 'answers'})
+    record['dictionaries'] = {'models': list(models), 'metrics': list(metrics)}
+    record['answers'] = encoded
+    return record
+
+
+def _compact_rating(value):
+    # Whole-number ratings are stored as integers
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def decode_result(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Result dictionary (schema 1) of a record in any format.
+
+    Args:
+        record: Parsed result file or backend record
+
+    Returns:
+        The result dictionary; schema 1 records are returned unchanged
+    """
+    if record.get('schema', 1) == 1:
+        return record
+    if record['schema'] > SCHEMA_VERSION:
+        raise ValueError(f"Result schema {record['schema']} is newer than this version ({SCHEMA_VERSION})")
+
+    models = record['dictionaries']['models']
+    metrics = record['dictionaries']['metrics']
+    answers = {}
+    for key, entry in record.get('answers', {}).items():
+        answer = {old: entry[new] for old, new in _ANSWER_FIELDS.items() if new in entry}
+        answer.update({k: v for k, v in entry.items()
+                       if k not in _ANSWER_FIELDS.values() and k not in ('models', 'rated', 'ratings')})
+        order = [models[code] for code in entry['models']] if 'models' in entry else None
+        if order is not None:
+            answer['models_shuffled_order'] = order
+        ratings = entry.get('ratings')
+        if ratings is None:
+            if 'ratings' in entry:
+                answer['metrics_rated'] = None
+        else:
+            rows = [models[code] for code in entry['rated']] if 'rated' in entry else order or []
+            answer['metrics_rated'] = {
+                model: {metric: value for metric, value in zip(metrics, row) if value is not None}
+                for model, row in zip(rows, ratings)
+            }
+        answers[key] = answer
+
+    data = {k: v for k, v in record.items() if k not in ('schema', 'dictionaries', 'answers')}
+    data['answers'] = answers
+    return data
+
+
+def dump_result(data: Dict[str, Any], record_format: str = 'json') -> str:
+    """
+    Serialize a result dictionary.
+
+    Args:
+        data: Result dictionary (schema 1)
+        record_format: 'json' or 'compact'
+
+    Returns:
+        JSON text
+    """
+    if record_format == 'compact':
+        return json.dumps(encode_result(data), ensure_ascii=False, separators=(',', ':'))
+    if record_format == 'json':
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    raise ValueError(f"Unknown result format '{record_format}' (expected one of {', '.join(RECORD_FORMATS)})")
+
+
+def read_result(path: str) -> Dict[str, Any]:
+    """
+    Load a result file of any format and compression.
+
+    Args:
+        path: .json, .json.gz or .json.zst file
+
+    Returns:
+        Result dictionary (schema 1)
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as fp:
+            return decode_result(json.load(fp))
+    if path.endswith('.zst'):
+        with open(path, 'rb') as fp:
+            raw = _zstandard().ZstdDecompressor().stream_reader(fp).read()
+        return decode_result(json.loads(raw.decode('utf-8')))
+    with open(path, 'r', encoding='utf-8') as fp:
+        return decode_result(json.load(fp))
+
+
+def result_paths(results_dir: str) -> List[str]:
+    """
+    Result files of a directory, in all formats.
+
+    Args:
+        results_dir: Results directory
+
+    Returns:
+        Sorted paths; file names start with the time, so this is oldest first
+    """
+    return sorted(path for pattern in RESULT_PATTERNS for path in glob.glob(os.path.join(results_dir, pattern)))
+
+
+def result_filename(timestamp: int, uuid_hex: str, compression: Optional[str] = None) -> str:
+    """
+    File name of a result: its Asia/Taipei time and UUID.
+
+    The name depends only on the stored data, so every node derives the same
+    name for the same session.
+
+    Args:
+        timestamp: Unix timestamp stored in the result
+        uuid_hex: UUID stored in the result
+        compression: None, 'gzip' or 'zstd'
+
+    Returns:
+        File name, e.g. "20250101_120000_<uuid>.json" (".json.gz" with gzip)
+    """
+    taipei_tz = pytz.timezone('Asia/Taipei')
+    formatted = datetime.fromtimestamp(timestamp, dt_timezone.utc).astimezone(taipei_tz).strftime('%Y%m%d_%H%M%S')
+    return f"{formatted}_{uuid_hex}.json{COMPRESSION_SUFFIXES[compression]}"
+
 
 def save(
     participant: Dict[str, Any],
     # answers now contains all details, keyed by presentation index
     answers: Dict[str, Any],
-    out_dir: str = "results"
+    out_dir: str = "results",
     # randomization_details parameter is removed
+    uuid_hex: Optional[str] = None,
+    timestamp: Optional[int] = None,
+    metrics: Optional[Dict[str, str]] = None,
+    record_format: str = 'json',
+    compression: Optional[str] = None
 ) -> str:
     """
     Saves participant data, including answers and their associated randomization details,
@@ -29,27 +247,25 @@ def save(
                  indices (e.g., "0", "1") and values are objects containing
                  metrics rated and randomization details for that question.
         out_dir: Output directory for results (default: "results").
+        uuid_hex: UUID of the result, e.g. the participant's session UUID
+                  (default: a new UUID).
+        timestamp: Unix timestamp of the result (default: now).
+        metrics: Metric ID -> full name of the metric IDs in the answers
+                 (see utils/metric_names.py); omitted when None.
+        record_format: 'json' or 'compact' (see the module docstring).
+        compression: None, 'gzip' or 'zstd'.
                                
     Returns:
         Path to the saved file.
     """
     # Generate UUID for unique filename part
-    uuid_hex = uuid4().hex
-    
-    # Get current time in UTC
-    now_utc = datetime.now(dt_timezone.utc)
-    
-    # Define and convert to Asia/Taipei timezone
-    taipei_tz = pytz.timezone('Asia/Taipei')
-    now_taipei = now_utc.astimezone(taipei_tz)
-    
-    # Format for filename
-    formatted_dt_for_filename = now_taipei.strftime('%Y%m%d_%H%M%S')
-    
-    filename = f"{formatted_dt_for_filename}_{uuid_hex}.json"
+    uuid_hex = uuid_hex or uuid4().hex
     
     # Keep the original Unix timestamp for storing inside the JSON data
-    unix_timestamp_for_json = int(time.time())
+    unix_timestamp_for_json = int(time.time()) if timestamp is None else timestamp
+
+    # Filename from the Asia/Taipei time and the UUID
+    filename = result_filename(unix_timestamp_for_json, uuid_hex, compression)
 
     # Prepare output directory
     output_dir = Path(out_dir)
@@ -62,13 +278,22 @@ def save(
         "timestamp": unix_timestamp_for_json, # Store the precise Unix timestamp
         "uuid": uuid_hex, # Store the UUID hex
     }
+    if metrics is not None:
+        data["metrics"] = metrics
     # The 'answers' dict now contains all necessary details, including randomization.
     # No separate randomization_details key at the top level of the JSON.
     
     # Write to temporary file first
     temp_file = output_dir / f".{filename}.tmp"
-    with temp_file.open("w", encoding="utf-8") as fp:
-        json.dump(data, fp, ensure_ascii=False, indent=2)
+    text = dump_result(data, record_format)
+    if compression == 'gzip':
+        with gzip.open(temp_file, "wt", encoding="utf-8") as fp:
+            fp.write(text)
+    elif compression == 'zstd':
+        temp_file.write_bytes(_zstandard().ZstdCompressor(level=9).compress(text.encode("utf-8")))
+    else:
+        with temp_file.open("w", encoding="utf-8") as fp:
+            fp.write(text)
     
     # Atomically rename to final filename
     final_file = output_dir / filename
@@ -77,15 +302,89 @@ def save(
     return str(final_file)
 
 
+def save_once(
+    backend,
+    participant: Dict[str, Any],
+    answers: Dict[str, Any],
+    out_dir: str,
+    uuid_hex: str,
+    hash_name: str = 'results',
+    metrics: Optional[Dict[str, str]] = None,
+    record_format: str = 'json',
+    compression: Optional[str] = None
+) -> Tuple[str, bool]:
+    """
+    Saves a result unless a result with the same UUID was already stored.
+
+    Args:
+        backend: Shared state backend (utils.state.StateBackend)
+        participant: Participant information dictionary.
+        answers: Dictionary of participant answers (see save).
+        out_dir: Output directory for results.
+        uuid_hex: Session UUID the write is idempotent on.
+        hash_name: Backend hash holding the results ('results' or 'debug_results').
+        metrics: Metric ID -> full name header (see save).
+        record_format: Format of the file and the backend record (see save).
+        compression: Compression of the file (see save).
+
+    Returns:
+        (path of the result file, True if this call saved it); the path of an
+        earlier save may be on another node.
+    """
+    timestamp = int(time.time())
+    data = {"participant": participant, "answers": answers, "timestamp": timestamp, "uuid": uuid_hex}
+    if metrics is not None:
+        data["metrics"] = metrics
+    # The backend record is never indented; with the compact format it is a schema 2 record
+    record = json.dumps(encode_result(data) if record_format == 'compact' else data,
+                        ensure_ascii=False, separators=(',', ':'))
+    if not backend.hsetnx(hash_name, uuid_hex, record):
+        stored = json.loads(backend.hget(hash_name, uuid_hex))
+        return str(Path(out_dir) / result_filename(stored["timestamp"], uuid_hex, compression)), False
+    try:
+        return save(participant, answers, out_dir, uuid_hex, timestamp, metrics, record_format, compression), True
+    except Exception:
+        # Let a retry save it
+        backend.hdel(hash_name, [uuid_hex])
+        raise
+
+
+def export_results(backend, out_dir: str, hash_name: str = 'results', record_format: str = 'json',
+                   compression: Optional[str] = None) -> int:
+    """
+    Writes the results stored in the backend that are missing from a directory.
+
+    Args:
+        backend: Shared state backend (utils.state.StateBackend)
+        out_dir: Output directory for results.
+        hash_name: Backend hash holding the results.
+        record_format: Format of the written files (see save).
+        compression: Compression of the written files (see save).
+
+    Returns:
+        Number of result files written.
+    """
+    written = 0
+    for uuid_hex, value in backend.hgetall(hash_name).items():
+        data = decode_result(json.loads(value))
+        filename = result_filename(data["timestamp"], uuid_hex)
+        # A result counts as present in any compression
+        if any((Path(out_dir) / f"{filename}{suffix}").exists() for suffix in COMPRESSION_SUFFIXES.values()):
+            continue
+        save(data["participant"], data["answers"], out_dir, uuid_hex, data["timestamp"], data.get("metrics"),
+             record_format, compression)
+        written += 1
+    return written
+
+
 def load_results(result_file: str) -> Dict[str, Any]:
     """
     Loads a saved result file.
     
     Args:
-        result_file: Path to the result file
+        result_file: Path to the result file, in any format (see read_result)
         
     Returns:
         Dictionary containing the loaded data
     """
-    with open(result_file, "r", encoding="utf-8") as fp:
-        return json.load(fp)
\ No newline at end of file
+    return read_result(result_file)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+Utility module for screening out low-quality participant sessions as results arrive.
+
+forum.json may set screening rules:
+
+    "screening": {
+        "min_seconds_per_question": 20,
+        "max_fast_fraction": 0.5,
+        "max_straightline_fraction": 0.5,
+        "reference_model": "gt",
+        "max_reference_misrank_fraction": 0.5
+    }
+
+A session is excluded when more than the given fraction of its questions
+- took less than min_seconds_per_question ("fast"),
+- rate every model identically on every metric ("straightline"),
+- rate the hidden reference model below another model on average over the
+  metrics ("reference_misrank"), or
+- have no ratings at all ("unanswered", max_unanswered_fraction).
+Rules that are not set are not checked.
+
+Sessions are screened in api.finish, right after their result is saved. The
+result file is kept, but the ratings of an excluded session are not counted
+towards the quotas or the adaptive statistics. Its quota reservation is
+released, so its prompts are assigned to the next participants instead.
+Verdicts live in the shared state backend, and analyze_results.py --screening
+applies the same rules offline.
+"""
+import json
+import os
+from typing import Dict, List, Any, Iterable, Optional, Set
+
+from flask import Flask
+
+from utils.saver import read_result, result_paths
+from utils.state import StateBackend
+
+VERDICTS = 'screening:verdicts'  # result UUID -> JSON {"excluded": bool, "reasons": [...]}
+
+RULES = {
+    'min_seconds_per_question': None,  # Seconds below which a question counts as fast
+    'max_fast_fraction': 0.5,
+    'max_straightline_fraction': None,
+    'reference_model': None,  # Hidden reference, e.g. "gt"
+    'max_reference_misrank_fraction': 0.5,
+    'max_unanswered_fraction': None,
+}
+
+
+def _question_flags(answer: Dict[str, Any], rules: Dict[str, Any]) -> Dict[str, bool]:
+    # Which rules a single answered question breaks
+    rated = answer.get('metrics_rated')
+    if not rated:
+        return {'unanswered': True}
+
+    flags = {}
+    min_seconds = rules.get('min_seconds_per_question')
+    seconds = answer.get('time_spent_on_question')
+    if min_seconds is not None and isinstance(seconds, (int, float)):
+        flags['fast'] = seconds < min_seconds
+
+    values = [value for ratings in rated.values() for value in ratings.values()]
+    if len(rated) > 1 and values:
+        flags['straightline'] = len(set(values)) == 1
+
+    reference = rules.get('reference_model')
+    if reference and reference in rated and len(rated) > 1:
+        means = {model: sum(ratings.values()) / len(ratings) for model, ratings in rated.items() if ratings}
+        others = [mean for model, mean in means.items() if model != reference]
+        if reference in means and others:
+            flags['reference_misrank'] = means[reference] < max(others)
+    return flags
+
+
+def screen_result(data: Dict[str, Any], rules: Dict[str, Any]) -> List[str]:
+    """
+    Reasons to exclude a saved result.
+
+    Args:
+        data: Result dictionary as saved by utils.saver
+        rules: The "screening" section of forum.json
+
+    Returns:
+        List of reasons, e.g. ["fast: 3/4 questions"]; empty if the result passes
+    """
+    rules = {**RULES, **rules}
+    answers = list((data.get('answers') or {}).values())
+    if not answers:
+        return ['unanswered: no questions']
+
+    limits = {
+        'fast': rules['max_fast_fraction'] if rules['min_seconds_per_question'] is not None else None,
+        'straightline': rules['max_straightline_fraction'],
+        'reference_misrank': rules['max_reference_misrank_fraction'] if rules['reference_model'] else None,
+        'unanswered': rules['max_unanswered_fraction'],
+    }
+    counts = {rule: 0 for rule in limits}
+    checked = {rule: 0 for rule in limits}
+    for answer in answers:
+        flags = _question_flags(answer, rules)
+        for rule in limits:
+            if rule in flags:
+                checked[rule] += 1
+                counts[rule] += flags[rule]
+            elif rule == 'unanswered':
+                checked[rule] += 1
+
+    return [
+        f"{rule}: {counts[rule]}/{checked[rule]} questions"
+        for rule, limit in limits.items()
+        if limit is not None and checked[rule] and counts[rule] / checked[rule] > limit
+    ]
+
+
+class Screener:
+    """
+    Screens finished sessions and remembers the verdicts across workers.
+
+    Attributes:
+        backend: Shared state backend
+        rules: Screening rules from forum.json
+    """
+
+    def __init__(self, backend: StateBackend, rules: Dict[str, Any]):
+        self.backend = backend
+        self.rules = rules
+
+    def screen(self, uuid_hex: str, data: Dict[str, Any]) -> List[str]:
+        """
+        Screen a saved result and store the verdict.
+
+        Args:
+            uuid_hex: Result UUID
+            data: Result dictionary (at least 'answers')
+
+        Returns:
+            Reasons to exclude the result; empty if it is accepted
+        """
+        reasons = screen_result(data, self.rules)
+        self.backend.hset(VERDICTS, {uuid_hex: json.dumps({'excluded': bool(reasons), 'reasons': reasons})})
+        return reasons
+
+    def excluded(self) -> Set[str]:
+        """
+        UUIDs of all excluded results.
+
+        Returns:
+            Set of result UUIDs
+        """
+        return {uuid_hex for uuid_hex, value in self.backend.hgetall(VERDICTS).items()
+                if json.loads(value)['excluded']}
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Screening summary for /admin/screening.
+
+        Returns:
+            Dictionary with 'rules', 'screened', 'excluded' and the reasons per
+            excluded result UUID
+        """
+        verdicts = {uuid_hex: json.loads(value) for uuid_hex, value in self.backend.hgetall(VERDICTS).items()}
+        excluded = {uuid_hex: v['reasons'] for uuid_hex, v in verdicts.items() if v['excluded']}
+        return {'rules': {**RULES, **self.rules}, 'screened': len(verdicts), 'excluded': len(excluded),
+                'reasons': excluded}
+
+    def is_empty(self) -> bool:
+        """
+        Whether no result has been screened yet.
+
+        Returns:
+            True for a new backend
+        """
+        return not self.backend.hgetall(VERDICTS)
+
+    def rebuild(self, results_dir: str) -> int:
+        """
+        Screen all result files again, e.g. when screening is added mid-study.
+
+        Args:
+            results_dir: Directory of result JSON files
+
+        Returns:
+            Number of result files screened
+        """
+        verdicts = {}
+        for path in result_paths(results_dir):
+            try:
+                data = read_result(path)
+            except (OSError, ValueError):
+                continue
+            reasons = screen_result(data, self.rules)
+            verdicts[result_uuid(data, path)] = json.dumps({'excluded': bool(reasons), 'reasons': reasons})
+        self.backend.replace(VERDICTS, verdicts)
+        return len(verdicts)
+
+
+def result_uuid(data: Dict[str, Any], path: str) -> str:
+    """
+    UUID of a result file.
+
+    Args:
+        data: Result dictionary
+        path: Path of the result file, "<date>_<time>_<uuid>.json" (or .json.gz, .json.zst)
+
+    Returns:
+        The stored UUID, or the one in the file name for old results
+    """
+    return data.get('uuid') or os.path.basename(path).split('.', 1)[0].rsplit('_', 1)[-1]
+
+
+def filter_results(results: Iterable[Dict[str, Any]], rules: Dict[str, Any]) -> tuple:
+    """
+    Split results into accepted and excluded ones.
+
+    Args:
+        results: Result dictionaries
+        rules: Screening rules
+
+    Returns:
+        (accepted results, list of (result, reasons))
+    """
+    accepted, excluded = [], []
+    for data in results:
+        reasons = screen_result(data, rules)
+        if reasons:
+            excluded.append((data, reasons))
+        else:
+            accepted.append(data)
+    return accepted, excluded
+
+
+def init_screening(app: Flask) -> Optional[Screener]:
+    """
+    Create the app's screener when forum.json has a "screening" section.
+
+    Result files without a verdict are screened at startup, so the quotas and
+    adaptive statistics rebuilt from them leave excluded sessions out.
+
+    Args:
+        app: Flask application with FORUM loaded and its state backend
+
+    Returns:
+        The screener, also stored as app.extensions['screening'], or None
+    """
+    rules = app.config.get('FORUM', {}).get('screening')
+    if not rules:
+        return None
+    unknown = set(rules) - set(RULES)
+    if unknown:
+        app.logger.warning(f"Unknown screening rules ignored: {sorted(unknown)}")
+
+    screener = Screener(app.extensions['state'], {k: v for k, v in rules.items() if k in RULES})
+    if screener.is_empty():
+        screened = screener.rebuild(app.config['RESULTS_DIR'])
+        app.logger.info(f"Screened {screened} existing result files")
+    app.extensions['screening'] = screener
+    return screener
@@ -0,0 +1,152 @@
+"""
+Session interface that keeps lightweight routes from loading or rewriting the session cookie.
+
+Flask's default cookie session is decoded on every request and, for permanent
+sessions, re-signed and re-sent on every response. For the listening test this
+means every heartbeat and every audio/static fetch pays for a full session
+round trip. This module skips the session entirely for those routes and only
+refreshes the cookie when it is actually needed.
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Optional
+
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+
+class ForumSession(SecureCookieSession):
+    """
+    Cookie session that remembers when its cookie was last signed.
+
+    Attributes:
+        issued_at: Time the incoming cookie was signed (None for new sessions)
+        touch_only: True for keep-alive requests where the payload is never decoded
+        raw_payload: Signed-but-undecoded cookie payload, kept for touch-only refreshes
+    """
+    issued_at: Optional[datetime] = None
+    touch_only: bool = False
+    raw_payload: Optional[bytes] = None
+
+
+class LightweightSessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie session interface with three request classes:
+
+    - skip paths (audio, static): no session is opened and nothing is saved.
+    - touch paths (heartbeat): the signature is checked but the payload is not
+      decoded; the cookie is re-signed only when it is older than
+      SESSION_REFRESH_AFTER seconds, which extends its lifetime cheaply.
+    - everything else: normal session, but the cookie is only re-sent when the
+      session was modified or is due for a refresh.
+    """
+    session_class = ForumSession
+
+    def __init__(self):
+        self._stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Snapshot of session handling counters for this process.
+
+        Returns:
+            Dictionary with counts of skipped, touched, refreshed, written and avoided writes
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def _matches(path: str, prefixes) -> bool:
+        return any(path.startswith(prefix) for prefix in prefixes)
+
+    @staticmethod
+    def _refresh_due(app, issued_at: Optional[datetime]) -> bool:
+        if issued_at is None:
+            return True
+        age = (datetime.now(dt_timezone.utc) - issued_at).total_seconds()
+        return age >= app.config.get('SESSION_REFRESH_AFTER', 600)
+
+    def open_session(self, app, request):
+        path = request.path
+
+        # Audio and static files never read the session: use Flask's null session,
+        # which also means save_session() is never called for them.
+        if self._matches(path, app.config.get('SESSION_SKIP_PREFIXES', ())):
+            self._count('skipped')
+            return None
+
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        val = request.cookies.get(self.get_cookie_name(app))
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+
+        # Keep-alive requests: verify the signature and remember the raw payload
+        # without deserializing it.
+        if self._matches(path, app.config.get('SESSION_TOUCH_PATHS', ())):
+            session = self.session_class()
+            session.touch_only = True
+            if val:
+                try:
+                    signer = s.make_signer(s.salt)
+                    session.raw_payload, session.issued_at = signer.unsign(
+                        val, max_age=max_age, return_timestamp=True
+                    )
+                except BadSignature:
+                    pass
+            self._count('touched')
+            return session
+
+        if not val:
+            return self.session_class()
+        try:
+            data, issued_at = s.loads(val, max_age=max_age, return_timestamp=True)
+        except BadSignature:
+            return self.session_class()
+        session = self.session_class(data)
+        session.issued_at = issued_at
+        return session
+
+    def should_set_cookie(self, app, session) -> bool:
+        if session.modified:
+            return True
+        if not session.permanent:
+            return False
+        return app.config['SESSION_REFRESH_EACH_REQUEST'] or self._refresh_due(
+            app, getattr(session, 'issued_at', None)
+        )
+
+    def save_session(self, app, session, response) -> None:
+        if getattr(session, 'touch_only', False):
+            if session.raw_payload is None or not self._refresh_due(app, session.issued_at):
+                self._count('avoided')
+                return
+
+            # Re-sign the untouched payload with a fresh timestamp. The app marks
+            # every participant session permanent, so the cookie keeps a full lifetime.
+            s = self.get_signing_serializer(app)
+            val = s.make_signer(s.salt).sign(session.raw_payload).decode('utf-8')
+            response.set_cookie(
+                self.get_cookie_name(app),
+                val,
+                expires=datetime.now(dt_timezone.utc) + app.permanent_session_lifetime,
+                httponly=self.get_cookie_httponly(app),
+                domain=self.get_cookie_domain(app),
+                path=self.get_cookie_path(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+            self._count('refreshed')
+            return
+
+        if session and self.should_set_cookie(app, session):
+            self._count('written')
+        elif session:
+            self._count('avoided')
+        super().save_session(app, session, response)
@@ -0,0 +1,186 @@
+"""
+Utility module for preparing audio data at startup, optionally in the background.
+
+Scanning the audio tree, loading the variant manifest, indexing clip durations
+and validating the question templates can take seconds on large or network
+mounted trees. With AUDIO_INIT_BACKGROUND the app starts serving immediately and
+does this work in a thread; /healthz reports 503 until it has finished, and
+routes that need the audio data wait for it (see wait_until_ready).
+
+With AUDIO_SHARED_CACHE (set by create_multi_app), the scanned audio tree, the
+variant manifest and the index are computed once per process for each audio
+root and shared by every study that uses it.
+"""
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from flask import Flask
+
+READY_EXTENSION = 'audio_ready'
+
+# Audio data shared by the apps of one process, keyed by (audio root, variants root, indexed)
+_shared_audio: Dict[tuple, Dict[str, Any]] = {}
+_shared_audio_locks: Dict[tuple, threading.Lock] = {}
+_shared_audio_guard = threading.Lock()
+
+
+def _load_audio(app: Flask, audio_root: str, variants_root: Optional[str]) -> Dict[str, Any]:
+    # Scan, variants and index of one audio root; independent of the question templates
+    from utils.loader import scan_audio_directory
+    from utils.audio_variants import load_variant_manifest
+    from utils.audio_index import build_audio_index, exclude_corrupt_clips
+
+    scanned = scan_audio_directory(audio_root)
+
+    # Load pre-transcoded variants (see transcode_audio.py), if configured
+    variants = load_variant_manifest(variants_root)
+    if variants:
+        app.logger.info(f"Loaded audio variants for {len(variants)} clips")
+
+    # Index clip durations and checksums
+    index = {}
+    if app.config['AUDIO_INDEX_ENABLED']:
+        cache_path = app.config['AUDIO_INDEX_CACHE'] or os.path.join(app.instance_path, 'audio_index.json')
+        index = build_audio_index(audio_root, cache_path, app.config['AUDIO_INDEX_WORKERS'])
+
+    # Never assign prompts whose clips cannot be decoded; validation still sees the full scan
+    models = {subfolder: {p_id: list(tags) for p_id, tags in prompts.items()} for subfolder, prompts in scanned.items()}
+    removed = exclude_corrupt_clips(models, index)
+    if index:
+        app.logger.info(f"Indexed {len(index)} audio clips ({removed} unreadable, excluded)")
+    return {'scanned': scanned, 'models': models, 'variants': variants, 'index': index}
+
+
+def _shared_audio_data(app: Flask, audio_root: str, variants_root: Optional[str]) -> Dict[str, Any]:
+    # _load_audio once per process and key; concurrent studies wait for the first
+    key = (
+        os.path.abspath(audio_root),
+        os.path.abspath(variants_root) if variants_root else None,
+        bool(app.config['AUDIO_INDEX_ENABLED']),
+    )
+    with _shared_audio_guard:
+        lock = _shared_audio_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key in _shared_audio:
+            app.logger.info(f"Reusing audio data of {audio_root} shared with another study")
+        else:
+            _shared_audio[key] = _load_audio(app, audio_root, variants_root)
+        return _shared_audio[key]
+
+
+def prepare_audio(app: Flask) -> None:
+    """
+    Scan, index and validate the audio for the forum configuration.
+
+    Results are published to app.config (AUDIO_MODELS, AUDIO_VARIANTS,
+    AUDIO_INDEX, AUDIO_ERRORS) only once everything is computed, so requests
+    never see a half-built state.
+
+    Args:
+        app: Flask application with FORUM already loaded
+    """
+    from utils.loader import validate_questions
+    from utils.audio_index import validate_audio_index
+
+    started = time.perf_counter()
+    forum_config = app.config.get('FORUM', {})
+    if not forum_config:
+        return  # Configuration failed to load; keep the empty audio data
+    questions = forum_config.get('questions', [])
+
+    audio_root = forum_config.get('audioRoot', 'static/audio')
+    variants_root = forum_config.get('audioVariantsRoot')
+    if app.config.get('AUDIO_SHARED_CACHE'):
+        audio = _shared_audio_data(app, audio_root, variants_root)
+    else:
+        audio = _load_audio(app, audio_root, variants_root)
+
+    # Validate questions
+    errors = validate_questions(questions, audio['scanned'])
+    errors += validate_audio_index(questions, audio['scanned'], audio['index'], app.config['AUDIO_DURATION_TOLERANCE'])
+    if errors:
+        app.logger.error("Forum configuration validation errors:")
+        for error in errors:
+            app.logger.error(f"- {error}")
+
+    app.config.update(
+        AUDIO_MODELS=audio['models'],
+        AUDIO_VARIANTS=audio['variants'],
+        AUDIO_INDEX=audio['index'],
+        AUDIO_ERRORS=errors,
+    )
+    app.logger.info(f"Audio prepared in {time.perf_counter() - started:.2f}s")
+
+
+def start_audio_preparation(app: Flask, background: bool) -> threading.Event:
+    """
+    Run prepare_audio now or in a daemon thread, and track readiness.
+
+    Under a preloading server (gunicorn preload_app) this must run synchronously:
+    threads do not survive the fork into workers.
+
+    Args:
+        app: Flask application
+        background: Prepare in a thread instead of before returning
+
+    Returns:
+        Event that is set once the audio data is available
+    """
+    ready = threading.Event()
+    app.extensions[READY_EXTENSION] = ready
+
+    def run():
+        try:
+            prepare_audio(app)
+        except Exception as e:
+            # Serve with empty audio data rather than never becoming ready
+            app.logger.error(f"Error preparing audio: {e}")
+            app.config['AUDIO_ERRORS'] = [str(e)]
+        finally:
+            ready.set()
+        # Start warming the clips of the likely prompts (see utils/warmer.py)
+        if app.extensions.get('warmer') is not None:
+            from utils.warmer import warm_likely
+            try:
+                warm_likely(app)
+            except Exception as e:
+                app.logger.error(f"Error planning audio warming: {e}")
+
+    if background:
+        threading.Thread(target=run, name='forum-audio-init', daemon=True).start()
+    else:
+        run()
+    return ready
+
+
+def is_ready(app: Flask) -> bool:
+    """
+    Whether startup audio preparation has finished.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        True once the audio data is available
+    """
+    ready = app.extensions.get(READY_EXTENSION)
+    return ready is None or ready.is_set()
+
+
+def wait_until_ready(app: Flask, timeout: Optional[float] = None) -> bool:
+    """
+    Block until startup audio preparation has finished.
+
+    Args:
+        app: Flask application
+        timeout: Maximum seconds to wait (None: AUDIO_READY_TIMEOUT)
+
+    Returns:
+        True if ready, False on timeout
+    """
+    ready = app.extensions.get(READY_EXTENSION)
+    if ready is None:
+        return True
+    return ready.wait(app.config.get('AUDIO_READY_TIMEOUT', 30) if timeout is None else timeout)
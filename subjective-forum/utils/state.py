@@ -0,0 +1,414 @@
+"""
+Utility module for the shared state behind admission, quotas, adaptive scheduling and results.
+
+Everything that must agree across workers, and across nodes in a scale-out
+deployment, goes through a StateBackend: a store of named hashes (field -> text
+value) with atomic increments, set-if-absent and a named lock. Backends:
+
+- 'sqlite:///path' (default: <instance>/state.sqlite3): shared by the workers
+  of one node
+- 'redis://host:6379/0': shared by several nodes behind a load balancer
+  (needs the optional `redis` package)
+- 'memory://': one process only; the stand-in for tests
+
+Session data stays in the signed session cookie (see utils/session.py), so any
+node with the same SECRET_KEY can serve any request of a participant's session.
+"""
+import copy
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from flask import Flask
+
+PREFIX = 'forum:'  # Name prefix of process-wide state; studies add their name
+FIELD_SEP = '\x1f'  # Joins the parts of a composite hash field
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (name TEXT, field TEXT, value TEXT, PRIMARY KEY (name, field));
+"""
+
+
+def join_field(*parts: str) -> str:
+    """
+    Composite hash field, e.g. (template, prompt, model).
+
+    Args:
+        *parts: Field parts
+
+    Returns:
+        Field string
+    """
+    return FIELD_SEP.join(str(part) for part in parts)
+
+
+def split_field(field: str) -> tuple:
+    """
+    Parts of a composite hash field.
+
+    Args:
+        field: Result of join_field
+
+    Returns:
+        Tuple of parts
+    """
+    return tuple(field.split(FIELD_SEP))
+
+
+class StateBackend:
+    """
+    Named hashes shared by all workers (and nodes) of a deployment.
+
+    Subclasses implement the primitives below. Every name is prefixed with
+    `prefix`, so several studies can share one backend.
+
+    Attributes:
+        prefix: Prefix of all hash names
+        shared_across_nodes: Whether other machines see the same state
+    """
+
+    shared_across_nodes = False
+
+    def __init__(self, prefix: str = PREFIX):
+        self.prefix = prefix
+
+    def with_prefix(self, prefix: str) -> 'StateBackend':
+        """
+        View of the same store under another name prefix.
+
+        Args:
+            prefix: Prefix of all hash names, e.g. PREFIX for process-wide state
+
+        Returns:
+            Backend sharing this one's connections
+        """
+        view = copy.copy(self)
+        view.prefix = prefix
+        return view
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        """
+        Value of one field.
+
+        Args:
+            name: Hash name
+            field: Field
+
+        Returns:
+            Value, or None if the field does not exist
+        """
+        raise NotImplementedError
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        """
+        All fields of a hash.
+
+        Args:
+            name: Hash name
+
+        Returns:
+            Dictionary of field -> value (empty for a missing hash)
+        """
+        raise NotImplementedError
+
+    def hset(self, name: str, mapping: Dict[str, str]) -> None:
+        """
+        Set several fields.
+
+        Args:
+            name: Hash name
+            mapping: Field -> value
+        """
+        raise NotImplementedError
+
+    def hsetnx(self, name: str, field: str, value: str) -> bool:
+        """
+        Set a field unless it exists, atomically across workers and nodes.
+
+        Args:
+            name: Hash name
+            field: Field
+            value: Value
+
+        Returns:
+            True if the field was set, False if it already existed
+        """
+        raise NotImplementedError
+
+    def hdel(self, name: str, fields: Iterable[str]) -> None:
+        """
+        Remove fields.
+
+        Args:
+            name: Hash name
+            fields: Fields to remove
+        """
+        raise NotImplementedError
+
+    def hincr(self, name: str, increments: Dict[str, float]) -> None:
+        """
+        Add to numeric fields in one atomic step; missing fields count as 0.
+
+        Args:
+            name: Hash name
+            increments: Field -> amount
+        """
+        raise NotImplementedError
+
+    def replace(self, name: str, mapping: Dict[str, str]) -> None:
+        """
+        Replace the whole hash in one atomic step.
+
+        Args:
+            name: Hash name
+            mapping: New field -> value
+        """
+        raise NotImplementedError
+
+    def lock(self, name: str, timeout: float = 10.0):
+        """
+        Context manager holding a lock shared by all workers (and nodes).
+
+        Args:
+            name: Lock name
+            timeout: Seconds to wait for the lock
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(StateBackend):
+    """
+    In-process backend for tests and single-process development servers.
+    """
+
+    def __init__(self, prefix: str = PREFIX):
+        super().__init__(prefix)
+        self._hashes: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self._lock = threading.RLock()
+
+    def hget(self, name, field):
+        with self._lock:
+            return self._hashes[self.prefix + name].get(field)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._hashes[self.prefix + name])
+
+    def hset(self, name, mapping):
+        with self._lock:
+            self._hashes[self.prefix + name].update({k: str(v) for k, v in mapping.items()})
+
+    def hsetnx(self, name, field, value):
+        with self._lock:
+            values = self._hashes[self.prefix + name]
+            if field in values:
+                return False
+            values[field] = str(value)
+            return True
+
+    def hdel(self, name, fields):
+        with self._lock:
+            values = self._hashes[self.prefix + name]
+            for field in fields:
+                values.pop(field, None)
+
+    def hincr(self, name, increments):
+        with self._lock:
+            values = self._hashes[self.prefix + name]
+            for field, amount in increments.items():
+                values[field] = repr(float(values.get(field, 0)) + amount)
+
+    def replace(self, name, mapping):
+        with self._lock:
+            self._hashes[self.prefix + name] = {k: str(v) for k, v in mapping.items()}
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        with self._lock:
+            yield
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Backend in one SQLite file, shared by the worker processes of one node.
+
+    Attributes:
+        db_path: SQLite database file
+    """
+
+    def __init__(self, db_path: str, prefix: str = PREFIX):
+        super().__init__(prefix)
+        self.db_path = db_path
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def hget(self, name, field):
+        row = self._connection().execute('SELECT value FROM hashes WHERE name = ? AND field = ?',
+                                         (self.prefix + name, field)).fetchone()
+        return row[0] if row else None
+
+    def hgetall(self, name):
+        return dict(self._connection().execute('SELECT field, value FROM hashes WHERE name = ?', (self.prefix + name,)))
+
+    def hset(self, name, mapping):
+        self._connection().executemany(
+            'INSERT INTO hashes VALUES (?, ?, ?) ON CONFLICT(name, field) DO UPDATE SET value = excluded.value',
+            [(self.prefix + name, field, str(value)) for field, value in mapping.items()]
+        )
+
+    def hsetnx(self, name, field, value):
+        cursor = self._connection().execute('INSERT OR IGNORE INTO hashes VALUES (?, ?, ?)',
+                                            (self.prefix + name, field, str(value)))
+        return cursor.rowcount == 1
+
+    def hdel(self, name, fields):
+        self._connection().executemany('DELETE FROM hashes WHERE name = ? AND field = ?',
+                                       [(self.prefix + name, field) for field in fields])
+
+    def hincr(self, name, increments):
+        with self.lock(name):
+            self._connection().executemany(
+                'INSERT INTO hashes VALUES (?, ?, ?) ON CONFLICT(name, field) '
+                'DO UPDATE SET value = CAST(value AS REAL) + CAST(excluded.value AS REAL)',
+                [(self.prefix + name, field, repr(float(amount))) for field, amount in increments.items()]
+            )
+
+    def replace(self, name, mapping):
+        with self.lock(name):
+            self._connection().execute('DELETE FROM hashes WHERE name = ?', (self.prefix + name,))
+            self.hset(name, mapping)
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        # A write transaction serializes all workers; nested locks join the open one
+        conn = self._connection()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend on a Redis server, shared by every node of a scale-out deployment.
+
+    Attributes:
+        url: Redis URL, e.g. redis://localhost:6379/0
+    """
+
+    shared_across_nodes = True
+
+    def __init__(self, url: str, prefix: str = PREFIX):
+        super().__init__(prefix)
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND is a Redis URL but the 'redis' package is not installed "
+                               "(pip install redis)") from e
+        self.url = url
+        # redis-py reconnects by itself after a fork
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def hget(self, name, field):
+        return self.client.hget(self.prefix + name, field)
+
+    def hgetall(self, name):
+        return self.client.hgetall(self.prefix + name)
+
+    def hset(self, name, mapping):
+        if mapping:
+            self.client.hset(self.prefix + name, mapping={k: str(v) for k, v in mapping.items()})
+
+    def hsetnx(self, name, field, value):
+        return bool(self.client.hsetnx(self.prefix + name, field, str(value)))
+
+    def hdel(self, name, fields):
+        fields = list(fields)
+        if fields:
+            self.client.hdel(self.prefix + name, *fields)
+
+    def hincr(self, name, increments):
+        pipe = self.client.pipeline(transaction=True)
+        for field, amount in increments.items():
+            pipe.hincrbyfloat(self.prefix + name, field, amount)
+        pipe.execute()
+
+    def replace(self, name, mapping):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self.prefix + name)
+        if mapping:
+            pipe.hset(self.prefix + name, mapping={k: str(v) for k, v in mapping.items()})
+        pipe.execute()
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        with self.client.lock(f"{self.prefix}lock:{name}", timeout=timeout, blocking_timeout=timeout):
+            yield
+
+
+def open_backend(url: str, prefix: str = PREFIX) -> StateBackend:
+    """
+    Backend for a STATE_BACKEND URL.
+
+    Args:
+        url: 'sqlite:///relative/path', 'sqlite:////absolute/path', 'memory://'
+            or a redis:// / rediss:// URL
+        prefix: Prefix of all hash names
+
+    Returns:
+        The backend
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], prefix)
+    if url.startswith('memory://'):
+        return MemoryBackend(prefix)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url, prefix)
+    raise ValueError(f"Unknown STATE_BACKEND '{url}' (expected sqlite:///, memory:// or redis://)")
+
+
+def init_state(app: Flask) -> StateBackend:
+    """
+    Create the app's shared state backend from STATE_BACKEND.
+
+    A StateBackend instance may be given directly, e.g. one MemoryBackend shared
+    by several test apps standing in for nodes.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        The backend, also stored as app.extensions['state']
+    """
+    backend = app.config['STATE_BACKEND']
+    if not isinstance(backend, StateBackend):
+        url = backend or f"sqlite:///{os.path.join(app.instance_path, 'state.sqlite3')}"
+        study = app.config.get('STUDY_NAME')
+        backend = open_backend(url, f"{PREFIX}{study}:" if study else PREFIX)
+    if backend.shared_across_nodes and app.config['SECRET_KEY'] == 'dev':
+        app.logger.warning("Scale-out state backend with the default SECRET_KEY: set the same "
+                           "secret SECRET_KEY on every node so any node accepts the session cookie")
+    app.extensions['state'] = backend
+    app.logger.info(f"Shared state backend: {type(backend).__name__}")
+    return backend
@@ -0,0 +1,291 @@
+"""
+Utility module for client-side timing telemetry (audio load, decode, stalls, page time).
+
+The questions page sends batches of events to /api/telemetry (usually with
+navigator.sendBeacon when the page is hidden). Events are validated, aggregated
+in memory per clip and per network class (navigator.connection.effectiveType)
+for live percentiles, and appended to telemetry_<pid>.jsonl files so that
+analyze_results.py --telemetry can aggregate all workers offline.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List, Any, Callable, Iterable, Optional
+
+# Numeric event fields: milliseconds unless noted
+CLIP_FIELDS = ('ttfb', 'load', 'decode', 'stalls', 'stallMs', 'bytes')  # stalls: count, bytes: transfer size
+PAGE_FIELDS = ('pageTime',)
+PERCENTILES = (50, 90, 99)
+
+NETWORK_CLASSES = {'slow-2g', '2g', '3g', '4g', 'unknown'}
+MAX_EVENTS_PER_BATCH = 100
+MAX_TEXT_LENGTH = 200
+MAX_KEYS = 5000  # Clips (or networks) with live percentiles per process; later ones count as OTHER_KEY
+OTHER_KEY = 'other'
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not math.isfinite(value) or value < 0:
+        return None
+    return float(value)
+
+
+def _text(value: Any) -> Optional[str]:
+    if not isinstance(value, str) or not value or len(value) > MAX_TEXT_LENGTH:
+        return None
+    return value
+
+
+def known_clip(audio_models: Dict[str, Dict[str, List[str]]], clip: str) -> bool:
+    """
+    Whether a clip name is one of the scanned audio files.
+
+    Args:
+        audio_models: Scanned audio (AUDIO_MODELS): subfolder -> prompt ID -> model tags
+        clip: Clip path relative to the audio root, e.g. "task_1/001_gt.mp3"
+
+    Returns:
+        True if the clip exists in the scan
+    """
+    subfolder, _, filename = clip.rpartition('/')
+    stem, extension = os.path.splitext(filename)
+    prompt_id, _, tag = stem.partition('_')
+    return extension == '.mp3' and tag in audio_models.get(subfolder, {}).get(prompt_id, ())
+
+
+def normalize_batch(payload: Any, is_known_clip: Optional[Callable[[str], bool]] = None) -> List[Dict[str, Any]]:
+    """
+    Validate a telemetry batch from the client and flatten it into events.
+
+    Unknown fields are dropped, negative or non-numeric timings are ignored and
+    at most MAX_EVENTS_PER_BATCH events are accepted.
+
+    Args:
+        payload: Decoded JSON body {"network": "4g", "events": [{...}, ...]}
+        is_known_clip: Filter for clip names, e.g. known_clip over AUDIO_MODELS;
+            clip events of other names are dropped. The endpoint needs no
+            session, so clip names must not come from the client unchecked.
+
+    Returns:
+        List of clean event dictionaries, each with 'type' and 'network'
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('events'), list):
+        return []
+    network = payload.get('network')
+    if network not in NETWORK_CLASSES:
+        network = 'unknown'
+
+    events = []
+    for raw in payload['events'][:MAX_EVENTS_PER_BATCH]:
+        if not isinstance(raw, dict):
+            continue
+        event_type = raw.get('type')
+        if event_type == 'clip':
+            clip = _text(raw.get('clip'))
+            if clip is None or (is_known_clip is not None and not is_known_clip(clip)):
+                continue
+            event = {'type': 'clip', 'clip': clip, 'network': network}
+            fields = CLIP_FIELDS
+        elif event_type == 'page':
+            event = {'type': 'page', 'network': network}
+            fields = PAGE_FIELDS
+        else:
+            continue
+
+        for key in ('template', 'prompt', 'format'):
+            text = _text(raw.get(key))
+            if text is not None:
+                event[key] = text
+        question = raw.get('question')
+        if isinstance(question, int) and not isinstance(question, bool) and question >= 0:
+            event['question'] = question
+        for field in fields:
+            value = _number(raw.get(field))
+            if value is not None:
+                event[field] = value
+        if not any(field in event for field in fields):
+            continue  # Nothing measured
+        events.append(event)
+    return events
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """
+    Percentile with linear interpolation between closest ranks.
+
+    Args:
+        sorted_values: Non-empty, ascending list of values
+        q: Percentile in [0, 100]
+
+    Returns:
+        The interpolated percentile
+    """
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[int(position)]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_values(values: Iterable[float]) -> Dict[str, float]:
+    """
+    Count and percentiles of a set of measurements.
+
+    Args:
+        values: Measurements
+
+    Returns:
+        Dictionary with count, mean and p50/p90/p99
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0}
+    summary = {'count': len(ordered), 'mean': round(sum(ordered) / len(ordered), 2)}
+    for q in PERCENTILES:
+        summary[f"p{q}"] = round(percentile(ordered, q), 2)
+    return summary
+
+
+def summarize_events(events: Iterable[Dict[str, Any]], group_by: str) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Percentiles of every numeric field, grouped by an event attribute.
+
+    Args:
+        events: Normalized telemetry events
+        group_by: Event key to group on (e.g. 'clip', 'network', 'format')
+
+    Returns:
+        {group value: {field: summary}}
+    """
+    grouped: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    for event in events:
+        key = event.get(group_by)
+        if key is None:
+            continue
+        for field in CLIP_FIELDS + PAGE_FIELDS:
+            if field in event:
+                grouped[str(key)][field].append(event[field])
+    return {
+        key: {field: summarize_values(values) for field, values in fields.items()}
+        for key, fields in sorted(grouped.items())
+    }
+
+
+class TelemetryAggregator:
+    """
+    In-memory percentiles plus periodic JSONL persistence for one process.
+
+    Attributes:
+        out_dir: Directory for telemetry_<pid>.jsonl files
+        flush_interval: Minimum seconds between appends to disk
+        max_samples: Measurements kept per clip/network and field for live percentiles
+        max_keys: Clips/networks tracked per group; events of further keys are
+            aggregated under OTHER_KEY, so memory stays bounded
+    """
+
+    def __init__(self, out_dir: str, flush_interval: float = 30.0, max_samples: int = 1024,
+                 max_keys: int = MAX_KEYS):
+        self.out_dir = out_dir
+        self.flush_interval = flush_interval
+        self.max_samples = max_samples
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._samples: Dict[str, Dict[str, Dict[str, deque]]] = {
+            'clip': defaultdict(lambda: defaultdict(lambda: deque(maxlen=self.max_samples))),
+            'network': defaultdict(lambda: defaultdict(lambda: deque(maxlen=self.max_samples))),
+        }
+        self.received = 0
+
+    def add(self, events: List[Dict[str, Any]]) -> None:
+        """
+        Add normalized events and flush them to disk if the interval has passed.
+
+        Args:
+            events: Events from normalize_batch
+        """
+        now = time.time()
+        with self._lock:
+            for event in events:
+                event['ts'] = round(now, 3)
+                self._pending.append(event)
+                self.received += 1
+                for group in ('clip', 'network'):
+                    key = event.get(group)
+                    if key is None:
+                        continue
+                    if key not in self._samples[group] and len(self._samples[group]) >= self.max_keys:
+                        key = OTHER_KEY
+                    for field in CLIP_FIELDS + PAGE_FIELDS:
+                        if field in event:
+                            self._samples[group][key][field].append(event[field])
+        self.flush()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Live percentiles of this process (recent max_samples measurements per key).
+
+        Returns:
+            Dictionary {'received', 'clips': {...}, 'networks': {...}}
+        """
+        with self._lock:
+            snapshot = {
+                group: {key: {field: list(values) for field, values in fields.items()}
+                        for key, fields in keys.items()}
+                for group, keys in self._samples.items()
+            }
+            received = self.received
+        return {
+            'received': received,
+            'clips': {key: {field: summarize_values(values) for field, values in fields.items()}
+                      for key, fields in sorted(snapshot['clip'].items())},
+            'networks': {key: {field: summarize_values(values) for field, values in fields.items()}
+                         for key, fields in sorted(snapshot['network'].items())},
+        }
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Append pending events to this process's JSONL file.
+
+        Args:
+            force: Write even if the flush interval has not passed
+        """
+        with self._lock:
+            if not self._pending or (not force and time.monotonic() - self._last_flush < self.flush_interval):
+                return
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+
+        Path(self.out_dir).mkdir(parents=True, exist_ok=True)
+        path = Path(self.out_dir) / f"telemetry_{os.getpid()}.jsonl"
+        with path.open('a', encoding='utf-8') as fp:
+            fp.write(''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in pending))
+
+
+def load_telemetry(telemetry_dir: str) -> List[Dict[str, Any]]:
+    """
+    Read all telemetry JSONL files of a directory.
+
+    Args:
+        telemetry_dir: Directory with telemetry_<pid>.jsonl files
+
+    Returns:
+        List of events (malformed lines are skipped)
+    """
+    events = []
+    for path in sorted(Path(telemetry_dir).glob('telemetry_*.jsonl')):
+        with path.open('r', encoding='utf-8') as fp:
+            for line in fp:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Partially written last line
+    return events
@@ -0,0 +1,343 @@
+"""
+Utility module for pre-warming the audio clips participants are likely to request next.
+
+The first participants of a cohort would otherwise pay the cold-read cost of the
+audio mount (often a network file system). A background thread reads the clips
+of the prompts most likely to be assigned into the OS page cache, which every
+worker process shares: posix_fadvise(WILLNEED) starts readahead, and reading
+the file makes sure it is resident on mounts that ignore the hint.
+
+Likely prompts are found by running the session assignment itself
+(select_and_randomize_questions_for_session) for the next AUDIO_WARM_SESSIONS
+sessions, so quota and adaptive ordering are honoured; the remaining valid
+prompts follow in random order. The plan is made once the audio data is ready
+and again at most every AUDIO_WARM_REFRESH seconds after a session has been
+assigned, on the warming thread rather than in the assigning request; the clips
+of an assigned session are warmed first. Warmed files are tracked up to
+AUDIO_WARM_BUDGET_MB, oldest first out, and audio responses count as warm or
+cold hits in forum_audio_warm_requests_total.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Callable, Iterable, Optional
+
+from flask import Flask
+
+CHUNK_SIZE = 1 << 20  # Bytes per read while warming
+
+
+class AudioWarmer:
+    """
+    Background reader that keeps likely-requested audio files in the page cache.
+
+    Attributes:
+        budget: Bytes of audio tracked as warm
+        refresh_interval: Minimum seconds between two warming plans
+    """
+
+    def __init__(self, budget: int, refresh_interval: float = 60.0):
+        self.budget = budget
+        self.refresh_interval = refresh_interval
+        self.planned_at: Optional[float] = None
+        self._warm: 'OrderedDict[str, int]' = OrderedDict()  # Path -> size, least recently warmed first
+        self._warm_bytes = 0
+        self._queue: deque = deque()
+        self._queued: set = set()
+        self._replan: Optional[Callable[[], Any]] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        if hasattr(os, 'register_at_fork'):
+            # The warming thread of a preloading master may hold the lock at fork time
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # Threads do not survive a fork; each worker starts its own on first use
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='forum-audio-warmer', daemon=True)
+            self._thread.start()
+
+    def warm(self, paths: Iterable[str], urgent: bool = False) -> int:
+        """
+        Queue files for warming.
+
+        Args:
+            paths: File system paths
+            urgent: Warm before anything already queued (clips of an assigned session)
+
+        Returns:
+            Number of files queued
+        """
+        queued = 0
+        with self._condition:
+            for path in (reversed(list(paths)) if urgent else paths):
+                path = os.path.normpath(path)
+                if path in self._warm:
+                    self._warm.move_to_end(path)
+                    continue
+                if path in self._queued:
+                    continue
+                self._queued.add(path)
+                (self._queue.appendleft if urgent else self._queue.append)(path)
+                queued += 1
+            if queued:
+                self._ensure_thread()
+                self._condition.notify()
+        return queued
+
+    def replan(self, plan: Callable[[], Any]) -> bool:
+        """
+        Run a warming plan on the warming thread, unless one was made recently.
+
+        Args:
+            plan: Callable that queues the files to warm (e.g. warm_likely for the app)
+
+        Returns:
+            True if the plan was scheduled, False if it is not due yet
+        """
+        with self._condition:
+            if self.planned_at is not None and time.monotonic() - self.planned_at < self.refresh_interval:
+                return False
+            # Claimed now, so concurrent assignments do not schedule it again
+            self.planned_at = time.monotonic()
+            self._replan = plan
+            self._ensure_thread()
+            self._condition.notify()
+        return True
+
+    def _run(self) -> None:
+        buffer = bytearray(CHUNK_SIZE)
+        while True:
+            with self._condition:
+                while not self._queue and self._replan is None:
+                    self._condition.wait()
+                # Queued paths first: they include the clips of a just-assigned session
+                if self._queue:
+                    path, plan = self._queue.popleft(), None
+                else:
+                    path, plan, self._replan = None, self._replan, None
+            if plan is not None:
+                try:
+                    plan()
+                except Exception:
+                    pass  # Keep warming; the next plan is due after refresh_interval
+                continue
+            try:
+                size = self._read(path, buffer)
+            except OSError:
+                size = None  # Missing or unreadable; the request will report it
+            with self._condition:
+                self._queued.discard(path)
+                if size is not None and size <= self.budget:
+                    self._warm[path] = size
+                    self._warm_bytes += size
+                    while self._warm_bytes > self.budget:
+                        _, evicted = self._warm.popitem(last=False)
+                        self._warm_bytes -= evicted
+
+    @staticmethod
+    def _read(path: str, buffer: bytearray) -> int:
+        # Read the whole file once; the data itself is discarded
+        with open(path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            size = 0
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    return size
+                size += n
+
+    def is_warm(self, path: str) -> bool:
+        """
+        Whether a file has been warmed (and not dropped for the budget since).
+
+        Args:
+            path: File system path
+
+        Returns:
+            True if the file is tracked as warm
+        """
+        with self._condition:
+            return os.path.normpath(path) in self._warm
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Warmer state for /metrics; the warm-hit ratio follows from
+        forum_audio_warm_requests_total.
+
+        Returns:
+            Dictionary with warm files, warm bytes and queued files
+        """
+        with self._condition:
+            return {
+                'warm_files': len(self._warm),
+                'warm_bytes': self._warm_bytes,
+                'queued_files': len(self._queue),
+            }
+
+
+def clip_files(app: Flask, clips: Iterable[str]) -> List[tuple]:
+    """
+    Files served for clips: their pre-transcoded variants, or the original mp3.
+
+    Args:
+        app: Flask application with the audio data prepared
+        clips: Clip paths relative to the audio root, e.g. "task_1/001_gt.mp3"
+
+    Returns:
+        List of (file system path, size in bytes or None if unknown)
+    """
+    forum_config = app.config.get('FORUM', {})
+    audio_root = forum_config.get('audioRoot', 'static/audio')
+    variants_root = forum_config.get('audioVariantsRoot')
+    all_variants = app.config.get('AUDIO_VARIANTS', {})
+    audio_index = app.config.get('AUDIO_INDEX', {})
+
+    files = []
+    for clip in clips:
+        variants = all_variants.get(clip)
+        if variants and variants_root:
+            files.extend((os.path.join(variants_root, v['path']), v.get('size')) for v in variants)
+        else:
+            files.append((os.path.join(audio_root, clip), audio_index.get(clip, {}).get('size')))
+    return files
+
+
+def session_clips(session_questions: List[Dict[str, Any]]) -> List[str]:
+    """
+    Clips a session will request, in presentation order.
+
+    Args:
+        session_questions: Result of select_and_randomize_questions_for_session
+
+    Returns:
+        Clip paths relative to the audio root
+    """
+    return [
+        f"{q['audioSubfolder']}/{q['promptId']}_{tag}.mp3"
+        for q in session_questions for tag in ['prompt'] + list(q.get('models', []))
+    ]
+
+
+def likely_clips(app: Flask, sessions: int) -> List[str]:
+    """
+    Clips in the order they are likely to be requested.
+
+    Args:
+        app: Flask application with the audio data prepared
+        sessions: Number of upcoming sessions to simulate
+
+    Returns:
+        Clips of the simulated sessions, then every other clip of a valid prompt
+    """
+    from utils.loader import select_and_randomize_questions_for_session
+
+    templates = app.config.get('FORUM', {}).get('questions', [])
+    scanned = app.config.get('AUDIO_MODELS', {})
+    quota = app.extensions.get('quota')
+    quota_usage = quota.usage() if quota is not None else None
+
+    ordered: Dict[str, None] = {}
+    for _ in range(sessions):
+        questions = select_and_randomize_questions_for_session(templates, scanned, quota_usage,
+                                                               app.extensions.get('adaptive'))
+        ordered.update(dict.fromkeys(session_clips(questions)))
+
+    rest = []
+    for q_template in templates:
+        required = ['prompt'] + list(q_template.get('models', []))
+        prompts = scanned.get(q_template.get('audioSubfolder'), {})
+        for p_id, tags in prompts.items():
+            if q_template.get('n_to_present', 0) > 0 and all(tag in tags for tag in required):
+                rest.extend(f"{q_template['audioSubfolder']}/{p_id}_{tag}.mp3" for tag in required)
+    random.shuffle(rest)
+    ordered.update(dict.fromkeys(rest))
+    return list(ordered)
+
+
+def warm_likely(app: Flask) -> int:
+    """
+    Queue the likely clips that fit in the warming budget.
+
+    Args:
+        app: Flask application with its warmer
+
+    Returns:
+        Number of files queued
+    """
+    warmer = app.extensions.get('warmer')
+    if warmer is None:
+        return 0
+    warmer.planned_at = time.monotonic()
+    planned, total = [], 0
+    for path, size in clip_files(app, likely_clips(app, app.config['AUDIO_WARM_SESSIONS'])):
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+        if total + size > warmer.budget:
+            break
+        planned.append(path)
+        total += size
+    queued = warmer.warm(planned)
+    app.logger.info(f"Audio warmer: {queued} files queued ({total / 1e6:.1f} MB planned)")
+    return queued
+
+
+def _replan(app: Flask) -> None:
+    # Runs on the warming thread
+    try:
+        warm_likely(app)
+    except Exception as e:
+        app.logger.error(f"Error planning audio warming: {e}")
+
+
+def warm_after_assignment(app: Flask, session_questions: List[Dict[str, Any]]) -> None:
+    """
+    Warm the clips of a newly assigned session, and schedule a re-plan if it is time.
+
+    Only the session's own clips are looked up here; simulating the upcoming
+    sessions happens on the warming thread.
+
+    Args:
+        app: Flask application with its warmer
+        session_questions: Questions just assigned to a participant
+    """
+    warmer = app.extensions.get('warmer')
+    if warmer is None:
+        return
+    warmer.warm([path for path, _ in clip_files(app, session_clips(session_questions))], urgent=True)
+    warmer.replan(lambda: _replan(app))
+
+
+def init_warmer(app: Flask) -> Optional[AudioWarmer]:
+    """
+    Create the app's audio warmer unless AUDIO_WARM_BUDGET_MB is 0.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        The warmer, also stored as app.extensions['warmer'], or None
+    """
+    budget_mb = float(app.config['AUDIO_WARM_BUDGET_MB'] or 0)
+    if budget_mb <= 0:
+        return None
+    warmer = AudioWarmer(int(budget_mb * 1e6), app.config['AUDIO_WARM_REFRESH'])
+    app.extensions['warmer'] = warmer
+    registry = app.extensions.get('metrics')
+    if registry is not None:
+        registry.register_collector(
+            'forum_audio_warmer', 'gauge',
+            'Audio warmer state of this worker (warm_files, warm_bytes, queued_files).',
+            warmer.stats, 'stat'
+        )
+    return warmer
@@ -0,0 +1,26 @@
+"""
+WSGI entry point for production serving (see gunicorn.conf.py).
+
+The application is created at import time so that gunicorn's preload_app builds
+it once in the master process.
+
+With FORUM_STUDIES pointing to a JSON file that maps URL prefixes to per-study
+config overrides, e.g. {"/study-a": {"FORUM_CONFIG": "config/a.json"}}, all
+studies are served by the same workers (see create_multi_app).
+"""
+import json
+import os
+
+from app import create_app, create_multi_app
+
+config = {
+    'DEBUG': False,
+    'LOG_LEVEL': os.environ.get('FLASK_LOG_LEVEL', 'INFO'),
+}
+
+studies_file = os.environ.get('FORUM_STUDIES')
+if studies_file:
+    with open(studies_file, 'r', encoding='utf-8') as f:
+        app = create_multi_app(json.load(f), config)
+else:
+    app = create_app(config)